@@ -45,7 +45,7 @@ class Drawing( models.Model ):
     if self.name and not name_regex.match( self.name ):
       errors[ 'name' ] = 'Invalid'
 
-    results = parser.lint( self.script )
+    results = parser.lint_incremental( self.script )
     if results is not None:
       errors[ 'script' ] = 'invalid'
 
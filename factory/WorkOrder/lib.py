@@ -1,21 +1,33 @@
-import pickle
-import copy
+import time
+import threading
+from contextlib import contextmanager
 
 from pymongo import MongoClient
-from django.utils import timezone
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Now
 from django.conf import settings
 
-from factory.script.parser import Parser
+from factory.script.compiler import CompiledRunner
+from factory.script.parser import value_keys, function_modules
 from factory.script.runner import Runner, Pause, ExecutionError, UnrecoverableError, ParamaterError, NotDefinedError, ScriptError
 
-from factory.WorkOrder.models import WorkOrder, Job, WorkOrderException
+from factory.WorkOrder.models import WorkOrder, Job, WorkOrderException, load_ast, load_runner
 
 
 RUNNER_MODULE_LIST = []
 
 MAX_PART_LIST_SIZE = 100
 
+JOB_CREATE_BATCH_SIZE = 500  # default number of Jobs inserted at a time by createJobs
+
+JOB_RUN_TIME = 0.5        # default max seconds each job's script runs for each processJobs
+PROCESS_JOBS_TIME = 5.0   # default max seconds each processJobs spends running scripts
+
+JOB_CLAIM_BATCH_SIZE = 10  # default number of jobs processJobs locks at a time
+
 _mongo_db = None
+_workorder_cache = threading.local()
 
 
 def _connect():
@@ -27,15 +39,85 @@ def _connect():
   return _mongo_db
 
 
-def get_part_list( query, max_results ):
+def part_projection( ast ):  # the Mongo projection of the part values used by the script, None for all of them
+  if not getattr( settings, 'WORKORDER_PART_PROJECTION', True ):  # ie: API clients use all of the Job's values
+    return None
+
+  if function_modules( ast ):  # the functions of a module can get all of the values with getScriptValue
+    return None
+
+  key_set = value_keys( ast, PartPlugin.SCRIPT_NAME, 'values' )
+  if key_set is None:
+    return None
+
+  for key in key_set:
+    if not isinstance( key, str ) or not key or key.startswith( '$' ) or '.' in key:  # Mongo would take it as something other than a field name
+      return None
+
+  return dict.fromkeys( key_set, True )  # the _id is allways included
+
+
+def get_part_list( query, max_results, projection=None ):
   if not query:
     return []
 
   db = _connect()
-  part_list = list( db.find( filter=query, limit=max_results ) )
+  part_list = list( db.find( filter=query, projection=projection, limit=max_results ) )
   return part_list
 
 
+def count_parts( query, max_count ):  # stops counting at max_count
+  if not query:
+    return 0
+
+  db = _connect()
+  return db.count_documents( query, limit=max_count )
+
+
+def iter_part_batches( query, projection=None, batch_size=JOB_CREATE_BATCH_SIZE, limit=0 ):  # lists of up to batch_size parts, as they come from the cursor, at most limit parts, 0 for no limit
+  if not query:
+    return
+
+  db = _connect()
+  part_list = []
+  for part in db.find( filter=query, projection=projection, batch_size=batch_size, limit=limit ):
+    part_list.append( part )
+    if len( part_list ) >= batch_size:
+      yield part_list
+      part_list = []
+
+  if part_list:
+    yield part_list
+
+
+@contextmanager
+def workorder_cache():
+  """
+  WorkOrders loaded by WorkOrderPlugins inside this are loaded once and
+  shared, for working on many jobs in one request.
+  """
+  prev = getattr( _workorder_cache, 'map', None )
+  _workorder_cache.map = {}
+  try:
+    yield
+  finally:
+    _workorder_cache.map = prev
+
+
+def _load_workorder( workorder_pk ):
+  workorder_map = getattr( _workorder_cache, 'map', None )
+  if workorder_map is None:
+    return WorkOrder.objects.get( pk=workorder_pk )
+
+  try:
+    return workorder_map[ workorder_pk ]
+  except KeyError:
+    pass
+
+  workorder = workorder_map[ workorder_pk ] = WorkOrder.objects.get( pk=workorder_pk )
+  return workorder
+
+
 class WorkOrderPlugin( object ):
   SCRIPT_NAME = 'workorder'
 
@@ -43,11 +125,18 @@ class WorkOrderPlugin( object ):
     super().__init__()
     if isinstance( workorder, int ):
       self.workorder_pk = workorder
-      self.workorder = WorkOrder.objects.get( pk=self.workorder_pk )
+      self._workorder = None  # not loaded until the script uses it
 
     else:
-      self.workorder = workorder
-      self.workorder_pk = self.workorder.pk
+      self._workorder = workorder
+      self.workorder_pk = workorder.pk
+
+  @property
+  def workorder( self ):
+    if self._workorder is None:
+      self._workorder = _load_workorder( self.workorder_pk )
+
+    return self._workorder
 
   def getValues( self ):
     result = {}
@@ -71,10 +160,22 @@ class PartPlugin( object ):
     super().__init__()
     if isinstance( part, dict ):
       self.part = part[ '_id' ]
-      self.values = copy.deepcopy( part )
+      self._values = part
     else:
       self.part = part
-      self.values = values
+      self._values = values  # None when it is the Job's values, see bindJob, runners stored before had the values with them
+
+    self._job = None
+
+  def bindJob( self, job ):  # called by load_runner, the part's document is stored as the job's values
+    self._job = job
+
+  @property
+  def values( self ):  # the job's values are only loaded when the script uses them
+    if self._values is None and self._job is not None:
+      self._values = self._job.values
+
+    return self._values
 
   def getValues( self ):
     result = {}
@@ -88,13 +189,15 @@ class PartPlugin( object ):
 
     return result
 
-  def __reduce__( self ):
-    return ( self.__class__, ( self.part, self.values ) )
+  def __reduce__( self ):  # not the values, they are stored once, in the Job
+    return ( self.__class__, ( self.part, ) )
 
 
-def _createJob( workorder, part ):
-  parser = Parser()
-  runner = Runner( parser.parse( workorder.script ) )
+def _newJob( workorder, part, ast_hash ):  # the Job for the part, not saved
+  if getattr( settings, 'SCRIPT_RUNNER_COMPILED', False ):
+    runner = CompiledRunner( load_ast( ast_hash ), ast_hash )
+  else:
+    runner = Runner( load_ast( ast_hash ), ast_hash )
 
   for module in RUNNER_MODULE_LIST:
     runner.registerModule( module )
@@ -104,82 +207,130 @@ def _createJob( workorder, part ):
 
   job = Job( workorder=workorder, part=part[ '_id' ], values=part )
   job.state = 'new'
-  job.script_runner = pickle.dumps( runner )
-  job.full_clean()
+  job.setRunner( runner )
+
+  return job
+
+
+def createJobs( workorder, query, ast_hash, projection=None, limit=0 ):
+  """
+  Creates a Job for each part query finds, up to limit if it is not 0, a
+  batch at a time, so only one batch of the parts and Jobs are in memory at
+  once.  Returns the number of Jobs created.
+  """
+  batch_size = getattr( settings, 'JOB_CREATE_BATCH_SIZE', JOB_CREATE_BATCH_SIZE )
+  count = 0
+  for part_list in iter_part_batches( query, projection, batch_size, limit ):
+    job_list = []
+    for part in part_list:
+      job = _newJob( workorder, part, ast_hash )
+      job.full_clean( exclude=[ 'workorder' ] )  # it was just saved, checking it exists is a query for every job
+      job_list.append( job )
+
+    Job.objects.bulk_create( job_list )
+    count += len( job_list )
+
+  return count
+
+
+def _readyJobs( module_list ):  # the queued jobs that can make progress, the ones due to wake up, ie: a delay or scope max_time, waiting on an assembler module in module_list, or not waiting on anything, see Job.setRunner
+  return Job.objects.filter( Q( wake_at__lte=Now() ) | Q( pending_module__in=module_list ) | Q( wake_at__isnull=True, blocked=False, pending_module__isnull=True ), state='queued' )
+
+
+def _unlockedJobs( **kwargs ):  # the jobs matching kwargs that are not locked by another processJobs, getJobs runs in the request's transaction, so rows updated stay locked till the request is done, these are left for next time, instead of waiting on them
+  return Job.objects.filter( pk__in=Job.objects.filter( **kwargs ).select_for_update( skip_locked=True ).values( 'pk' ) )
+
+
+def _claimJobs( module_list, job_id_list ):  # lock the jobs of job_id_list that are still ready, and not locked by another processJobs, in job_id_list order
+  job_map = { job.pk: job for job in _readyJobs( module_list ).select_for_update( skip_locked=True ).filter( pk__in=job_id_list ).defer( 'values' ) }
+  return [ job_map[ pk ] for pk in job_id_list if pk in job_map ]
+
+
+def _runJob( job, module_list, time_limit ):  # run the job's script and save it, returns the task for the assembler, if there is one
+  runner = load_runner( job.script_runner, job )
+
+  if runner.aborted:
+    job.state = 'aborted'
+    job.full_clean( exclude=job.get_deferred_fields() )
+    job.save()
+    return None
+
+  if runner.done:
+    job.state = 'done'
+    job.full_clean( exclude=job.get_deferred_fields() )
+    job.save()
+    return None
+
+  task = None
+  try:
+    msg = runner.run( time_limit=time_limit )
+    if msg != 'Not Complete':  # TODO: this is ugly!! need a better way for the runner to say nothing, and/or the Interrupt to not have a user message, the job might post a message and the `is complete` system will stomp on  it
+      job.message = msg
+
+  except Pause as e:
+    job.state = 'paused'
+    job.message = str( e )[ 0:1024 ]
+
+  except ExecutionError as e:
+    job.state = 'error'
+    job.message = str( e )[ 0:1024 ]
+
+  except ( UnrecoverableError, ParamaterError, NotDefinedError, ScriptError ) as e:
+    job.state = 'aborted'
+    job.message = str( e )[ 0:1024 ]
+
+  except Exception as e:
+    job.state = 'aborted'
+    job.message = 'Unknown Runtime Exception ({0}): "{1}"'.format( type( e ).__name__, str( e ) )[ 0:1024 ]
+
+  if job.state == 'queued':
+    task = runner.toAssembler( module_list )
+    if task is not None:
+      task.update( { 'job_id': job.pk } )
+
+  job.status = runner.status
+  job.setRunner( runner )
+  job.full_clean( exclude=job.get_deferred_fields() )
   job.save()
 
+  return task
+
 
+@workorder_cache()  # the jobs of a WorkOrder all share it
 def processJobs( module_list, max_jobs=10 ):
   if max_jobs > 100:
     max_jobs = 100
 
-  # start waiting jobs
-  for job in Job.objects.select_for_update().filter( state='waiting' ):
-    job.state = 'queued'
-    job.started_at = timezone.now()
-    job.full_clean()
-    job.save()
+  job_run_time = getattr( settings, 'JOB_RUN_TIME', JOB_RUN_TIME )
+  claim_batch_size = getattr( settings, 'JOB_CLAIM_BATCH_SIZE', JOB_CLAIM_BATCH_SIZE )
+  end_at = time.monotonic() + getattr( settings, 'PROCESS_JOBS_TIME', PROCESS_JOBS_TIME )
 
-    # JobLog.started( job )
-
-  # clean up completed jobs
-  for job in Job.objects.select_for_update().filter( state='done' ):
-    job.finished_at = timezone.now()
-    job.full_clean()
-    job.save()
+  # start waiting jobs
+  _unlockedJobs( state='waiting' ).update( state='queued', started_at=Now(), updated=Now() )  # update() dosen't set the auto_now fields
+  # JobLog.started( job )
 
-    # JobLog.finished( job )
+  # clean up completed jobs, the ones not already cleaned up
+  _unlockedJobs( state='done', finished_at__isnull=True ).update( finished_at=Now(), updated=Now() )
+  # JobLog.finished( job )
 
-  # iterate over the curent jobs
+  # iterate over the curent jobs, each one that is run is saved, moving it to the end of the order, so the jobs not got to are first next time
+  # the jobs are claimed a batch at a time, each in it's own savepoint, jobs another processJobs has claimed are skipped, so concurrent getJobs don't wait on each other
+  job_id_list = list( _readyJobs( module_list ).order_by( 'updated' ).values_list( 'pk', flat=True ) )
   results = []
-  for job in Job.objects.select_for_update().filter( state='queued' ).order_by( 'updated' ):
-    runner = pickle.loads( job.script_runner )
-
-    if runner.aborted:
-      job.state = 'aborted'
-      job.full_clean()
-      job.save()
-      continue
-
-    if runner.done:
-      job.state = 'done'
-      job.full_clean()
-      job.save()
-      continue
-
-    try:
-      msg = runner.run()
-      if msg != 'Not Complete':  # TODO: this is ugly!! need a better way for the runner to say nothing, and/or the Interrupt to not have a user message, the job might post a message and the `is complete` system will stomp on  it
-        job.message = msg
-
-    except Pause as e:
-      job.state = 'paused'
-      job.message = str( e )[ 0:1024 ]
-
-    except ExecutionError as e:
-      job.state = 'error'
-      job.message = str( e )[ 0:1024 ]
-
-    except ( UnrecoverableError, ParamaterError, NotDefinedError, ScriptError ) as e:
-      job.state = 'aborted'
-      job.message = str( e )[ 0:1024 ]
-
-    except Exception as e:
-      job.state = 'aborted'
-      job.message = 'Unknown Runtime Exception ({0}): "{1}"'.format( type( e ).__name__, str( e ) )[ 0:1024 ]
-
-    if job.state == 'queued':
-      task = runner.toAssembler( module_list )
-      if task is not None:
-        task.update( { 'job_id': job.pk } )
-        results.append( task )
-
-    job.status = runner.status
-    job.script_runner = pickle.dumps( runner )
-    job.full_clean()
-    job.save()
-
-    if len( results ) >= max_jobs:
+  for i in range( 0, len( job_id_list ), claim_batch_size ):
+    with transaction.atomic():
+      for job in _claimJobs( module_list, job_id_list[ i:i + claim_batch_size ] ):
+        time_left = end_at - time.monotonic()
+        if time_left <= 0:
+          break
+
+        task = _runJob( job, module_list, min( job_run_time, time_left ) )
+        if task is not None:
+          results.append( task )
+          if len( results ) >= max_jobs:
+            break
+
+    if len( results ) >= max_jobs or time.monotonic() >= end_at:
       break
 
   return results
@@ -190,12 +341,12 @@ def processJobs( module_list, max_jobs=10 ):
 #   the job till it is pickled and saved
 def jobResults( job_id, cookie, data ):
   try:
-    job = Job.objects.select_for_update().get( pk=job_id )
+    job = Job.objects.select_for_update().defer( 'values' ).get( pk=job_id )
   except Job.DoesNotExist:
     raise WorkOrderException( 'JOB_NOT_FOUND', 'Error saving job results: "Job Not Found"' )
 
   # TODO: check the curent job state to make sure we don't undo something with the job.status = runner.status
-  runner = pickle.loads( job.script_runner )
+  runner = load_runner( job.script_runner, job )
   ( result, message ) = runner.fromAssembler( cookie, data )
   if result != 'Accepted':  # it wasn't valid/taken, no point in saving anything
     raise WorkOrderException( 'INVALID_RESULT', 'Error saving job results: "{0}"'.format( result ) )
@@ -205,8 +356,8 @@ def jobResults( job_id, cookie, data ):
     job.message = ''
   else:
     job.message = message
-  job.script_runner = pickle.dumps( runner )
-  job.full_clean()
+  job.setRunner( runner )
+  job.full_clean( exclude=job.get_deferred_fields() )
   job.save()
 
   return result
@@ -219,7 +370,7 @@ def jobError( job_id, cookie, msg ):
     raise WorkOrderException( 'JOB_NOT_FOUND', 'Error setting job to error: "Job Not Found"' )
 
   job = job.realJob
-  runner = pickle.loads( job.script_runner )
+  runner = load_runner( job.script_runner, job )
   if cookie != runner.assembler_cookie:  # we do our own out of bad cookie check b/c this type of error dosen't need to be propagated to the script runner
     raise WorkOrderException( 'BAD_COOKIE', 'Error setting job to error: "Bad Cookie"' )
 
@@ -0,0 +1,146 @@
+import pytest
+import threading
+from datetime import datetime, timedelta, timezone
+
+from django.db import connection, connections, transaction
+
+from factory.WorkOrder import lib
+from factory.script.parser import parse
+from factory.WorkOrder.models import WorkOrder, Job, store_ast
+from factory.WorkOrder.lib import _newJob, _claimJobs, processJobs, part_projection
+
+SCRIPT = 'delay( seconds=600 )'  # once run, the job waits on the delay, and is not ready again until it is up
+REMOTE_SCRIPT = 'testing.remote()'  # once run, the job waits on the assembler
+PLUGIN_MODULE = 'factory.script.runner_plugins_test'
+
+
+def test_part_projection( settings ):
+  assert part_projection( parse( 'aa = part.values[ "name" ]\nbb = part.values[ "size" ]' ) ) == { 'name': True, 'size': True }
+  assert part_projection( parse( 'aa = part.values' ) ) is None
+  assert part_projection( parse( 'aa = part.values[ "$where" ]' ) ) is None
+  assert part_projection( parse( 'aa = part.values[ "name" ]\ntesting.remote()' ) ) is None  # the function can get all of the values
+  settings.WORKORDER_PART_PROJECTION = False
+  assert part_projection( parse( 'aa = part.values[ "name" ]' ) ) is None
+
+
+def _workorder( script=SCRIPT ):
+  workorder = WorkOrder( user='test', name='test', script=script, part_query='{}', execution_style='parallel', started_at=datetime.now( timezone.utc ) )
+  workorder.save()
+
+  return workorder
+
+
+def _jobs( workorder, state_list ):  # a Job in each state of state_list, in order
+  ast_hash = store_ast( workorder.script )
+  job_list = []
+  for i, state in enumerate( state_list ):
+    job = _newJob( workorder, { '_id': 'part{0}'.format( i ), 'name': 'part {0}'.format( i ) }, ast_hash )
+    job.state = state
+    job_list.append( job )
+
+  Job.objects.bulk_create( job_list )
+
+  return list( Job.objects.filter( workorder=workorder ).order_by( 'pk' ) )
+
+
+@pytest.mark.django_db
+def test_process_jobs_transitions( settings ):
+  settings.PROCESS_JOBS_TIME = 5.0
+  finished_at = datetime( 2020, 1, 1, tzinfo=timezone.utc )
+  workorder = _workorder()
+  job_list = _jobs( workorder, [ 'waiting', 'waiting', 'done', 'done', 'paused', 'new' ] )
+  Job.objects.filter( pk=job_list[3].pk ).update( finished_at=finished_at )
+
+  assert processJobs( [], 10 ) == []
+
+  job_list = [ Job.objects.get( pk=job.pk ) for job in job_list ]
+  for job in job_list[ 0:2 ]:  # started, and run till the delay
+    assert job.state == 'queued'
+    assert job.started_at is not None
+    assert job.wake_at is not None
+    assert job.wake_at > datetime.now( timezone.utc )
+
+  assert job_list[2].state == 'done'
+  assert job_list[2].finished_at is not None
+  assert job_list[3].finished_at == finished_at  # allready cleaned up, left alone
+  assert job_list[4].state == 'paused'
+  assert job_list[4].started_at is None
+  assert job_list[5].state == 'new'
+  assert job_list[5].finished_at is None
+
+  updated = job_list[2].updated
+  assert processJobs( [], 10 ) == []  # nothing is ready, the delay is not up
+  assert Job.objects.get( pk=job_list[2].pk ).updated == updated
+  assert [ job.wake_at for job in Job.objects.filter( pk__in=[ job_list[0].pk, job_list[1].pk ] ).order_by( 'pk' ) ] == [ job_list[0].wake_at, job_list[1].wake_at ]
+
+
+@pytest.mark.django_db
+def test_claim_jobs():
+  now = datetime.now( timezone.utc )
+  job_list = _jobs( _workorder(), [ 'queued' ] * 7 + [ 'paused' ] )
+  Job.objects.filter( pk=job_list[1].pk ).update( blocked=True )
+  Job.objects.filter( pk=job_list[2].pk ).update( pending_module='other' )
+  Job.objects.filter( pk=job_list[3].pk ).update( pending_module='other', wake_at=now - timedelta( seconds=1 ) )  # woken, ie: for a scope max_time, even if no one has it's module
+  Job.objects.filter( pk=job_list[4].pk ).update( wake_at=now + timedelta( seconds=60 ) )
+  Job.objects.filter( pk=job_list[6].pk ).update( pending_module='other', wake_at=now + timedelta( seconds=60 ) )  # pending inside a scope max_time, an assembler with it's module can still move it along
+  id_list = [ job.pk for job in job_list ]
+
+  with transaction.atomic():
+    assert [ job.pk for job in _claimJobs( [], id_list ) ] == [ id_list[0], id_list[3], id_list[5] ]
+    assert [ job.pk for job in _claimJobs( [ 'other' ], list( reversed( id_list ) ) ) ] == [ id_list[6], id_list[5], id_list[3], id_list[2], id_list[0] ]  # in the order asked for
+    assert [ job.pk for job in _claimJobs( [ 'other' ], id_list[ 1:3 ] ) ] == [ id_list[2] ]
+    assert _claimJobs( [], [] ) == []
+
+
+@pytest.mark.django_db
+def test_process_jobs_batches( settings, monkeypatch ):
+  settings.JOB_CLAIM_BATCH_SIZE = 2
+  settings.PROCESS_JOBS_TIME = 5.0
+  monkeypatch.setattr( lib, 'RUNNER_MODULE_LIST', [ PLUGIN_MODULE ] )
+  job_list = _jobs( _workorder( REMOTE_SCRIPT ), [ 'waiting' ] * 5 )
+
+  task_list = processJobs( [ 'testing' ], 3 )  # stops part way through the second batch
+  assert len( task_list ) == 3
+  assert len( set( task[ 'job_id' ] for task in task_list ) ) == 3
+  assert Job.objects.filter( blocked=True ).count() == 3
+
+  task_list2 = processJobs( [ 'testing' ], 10 )  # the rest, the blocked ones are not ready
+  assert sorted( task[ 'job_id' ] for task in task_list + task_list2 ) == [ job.pk for job in job_list ]
+  assert processJobs( [ 'testing' ], 10 ) == []
+
+  job_list = _jobs( _workorder( REMOTE_SCRIPT ), [ 'waiting' ] * 3 )
+  assert processJobs( [], 10 ) == []  # run, but no assembler has the module
+  assert set( Job.objects.filter( pk__in=[ job.pk for job in job_list ] ).values_list( 'pending_module', 'blocked' ) ) == set( [ ( 'testing', False ) ] )
+  assert len( processJobs( [ 'testing' ], 10 ) ) == 3
+
+
+@pytest.mark.django_db( transaction=True )
+def test_process_jobs_locked( settings ):  # the jobs another getJobs has locked are skipped, not waited on
+  if not connection.features.has_select_for_update_skip_locked:
+    pytest.skip( 'database does not skip locked rows' )
+
+  settings.PROCESS_JOBS_TIME = 5.0
+  job_list = _jobs( _workorder(), [ 'waiting', 'waiting', 'done' ] )
+  result_list = []
+
+  def get_jobs():
+    try:
+      with transaction.atomic():  # as the API server does for each request
+        result_list.append( processJobs( [], 10 ) )
+    finally:
+      connections.close_all()
+
+  with transaction.atomic():
+    list( Job.objects.select_for_update().filter( pk__in=[ job_list[0].pk, job_list[2].pk ] ) )  # as if another getJobs is working on them
+    thread = threading.Thread( target=get_jobs )
+    thread.start()
+    thread.join( 10 )
+    assert not thread.is_alive()
+
+  assert result_list == [ [] ]
+  assert [ Job.objects.get( pk=job.pk ).state for job in job_list ] == [ 'waiting', 'queued', 'done' ]
+  assert Job.objects.get( pk=job_list[2].pk ).finished_at is None
+
+  processJobs( [], 10 )  # next time they are not locked
+  assert [ Job.objects.get( pk=job.pk ).state for job in job_list ] == [ 'queued', 'queued', 'done' ]
+  assert Job.objects.get( pk=job_list[2].pk ).finished_at is not None
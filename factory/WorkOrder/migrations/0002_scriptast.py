@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('WorkOrder', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScriptAST',
+            fields=[
+                ('script_hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('ast', models.BinaryField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('WorkOrder', '0002_scriptast'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='blocked',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='wake_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['state', 'blocked', 'wake_at'], name='WorkOrder_job_ready'),
+        ),
+    ]
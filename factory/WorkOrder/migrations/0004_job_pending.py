@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('WorkOrder', '0003_job_ready'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='pending_module',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='pending_function',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['state', 'pending_module'], name='WorkOrder_job_module'),
+        ),
+    ]
@@ -1,4 +1,10 @@
+import time
 import pickle
+import datetime
+import logging
+import threading
+from collections import OrderedDict
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 from django.core.exceptions import ValidationError
@@ -7,9 +13,13 @@ from cinp.orm_django import DjangoCInP as CInP
 
 from factory.fields import MapField, JSONField
 from factory.Plan.models import Drawing
+from factory.script.parser import parse_cached, script_hash
+from factory.script.runner import TRACE_OFF, TRACE_RUN, TRACE_STEP
+from factory.script import serializer
 
 PICKLE_PROTOCOL = 4
-MAX_TARGET_PARTS = 100
+AST_LRU_SIZE = 50
+MAX_TARGET_PARTS = 100  # default, see settings.WORKORDER_MAX_PARTS
 WORKORDER_EXECUTION_STYLE_CHOICES = ( 'parallel', 'serial' )
 JOB_STATE_CHOICES = ( 'new', 'queued', 'waiting', 'done', 'paused', 'error', 'aborted' )
 
@@ -62,14 +72,14 @@ class WorkOrder( models.Model ):
     workorder.save()
 
     if part_query:
-      from factory.WorkOrder.lib import get_part_list, _createJob
+      from factory.WorkOrder.lib import count_parts, part_projection, createJobs
 
-      part_list = get_part_list( part_query, MAX_TARGET_PARTS + 1 )
-      if len( part_list ) > MAX_TARGET_PARTS:
-        raise WorkOrderException( 'TO_MANY_PARTS', 'The party query returned to many parts, max: {0}'.format( MAX_TARGET_PARTS ) )
+      max_parts = getattr( settings, 'WORKORDER_MAX_PARTS', MAX_TARGET_PARTS )
+      if count_parts( part_query, max_parts + 1 ) > max_parts:
+        raise WorkOrderException( 'TO_MANY_PARTS', 'The party query returned to many parts, max: {0}'.format( max_parts ) )
 
-      for part in part_list:
-        _createJob( workorder, part )
+      ast_hash = store_ast( workorder.script )  # every job runs the same script, only parse and store it once
+      createJobs( workorder, part_query, ast_hash, part_projection( load_ast( ast_hash ) ), max_parts )  # only the part values the script uses, and no more than were counted, in case more were added since
 
     return workorder
 
@@ -178,9 +188,21 @@ class Job( models.Model ):
   script_runner = models.BinaryField( editable=False )
   started_at = models.DateTimeField( blank=True, null=True )
   finished_at = models.DateTimeField( blank=True, null=True )
+  blocked = models.BooleanField( editable=False, default=False )  # see setRunner
+  wake_at = models.DateTimeField( editable=False, blank=True, null=True )
+  pending_module = models.CharField( max_length=100, editable=False, blank=True, null=True )
+  pending_function = models.CharField( max_length=100, editable=False, blank=True, null=True )
   updated = models.DateTimeField( editable=False, auto_now=True )
   created = models.DateTimeField( editable=False, auto_now_add=True )
 
+  # not called via API
+  def setRunner( self, runner ):  # store the runner, and when it can next make progress, processJobs only runs the jobs that can
+    self.script_runner = dump_runner( runner )
+    self.blocked = runner.blocked
+    wake_at = runner.wake_at
+    self.wake_at = None if wake_at is None else wake_at.replace( tzinfo=datetime.timezone.utc )  # the runner's times are naive utc
+    ( self.pending_module, self.pending_function ) = runner.pending or ( None, None )
+
   @cinp.action()
   def pause( self ):
     """
@@ -222,10 +244,10 @@ class Job( models.Model ):
     if self.state != 'error':
       raise WorkOrderException( 'NOT_ERRORED', 'Can only reset a job if it is in error' )
 
-    runner = pickle.loads( self.script_runner )
+    runner = load_runner( self.script_runner, self )
     runner.clearDispatched()
     self.status = runner.status
-    self.script_runner = pickle.dumps( runner, protocol=PICKLE_PROTOCOL )
+    self.setRunner( runner )
 
     self.state = 'queued'
     self.full_clean()
@@ -242,13 +264,13 @@ class Job( models.Model ):
     if self.state != 'error':
       raise WorkOrderException( 'NOT_ERRORED', 'Can only rollback a job if it is in error' )
 
-    runner = pickle.loads( self.script_runner )
+    runner = load_runner( self.script_runner, self )
     msg = runner.rollback()
     if msg != 'Done':
       raise ValueError( 'Unable to rollback "{0}"'.format( msg ) )
 
     self.status = runner.status
-    self.script_runner = pickle.dumps( runner, protocol=PICKLE_PROTOCOL )
+    self.setRunner( runner )
     self.state = 'queued'
     self.full_clean()
     self.save()
@@ -265,10 +287,10 @@ class Job( models.Model ):
     if self.state != 'queued':
       raise WorkOrderException( 'NOT_ERRORED', 'Can only clear the dispatched flag a job if it is in queued state' )
 
-    runner = pickle.loads( self.script_runner )
+    runner = load_runner( self.script_runner, self )
     runner.clearDispatched()
     self.status = runner.status
-    self.script_runner = pickle.dumps( runner, protocol=PICKLE_PROTOCOL )
+    self.setRunner( runner )
 
     self.full_clean()
     self.save()
@@ -287,7 +309,7 @@ class Job( models.Model ):
     Returns variables internal to the job script
     """
     result = {}
-    runner = pickle.loads( self.script_runner )
+    runner = load_runner( self.script_runner, self )
 
     for module in runner.value_map:
       for name in runner.value_map[ module ]:
@@ -303,21 +325,53 @@ class Job( models.Model ):
     Returns the state of the job script
     """
     result = {}
-    runner = pickle.loads( self.script_runner )
+    runner = load_runner( self.script_runner, self )
     result[ 'script' ] = self.workorder.script
     result[ 'cur_line' ] = runner.cur_line
-    result[ 'state' ] = runner.state
+    if isinstance( runner.state, list ):
+      result[ 'state' ] = [ repr( frame ) for frame in runner.state ]
+    else:
+      result[ 'state' ] = runner.state
 
     return result
 
+  @cinp.action( paramater_type_list=[ { 'type': 'String', 'choices': ( 'off', 'run', 'step' ) } ] )
+  def setTrace( self, level ):
+    """
+    Sets the trace level of the job script, 'run' records the start and
+    end of each run, 'step' also records every step of the script and is
+    expensive, only use it to debug a script.  Setting the level to 'off'
+    discards the trace.
+    """
+    runner = load_runner( self.script_runner, self )
+    if level == 'off':
+      runner.disableTrace()
+    else:
+      runner.enableTrace( { 'run': TRACE_RUN, 'step': TRACE_STEP }[ level ] )
+
+    self.setRunner( runner )
+    self.full_clean()
+    self.save()
+
+  @cinp.action( return_type={ 'type': 'Map', 'is_array': True } )
+  def jobRunnerTrace( self ):
+    """
+    Returns the trace of the job script, oldest first
+    """
+    runner = load_runner( self.script_runner, self )
+    if runner.trace_level == TRACE_OFF:
+      return []
+
+    return [ { 'timestamp': item[0].isoformat(), 'line': item[1], 'event': item[2], 'detail': str( item[3] ) } for item in runner.trace ]
+
   @cinp.action( return_type='String', paramater_type_list=[ 'String' ] )
   def signalComplete( self, cookie ):
-    runner = pickle.loads( self.script_runner )
+    runner = load_runner( self.script_runner, self )
 
     for entry in runner.object_list:
       if entry.__class__.__name__ == 'SignalingPlugin':
         result = entry.signal( cookie )
-        self.script_runner = pickle.dumps( runner, protocol=PICKLE_PROTOCOL )
+        self.setRunner( runner )
         self.full_clean()
         self.save()
         return result
@@ -364,6 +418,85 @@ class Job( models.Model ):
                     ( 'can_base_job', 'Can Work With Base Jobs' ),
                     ( 'can_job_signal', 'Can call the Job Signalling Actions' )
                   )
+    indexes = [  # the jobs processJobs can run
+                models.Index( fields=[ 'state', 'blocked', 'wake_at' ], name='WorkOrder_job_ready' ),
+                models.Index( fields=[ 'state', 'pending_module' ], name='WorkOrder_job_module' )
+              ]
 
   def __str__( self ):
     return 'Job #{0} for "{1}"'.format( self.pk, self.workorder.pk )
+
+
+class ScriptAST( models.Model ):  # internal, not exposed via the API
+  """
+  Compiled ASTs of job scripts, keyed by the hash of the script text and the
+  parser's AST_VERSION, see script_hash.  The job runners reference the AST in here instead of carrying a copy of it.
+  """
+  script_hash = models.CharField( max_length=64, primary_key=True )
+  ast = models.BinaryField( editable=False )
+  created = models.DateTimeField( editable=False, auto_now_add=True )
+
+  def __str__( self ):
+    return 'ScriptAST "{0}"'.format( self.script_hash )
+
+
+_ast_lru = OrderedDict()
+_ast_lru_lock = threading.Lock()
+
+
+def _ast_lru_put( ast_hash, ast ):
+  with _ast_lru_lock:
+    _ast_lru[ ast_hash ] = ast
+    while len( _ast_lru ) > AST_LRU_SIZE:
+      _ast_lru.popitem( last=False )
+
+
+def store_ast( script ):
+  """
+  Parse script and make sure the AST is in the ScriptAST table, returns the
+  hash of the script and AST_VERSION, which is the key to get the AST with load_ast
+  """
+  ast_hash = script_hash( script )
+  ast = parse_cached( script )  # the row is checked every time, even if the AST is in the LRU, the transaction that stored it may have been rolled back
+  ( script_ast, created ) = ScriptAST.objects.get_or_create( script_hash=ast_hash, defaults={ 'ast': pickle.dumps( ast, protocol=PICKLE_PROTOCOL ) } )
+  if not created:  # the stored AST is the one load_ast returns, keep the same one in the LRU
+    ast = pickle.loads( script_ast.ast )
+
+  _ast_lru_put( ast_hash, ast )
+
+  return ast_hash
+
+
+def load_ast( ast_hash ):
+  """
+  Returns the AST for ast_hash, the AST is shared by all the runners in this
+  process, it must not be modified.
+  """
+  with _ast_lru_lock:
+    try:
+      _ast_lru.move_to_end( ast_hash )
+      return _ast_lru[ ast_hash ]
+    except KeyError:
+      pass
+
+  ast = pickle.loads( ScriptAST.objects.get( pk=ast_hash ).ast )
+  _ast_lru_put( ast_hash, ast )
+
+  return ast
+
+
+def dump_runner( runner ):
+  return serializer.dump_runner( runner, getattr( settings, 'RUNNER_COMPRESSION', 'zlib' ), getattr( settings, 'RUNNER_COMPRESS_SIZE', serializer.COMPRESS_SIZE ) )
+
+
+def load_runner( blob, job=None ):
+  start = time.perf_counter()
+  runner = serializer.load_runner( blob, load_ast )
+  if job is not None:
+    for obj in runner.object_list:  # objects that keep something in the job instead of the runner, ie: the PartPlugin's values
+      if hasattr( obj, 'bindJob' ):
+        obj.bindJob( job )
+
+  logging.debug( 'load_runner: job %s restored from %s bytes in %.1f us', job.pk if job is not None else None, len( blob ), ( time.perf_counter() - start ) * 1000000 )
+
+  return runner
@@ -0,0 +1,679 @@
+import copy
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+
+from factory.script.parser import Types
+from factory.script.values import ScriptList, ScriptMap, share, detached
+from factory.script.frame import NO_VALUE, ScopeFrame, FunctionFrame, ExistsFrame
+from factory.script.runner import Runner, TRACE_STEP, Pause, Goto, ParamaterError, NotDefinedError, UnrecoverableError, _debugDump, _is_item_paramater, infix_string_operator_map, infix_math_operator_map, infix_logical_operator_map
+
+"""
+Compiles the AST into a flat list of instructions run by CompiledRunner.
+
+Each instruction is a tuple of ( op function, arguments... ), the op function
+is called with ( runner, instruction, pc ) and returns the pc of the next
+instruction to run.  Values are passed between instructions on the runner's
+value stack, blocks that need to keep something across a pause (scope
+timing, function handlers, exists) push a frame on runner.state.  Resuming
+a paused script is a jump to runner.pc, there is no walking back down the AST.
+
+An instruction that raises leaves runner.pc on itself, so it is run again
+when the script is resumed, instructions that can raise a resumable error
+(Pause, ExecutionError, Interrupt) must not have changed the value stack
+before raising.
+"""
+
+PROGRAM_VERSION = 1  # bump when a change to the compiler changes the code of a Program, the stored pc and stack of a CompiledRunner only work with the same code
+PROGRAM_CACHE_SIZE = 50
+
+_program_cache = OrderedDict()
+_program_cache_lock = threading.Lock()
+
+
+def compile_ast( ast, ast_hash=None ):  # if ast_hash is not None the Program is cached by it
+  if ast_hash is None:
+    return Program( ast )
+
+  with _program_cache_lock:
+    try:
+      _program_cache.move_to_end( ast_hash )
+      return _program_cache[ ast_hash ]
+    except KeyError:
+      pass
+
+  program = Program( ast )
+
+  with _program_cache_lock:
+    _program_cache[ ast_hash ] = program
+    while len( _program_cache ) > PROGRAM_CACHE_SIZE:
+      _program_cache.popitem( last=False )
+
+  return program
+
+
+def _op_line( runner, op, pc ):
+  runner.cur_line = op[1]
+  return pc + 1
+
+
+def _op_scope( runner, op, pc ):
+  now = datetime.datetime.utcnow()
+  if op[1] is None:
+    runner.state.append( ScopeFrame( 0, now ) )
+  else:
+    runner.state.append( ScopeFrame( 0, now, op[1] + now ) )
+
+  return pc + 1
+
+
+def _op_scope_end( runner, op, pc ):
+  runner.state.pop()
+  return pc + 1
+
+
+def _op_nop( runner, op, pc ):
+  return pc + 1
+
+
+def _op_pop( runner, op, pc ):
+  runner.stack.pop()
+  return pc + 1
+
+
+def _op_constant( runner, op, pc ):
+  runner.stack.append( op[1] )
+  return pc + 1
+
+
+def _op_variable( runner, op, pc ):
+  try:
+    runner.stack.append( runner.variable_map[ op[1] ] )
+  except KeyError:
+    raise NotDefinedError( op[1], runner.cur_line )
+
+  return pc + 1
+
+
+def _op_module_variable( runner, op, pc ):
+  ( _, module_name, name ) = op
+  try:
+    module = runner.value_map[ module_name ]
+  except KeyError:
+    raise NotDefinedError( module_name, runner.cur_line )
+
+  try:
+    getter = module[ name ][0]  # index 0 is the getter
+  except KeyError:
+    raise NotDefinedError( '{0}" of module "{1}'.format( name, module_name ), runner.cur_line )
+
+  if getter is None:
+    raise ParamaterError( 'target', '"{0}" of module "{1}" is not gettable'.format( name, module_name ), runner.cur_line )
+
+  try:
+    value = getter()
+  except Exception as e:
+    _debugDump( 'getter "{0}" in module "{1}" error during setup on line "{2}"'.format( name, module_name, runner.cur_line ), e, runner.ast, runner.state )
+    raise UnrecoverableError( 'getter "{0}" in module "{1}" error during setup on line "{2}": "{3}"({4})'.format( name, module_name, runner.cur_line, str( e ), e.__class__.__name__) )
+
+  runner.stack.append( value )
+  return pc + 1
+
+
+def _op_array( runner, op, pc ):
+  stack = runner.stack
+  if op[1]:
+    value = ScriptList( map( share, stack[ -op[1]: ] ) )
+    del stack[ -op[1]: ]
+  else:
+    value = ScriptList()
+
+  stack.append( value )
+  return pc + 1
+
+
+def _op_map( runner, op, pc ):
+  stack = runner.stack
+  key_list = op[1]
+  if key_list:
+    value = ScriptMap( zip( key_list, map( share, stack[ -len( key_list ): ] ) ) )
+    del stack[ -len( key_list ): ]
+  else:
+    value = ScriptMap()
+
+  stack.append( value )
+  return pc + 1
+
+
+def _op_array_map_item( runner, op, pc ):
+  ( _, module_name, name ) = op
+  index = runner.stack.pop()
+
+  if module_name is None:
+    try:
+      value = runner.variable_map[ name ]
+    except KeyError:
+      raise NotDefinedError( name, runner.cur_line )
+
+  else:
+    try:
+      module = runner.value_map[ module_name ]
+    except KeyError:
+      raise NotDefinedError( module_name, runner.cur_line )
+
+    try:
+      getter = module[ name ][0]  # index 0 is the getter
+    except KeyError:
+      raise NotDefinedError( '{0}" of "{1}'.format( module_name, name ), runner.cur_line )
+
+    if getter is None:
+      raise ParamaterError( 'target', '"{0}" of "{1}" is not gettable'.format( module_name, name ), runner.cur_line )
+
+    try:
+      value = getter()
+    except Exception as e:
+      _debugDump( 'getter "{0}" in module "{1}" error during setup on line "{2}"'.format( name, module_name, runner.cur_line ), e, runner.ast, runner.state )
+      raise UnrecoverableError( 'getter "{0}" in module "{1}" error during setup on line "{2}": "{3}"({4})'.format( name, module_name, runner.cur_line, str( e ), e.__class__.__name__) )
+
+  try:
+    value = value[ index ]
+  except ( IndexError, KeyError ):
+    raise NotDefinedError( 'Index/Key does not exist', runner.cur_line )
+
+  runner.stack.append( value )
+  return pc + 1
+
+
+def _op_item_paramater( runner, op, pc ):  # an array/map item paramater that the builtin changes in place, leaves ( value, index ) for _op_function
+  index = runner.stack[ -1 ]
+  pc = _op_array_map_item( runner, op, pc )
+  runner.stack.append( ( runner.stack.pop(), index ) )
+  return pc
+
+
+def _op_assign_invalid( runner, op, pc ):
+  raise ParamaterError( 'target', 'Can only assign to variables', runner.cur_line )
+
+
+def _op_assign( runner, op, pc ):
+  runner.variable_map[ op[1] ] = share( runner.stack.pop() )
+  return pc + 1
+
+
+def _op_assign_item( runner, op, pc ):
+  value = share( runner.stack.pop() )
+  index = runner.stack.pop()
+  runner._ownVariable( op[1] )[ index ] = value
+  return pc + 1
+
+
+def _op_assign_module( runner, op, pc ):
+  ( _, module_name, name ) = op
+  value = copy.deepcopy( runner.stack.pop() )  # the module gets it's own copy
+
+  try:
+    module = runner.value_map[ module_name ]
+  except KeyError:
+    raise NotDefinedError( module_name, runner.cur_line )
+
+  try:
+    setter = module[ name ][1]  # index 1 is the setter
+  except KeyError:
+    raise NotDefinedError( '{0}" of "{1}'.format( module_name, name ), runner.cur_line )
+
+  if setter is None:
+    raise ParamaterError( 'target', '"{0}" of "{1}" is not settable'.format( module_name, name ), runner.cur_line )
+
+  try:
+    setter( detached( value ) )
+  except Exception as e:
+    _debugDump( 'setter "{0}" in module "{1}" error on line "{2}"'.format( name, module_name, runner.cur_line ), e, runner.ast, runner.state )
+    raise UnrecoverableError( 'setter "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( name, module_name, runner.cur_line, str( e ), e.__class__.__name__) )
+
+  return pc + 1
+
+
+def _op_infix_string( runner, op, pc ):
+  stack = runner.stack
+  right_val = stack.pop()
+  left_val = stack.pop()
+  if not isinstance( left_val, str ):
+    left_val = str( left_val )
+  if not isinstance( right_val, str ):
+    right_val = str( right_val )
+
+  stack.append( op[1]( left_val, right_val ) )
+  return pc + 1
+
+
+def _op_infix_math( runner, op, pc ):
+  stack = runner.stack
+  right_val = stack.pop()
+  left_val = stack.pop()
+  if not isinstance( left_val, ( int, float, bool ) ):
+    raise ParamaterError( 'left of operator', 'must be numeric', runner.cur_line )
+  if not isinstance( right_val, ( int, float, bool ) ):
+    raise ParamaterError( 'right of operator', 'must be numeric', runner.cur_line )
+
+  stack.append( op[1]( left_val, right_val ) )
+  return pc + 1
+
+
+def _op_infix_logical( runner, op, pc ):
+  stack = runner.stack
+  right_val = stack.pop()
+  stack[ -1 ] = op[1]( stack[ -1 ], right_val )
+  return pc + 1
+
+
+def _op_infix_unknown( runner, op, pc ):
+  del runner.stack[ -2: ]
+  raise NotDefinedError( op[1], runner.cur_line )
+
+
+def _op_function( runner, op, pc ):
+  ( _, op_data, key_list, item_key ) = op
+  if not runner.state or runner.state[ -1 ].op_type != Types.FUNCTION:  # first time here, move the paramaters into the function's frame, from here on this can be re-run
+    stack = runner.stack
+    if key_list:
+      paramaters = dict( zip( key_list, stack[ -len( key_list ): ] ) )
+      del stack[ -len( key_list ): ]
+    else:
+      paramaters = {}
+
+    frame = FunctionFrame( paramaters )
+    if item_key is not None:
+      ( paramaters[ item_key ], frame.item_index ) = paramaters[ item_key ]
+
+    runner.state.append( frame )
+
+  else:
+    frame = runner.state[ -1 ]
+
+  if frame.value is not NO_VALUE:  # function allready executed and was an Exception last time
+    value = None
+
+  else:
+    value = runner._functionValue( op_data, frame )
+    if isinstance( value, Exception ):
+      frame.paramaters = None
+      frame.handler = None
+      frame.dispatched = None
+      frame.value = None
+      raise value
+
+  runner.state.pop()
+  runner.stack.append( value )
+  return pc + 1
+
+
+def _op_jump( runner, op, pc ):
+  return op[1]
+
+
+def _op_jump_false( runner, op, pc ):
+  if not runner.stack.pop():
+    return op[1]
+
+  return pc + 1
+
+
+def _op_exists( runner, op, pc ):
+  runner.state.append( ExistsFrame( op[1], len( runner.stack ) ) )  # op[1] is where to go if it dosen't exist
+  return pc + 1
+
+
+def _op_exists_end( runner, op, pc ):
+  runner.state.pop()
+  runner.stack[ -1 ] = True
+  return pc + 1
+
+
+def _op_goto( runner, op, pc ):
+  raise Goto( op[1], runner.cur_line )
+
+
+def _op_no_value( runner, op, pc ):
+  raise UnrecoverableError( '"{0}" does not return a value, on line {1}'.format( op[1], runner.cur_line ) )
+
+
+# the value returning types, when they are used as a line, the value needs to be poped off
+_VALUE_TYPE_LIST = ( Types.CONSTANT, Types.VARIABLE, Types.ARRAY, Types.MAP, Types.ARRAY_MAP_ITEM, Types.INFIX, Types.FUNCTION, Types.EXISTS )
+
+
+class Program( object ):
+  def __init__( self, ast ):
+    super().__init__()
+    self.code = []            # list of the instructions
+    self.path_list = []       # for each instruction, tuple of ( type, op_data, index, doing ) of the blocks it is in, used for status
+    self.line_pc_list = []    # pc of the start of each of the top level lines, used for goto
+    self._path = ()
+    self._handler_map = {
+                          Types.LINE: self._line,
+                          Types.SCOPE: self._scope,
+                          Types.CONSTANT: self._constant,
+                          Types.VARIABLE: self._variable,
+                          Types.ARRAY: self._array,
+                          Types.MAP: self._map,
+                          Types.ARRAY_MAP_ITEM: self._array_map_item,
+                          Types.ASSIGNMENT: self._assignment,
+                          Types.INFIX: self._infix,
+                          Types.FUNCTION: self._function,
+                          Types.WHILE: self._while,
+                          Types.IFELSE: self._ifelse,
+                          Types.EXISTS: self._exists,
+                          Types.JUMP_POINT: self._jump_point,
+                          Types.GOTO: self._goto
+                        }
+
+    self._compile( ast )
+    del self._handler_map
+
+  def _emit( self, *op ):
+    self.code.append( op )
+    self.path_list.append( self._path )
+    return len( self.code ) - 1
+
+  def _patch( self, pc, target ):  # set the jump target of the instruction at pc
+    self.code[ pc ] = self.code[ pc ][ 0:1 ] + ( target, ) + self.code[ pc ][ 2: ]
+
+  def _compile( self, operation ):
+    try:
+      handler = self._handler_map[ operation[0] ]
+    except KeyError:
+      raise ValueError( 'Unknown AST node type "{0}"'.format( operation[0] ) )
+
+    handler( operation )
+
+  def _compileValue( self, operation ):  # compile something that needs to leave a value on the stack
+    self._compile( operation )
+    if operation[0] not in _VALUE_TYPE_LIST:
+      self._emit( _op_no_value, operation[0] )
+
+  def _line( self, operation ):
+    self._emit( _op_line, operation[2] )
+    self._compile( operation[1] )
+    if operation[1][0] in _VALUE_TYPE_LIST:
+      self._emit( _op_pop )
+
+  def _scope( self, operation ):
+    op_data = operation[1]
+    self._emit( _op_scope, op_data.get( 'max_time', None ) )
+    parent_path = self._path
+    top = parent_path == ()  # the top scope of the script, anything else is inside it
+    for i in range( 0, len( op_data[ '_children' ] ) ):
+      self._path = parent_path + ( ( Types.SCOPE, op_data, i, None ), )
+      if top:
+        self.line_pc_list.append( len( self.code ) )
+
+      self._compile( op_data[ '_children' ][ i ] )
+
+    self._path = parent_path
+    self._emit( _op_scope_end )
+
+  def _constant( self, operation ):
+    self._emit( _op_constant, operation[1] )  # a folded array/map is a plain list/dict, so it is never changed in place
+
+  def _variable( self, operation ):
+    if operation[1][ 'module' ] is None:
+      self._emit( _op_variable, operation[1][ 'name' ] )
+    else:
+      self._emit( _op_module_variable, operation[1][ 'module' ], operation[1][ 'name' ] )
+
+  def _array( self, operation ):
+    for item in operation[1]:
+      self._compileValue( item )
+
+    self._emit( _op_array, len( operation[1] ) )
+
+  def _map( self, operation ):
+    for key in operation[1]:
+      self._compileValue( operation[1][ key ] )
+
+    self._emit( _op_map, tuple( operation[1].keys() ) )
+
+  def _array_map_item( self, operation ):
+    self._compileValue( operation[1][ 'index' ] )
+    self._emit( _op_array_map_item, operation[1][ 'module' ], operation[1][ 'name' ] )
+
+  def _assignment( self, operation ):
+    op_data = operation[1]
+    target_type = op_data[ 'target' ][0]
+    target = op_data[ 'target' ][1]
+    if target_type not in ( Types.VARIABLE, Types.ARRAY_MAP_ITEM ) or ( target_type == Types.ARRAY_MAP_ITEM and target[ 'module' ] is not None ):
+      self._emit( _op_assign_invalid )
+      return
+
+    if target_type == Types.ARRAY_MAP_ITEM:
+      self._compileValue( target[ 'index' ] )
+      self._compileValue( op_data[ 'value' ] )
+      self._emit( _op_assign_item, target[ 'name' ] )
+
+    elif target[ 'module' ] is None:
+      self._compileValue( op_data[ 'value' ] )
+      self._emit( _op_assign, target[ 'name' ] )
+
+    else:
+      self._compileValue( op_data[ 'value' ] )
+      self._emit( _op_assign_module, target[ 'module' ], target[ 'name' ] )
+
+  def _infix( self, operation ):
+    op_data = operation[1]
+    self._compileValue( op_data[ 'left' ] )
+    self._compileValue( op_data[ 'right' ] )
+    operator = op_data[ 'operator' ]
+    if operator in infix_string_operator_map:
+      self._emit( _op_infix_string, infix_string_operator_map[ operator ] )
+    elif operator in infix_math_operator_map:
+      self._emit( _op_infix_math, infix_math_operator_map[ operator ] )
+    elif operator in infix_logical_operator_map:
+      self._emit( _op_infix_logical, infix_logical_operator_map[ operator ] )
+    else:
+      self._emit( _op_infix_unknown, operator )
+
+  def _function( self, operation ):
+    op_data = operation[1]
+    parent_path = self._path
+    self._path = parent_path + ( ( Types.FUNCTION, op_data, None, None ), )
+    item_key = None
+    for key in op_data[ 'paramaters' ]:
+      paramater = op_data[ 'paramaters' ][ key ]
+      if _is_item_paramater( op_data, key ):  # keep the index, so the item can be changed where it is
+        item_key = key
+        self._compileValue( paramater[1][ 'index' ] )
+        self._emit( _op_item_paramater, None, paramater[1][ 'name' ] )
+      else:
+        self._compileValue( paramater )
+
+    self._emit( _op_function, op_data, tuple( op_data[ 'paramaters' ].keys() ), item_key )
+    self._path = parent_path
+
+  def _while( self, operation ):
+    op_data = operation[1]
+    parent_path = self._path
+    self._path = parent_path + ( ( Types.WHILE, op_data, None, 'condition' ), )
+    condition_pc = len( self.code )
+    self._compileValue( op_data[ 'condition' ] )
+    exit_pc = self._emit( _op_jump_false, None )
+    self._path = parent_path + ( ( Types.WHILE, op_data, None, 'expression' ), )
+    self._compile( op_data[ 'expression' ] )
+    if op_data[ 'expression' ][0] in _VALUE_TYPE_LIST:
+      self._emit( _op_pop )
+    self._emit( _op_jump, condition_pc )
+    self._path = parent_path
+    self._patch( exit_pc, len( self.code ) )
+
+  def _ifelse( self, operation ):
+    op_data = operation[1]
+    parent_path = self._path
+    end_pc_list = []
+    for i in range( 0, len( op_data ) ):
+      next_pc = None
+      if op_data[i][ 'condition' ] is not None:
+        self._path = parent_path + ( ( Types.IFELSE, op_data, i, 'condition' ), )
+        self._compileValue( op_data[i][ 'condition' ] )
+        next_pc = self._emit( _op_jump_false, None )
+
+      self._path = parent_path + ( ( Types.IFELSE, op_data, i, 'expression' ), )
+      self._compile( op_data[i][ 'expression' ] )
+      if op_data[i][ 'expression' ][0] in _VALUE_TYPE_LIST:
+        self._emit( _op_pop )
+      end_pc_list.append( self._emit( _op_jump, None ) )
+      if next_pc is not None:
+        self._patch( next_pc, len( self.code ) )
+
+    self._path = parent_path
+    for pc in end_pc_list:
+      self._patch( pc, len( self.code ) )
+
+  def _exists( self, operation ):
+    exists_pc = self._emit( _op_exists, None )
+    self._compileValue( operation[1] )
+    self._emit( _op_exists_end )
+    self._patch( exists_pc, len( self.code ) )
+
+  def _jump_point( self, operation ):  # just a NOP execution wise
+    self._emit( _op_nop )
+
+  def _goto( self, operation ):
+    self._emit( _op_goto, operation[1] )
+
+
+class CompiledRunner( Runner ):
+  def __init__( self, ast, ast_hash=None ):
+    super().__init__( ast, ast_hash )
+    # serilize
+    self.pc = 0       # index of the next instruction to run
+    self.stack = []   # value stack
+
+    # do not serlize
+    self._program = None
+
+  @property
+  def program( self ):  # compiled on first use, so ast_hash can be set after unpickling
+    if self._program is None:
+      self._program = compile_ast( self.ast, self.ast_hash )
+
+    return self._program
+
+  def _statusItems( self ):
+    scope_list = [ frame for frame in self.state if frame.op_type == Types.SCOPE ]
+    path = self.program.path_list[ self.pc ]
+    item_list = []  # ( scope position, scope length, scope type, scope data, frame, expected time )
+    scope_count = 0
+    for step_type, op_data, index, doing in path:
+      if step_type == Types.SCOPE:
+        tmp = {}
+        if 'description' in op_data:
+          tmp[ 'description' ] = op_data[ 'description' ]
+
+        item_list.append( ( index, len( op_data[ '_children' ] ), 'Scope', tmp, scope_list[ scope_count ], op_data.get( 'expected_time' ) ) )
+        scope_count += 1
+
+      elif step_type == Types.WHILE:
+        item_list.append( ( 0, 1, 'While', { 'doing': doing }, None, None ) )
+
+      elif step_type == Types.IFELSE:
+        item_list.append( ( index, len( op_data ), 'IfElse', { 'doing': doing }, None, None ) )
+
+      elif step_type == Types.FUNCTION:
+        item_list.append( ( 0, 1, 'Function', { 'module': op_data[ 'module' ], 'name': op_data[ 'name' ] }, None, None ) )
+
+    if item_list and item_list[ -1 ][2] == 'Function' and self.state[ -1 ].op_type == Types.FUNCTION:  # the function is running, so has a dispatched flag
+      item_list[ -1 ] = item_list[ -1 ][ :4 ] + ( self.state[ -1 ], None )
+
+    return item_list
+
+  def goto( self, jump_point ):
+    try:
+      pos = self.jump_point_map[ jump_point ]
+    except KeyError:
+      raise NotDefinedError( jump_point )
+
+    self.state = [ ScopeFrame( pos, datetime.datetime.utcnow() ) ]
+    self.stack = []
+    self._status = None
+    self.pc = self.program.line_pc_list[ pos ]
+
+  def _checkMaxTime( self ):  # the tree walker checks the scope max_time each time it decends into the scope, do the same on resume
+    for frame in self.state:
+      if frame.op_type != Types.SCOPE:
+        continue
+
+      if frame.timed_out:
+        frame.timed_out = False
+        frame.max_time_at = datetime.datetime.utcnow()  # last time was a timeout, so set it so next run will timeout
+
+      elif frame.max_time_at is not None and datetime.datetime.utcnow() > frame.max_time_at:
+        frame.timed_out = True
+        raise Pause( 'max time elapsed' )
+
+  def _traceStep( self, pc, op ):
+    logging.debug( 'runner: pc: "%s" op: "%s" stack: "%s"', pc, op, self.stack )
+    self._trace( TRACE_STEP, 'step', ( pc, op[0].__name__ ) )
+
+  def _execute( self ):
+    if self.state == []:
+      self.pc = 0
+      self.stack = []
+    else:
+      self._checkMaxTime()
+
+    code = self.program.code
+    end = len( code )
+    while True:
+      try:
+        pc = self.pc
+        if self._step_trace:  # a loop of it's own, so the untraced loop does not pay for checking
+          while pc < end:
+            if self.ttl <= 0:
+              self._nextSteps()
+
+            self.ttl -= 1
+            op = code[ pc ]
+            self._traceStep( pc, op )
+            pc = op[0]( self, op, pc )
+            self.pc = pc
+
+        while pc < end:
+          if self.ttl <= 0:
+            self._nextSteps()
+
+          self.ttl -= 1
+          op = code[ pc ]
+          pc = op[0]( self, op, pc )
+          self.pc = pc
+
+        break
+
+      except NotDefinedError:  # if we are inside an exists, it dosen't exist
+        for i in range( len( self.state ) - 1, -1, -1 ):
+          if self.state[ i ].op_type == Types.EXISTS:
+            break
+        else:
+          raise
+
+        frame = self.state[ i ]
+        del self.state[ i: ]
+        del self.stack[ frame.stack_len: ]
+        self.stack.append( False )
+        self.pc = frame.resume_pc
+
+    self.state = 'DONE'
+    self.cur_line = None
+
+  def __getstate__( self ):
+    result = super().__getstate__()
+    result[ 'pc' ] = self.pc
+    result[ 'stack' ] = self.stack
+    result[ 'program_version' ] = PROGRAM_VERSION
+    return result
+
+  def __setstate__( self, state ):
+    super().__setstate__( state )
+    self.pc = state[ 'pc' ]
+    self.stack = state[ 'stack' ]
+    version = state.get( 'program_version' )
+    if version != PROGRAM_VERSION and isinstance( self.state, list ) and self.state:  # not started and done do not use the pc
+      raise ValueError( 'Runner state is from program version "{0}", the compiler is version "{1}"'.format( version, PROGRAM_VERSION ) )
@@ -0,0 +1,67 @@
+import pytest
+import pickle
+
+from factory.script.parser import parse, Types
+from factory.script.runner import Runner, UnrecoverableError, Timeout
+from factory.script.compiler import CompiledRunner, Program, compile_ast, _op_line, _op_jump_false, _op_jump
+
+
+def test_compile():
+  program = Program( parse( 'aa = 1\n:jump_a\nbb = 2' ) )
+  assert program.line_pc_list == [ 1, 4, 6 ]
+  assert program.code[ 1 ] == ( _op_line, 1 )
+  assert program.code[ 4 ] == ( _op_line, 2 )
+  assert program.path_list[ 0 ] == ()
+  assert program.path_list[ 6 ][0][0] == Types.SCOPE
+  assert program.path_list[ 6 ][0][2] == 2
+
+  program = Program( parse( 'while True do aa = 1' ) )
+  op_list = [ op[0] for op in program.code ]
+  jump_false = op_list.index( _op_jump_false )
+  jump = op_list.index( _op_jump )
+  assert program.code[ jump_false ][1] == jump + 1
+  assert program.code[ jump ][1] == jump_false - 1
+  assert program.path_list[ jump_false - 1 ][ -1 ][3] == 'condition'
+  assert program.path_list[ jump - 1 ][ -1 ][3] == 'expression'
+
+  ast = parse( 'aa = 1' )
+  assert compile_ast( ast ) is not compile_ast( ast )
+  assert compile_ast( ast, 'aa' ) is compile_ast( ast, 'aa' )
+
+
+def test_exists():
+  runner = CompiledRunner( parse( 'aa = [ 1, exists( bb ), exists( cc[ 2 ] ), 4 ]' ) )
+  runner.run()
+  assert runner.done
+  assert runner.variable_map == { 'aa': [ 1, False, False, 4 ] }
+  assert runner.stack == []
+
+  runner = CompiledRunner( parse( 'cc = [ 1 ]\naa = exists( cc[ exists( bb ) ] )' ) )
+  runner.run()
+  assert runner.variable_map == { 'cc': [ 1 ], 'aa': True }
+
+  runner = CompiledRunner( parse( 'cc = [ 1 ]\naa = exists( cc[ nope( value=1 ) ] )' ) )
+  runner.run()
+  assert runner.variable_map == { 'cc': [ 1 ], 'aa': False }
+  assert runner.state == 'DONE'
+
+
+def test_no_value():
+  for runner_class in ( Runner, CompiledRunner ):
+    runner = runner_class( parse( 'aa = [ 1, bb = 2 ]' ) )
+    with pytest.raises( UnrecoverableError ):
+      runner.run()
+    assert runner.aborted
+
+
+def test_resume():
+  runner = CompiledRunner( parse( 'begin()\nbegin()\ncnt = 0\nwhile ( cnt < 3 ) do cnt = ( cnt + 1 )\nend\nend' ) )
+  with pytest.raises( Timeout ):
+    runner.run( 10 )
+  pc = runner.pc
+  buff = pickle.dumps( runner )
+  runner = pickle.loads( buff )
+  assert runner.pc == pc
+  runner.run()
+  assert runner.done
+  assert runner.variable_map == { 'cnt': 3 }
@@ -0,0 +1,271 @@
+from operator import attrgetter
+
+from factory.script.parser import Types
+from factory.script.values import ScriptList, ScriptMap
+
+"""
+Frames of the Runner's state stack, one for each level of the AST from the
+top scope down to the current execution point.  Frames are pickled with the
+runner, so they only hold what is needed to resume, and are kept small.
+
+A frame's value is NO_VALUE until the node has been evaluated, None is a
+valid script value.  The arguments of each frame's __init__ are it's slots, in
+order, a frame is saved as it's op_type and the values of it's slots, leaving
+off the trailing values that are still the default, see pack_state.
+"""
+
+
+class _NoValue( object ):
+  __slots__ = ()
+
+  def __repr__( self ):
+    return 'NO_VALUE'
+
+  def __reduce__( self ):  # pickle by reference, so it is still the same object after unpickling
+    return 'NO_VALUE'
+
+
+NO_VALUE = _NoValue()
+
+
+class Frame( object ):
+  __slots__ = ()
+  op_type = None
+  _defaults = ()
+
+  _getter = None
+
+  def __init_subclass__( cls ):
+    cls._defaults = cls.__init__.__defaults__ or ()
+    if cls.__slots__:
+      cls._getter = attrgetter( *cls.__slots__ )
+
+  def __getstate__( self ):
+    if len( self.__slots__ ) > 1:
+      return self._getter( self )
+
+    if self.__slots__:
+      return ( self._getter( self ), )
+
+    return ()
+
+  def _values( self ):  # the slot values with the trailing defaults left off
+    state = self.__getstate__()
+    i = len( state )
+    while i and state[ i - 1 ] is self._defaults[ i - 1 ]:
+      i -= 1
+
+    return state[ :i ]
+
+  def __reduce__( self ):
+    return ( self.__class__, self._values() )
+
+  def __eq__( self, other ):
+    return self.__class__ is other.__class__ and self.__getstate__() == other.__getstate__()
+
+  def __repr__( self ):
+    return '{0}( {1} )'.format( self.__class__.__name__, ', '.join( '{0}={1!r}'.format( name, getattr( self, name ) ) for name in self.__slots__ ) )
+
+  @classmethod
+  def fromList( cls, item ):  # from the state before frames, [ <type>, [ work values, [ return value ] ] ]
+    frame = cls()
+    if len( item ) > 1 and isinstance( item[1], dict ):
+      for key, value in item[1].items():
+        setattr( frame, key, value )
+
+    if len( item ) > 2:
+      frame.value = item[2]
+
+    return frame
+
+
+class LineFrame( Frame ):
+  __slots__ = ()
+  op_type = Types.LINE
+
+  def __init__( self ):
+    pass
+
+
+class ScopeFrame( Frame ):
+  __slots__ = ( 'position', 'started', 'max_time_at', 'timed_out' )
+  op_type = Types.SCOPE
+
+  def __init__( self, position=0, started=None, max_time_at=None, timed_out=False ):
+    self.position = position        # index of the child being evaluated, not used by the CompiledRunner
+    self.started = started
+    self.max_time_at = max_time_at  # None for no max time
+    self.timed_out = timed_out      # the max time was hit, and the script has not been resumed since
+
+  @classmethod
+  def fromList( cls, item ):  # [ SCOPE, position, started, [ max time at, None if timed out ] ]
+    frame = cls( *item[ 1:3 ] )
+    if len( item ) > 3:
+      if item[3] is None:
+        frame.timed_out = True
+      else:
+        frame.max_time_at = item[3]
+
+    return frame
+
+
+class ConstantFrame( Frame ):
+  __slots__ = ( 'value', )
+  op_type = Types.CONSTANT
+
+  def __init__( self, value=NO_VALUE ):
+    self.value = value
+
+
+class VariableFrame( Frame ):
+  __slots__ = ( 'value', )
+  op_type = Types.VARIABLE
+
+  def __init__( self, value=NO_VALUE ):
+    self.value = value
+
+
+class ArrayFrame( Frame ):
+  __slots__ = ( 'items', 'value' )
+  op_type = Types.ARRAY
+
+  def __init__( self, items=None, value=NO_VALUE ):
+    self.items = ScriptList() if items is None else items  # the values of the items evaluated so far
+    self.value = value
+
+  @classmethod
+  def fromList( cls, item ):
+    frame = super().fromList( item )
+    if len( item ) > 1 and item[1] is not None:
+      frame.items = item[1]
+
+    return frame
+
+
+class MapFrame( Frame ):
+  __slots__ = ( 'items', 'value' )
+  op_type = Types.MAP
+
+  def __init__( self, items=None, value=NO_VALUE ):
+    self.items = ScriptMap() if items is None else items
+    self.value = value
+
+  @classmethod
+  def fromList( cls, item ):
+    frame = cls()
+    if len( item ) > 1 and item[1] is not None:
+      frame.items = item[1]
+
+    if len( item ) > 2:
+      frame.value = item[2]
+
+    return frame
+
+
+class ArrayMapItemFrame( Frame ):
+  __slots__ = ( 'index', 'value' )
+  op_type = Types.ARRAY_MAP_ITEM
+
+  def __init__( self, index=NO_VALUE, value=NO_VALUE ):
+    self.index = index
+    self.value = value
+
+
+class AssignmentFrame( Frame ):
+  __slots__ = ( 'index', 'operand' )
+  op_type = Types.ASSIGNMENT
+
+  def __init__( self, index=NO_VALUE, operand=NO_VALUE ):
+    self.index = index      # only for assigning to an array/map item
+    self.operand = operand  # the value to assign
+
+  @classmethod
+  def fromList( cls, item ):
+    frame = cls()
+    if len( item ) > 1:
+      frame.index = item[1].get( 'index', NO_VALUE )
+      frame.operand = item[1].get( 'value', NO_VALUE )
+
+    return frame
+
+
+class InfixFrame( Frame ):
+  __slots__ = ( 'left', 'right', 'value' )
+  op_type = Types.INFIX
+
+  def __init__( self, left=NO_VALUE, right=NO_VALUE, value=NO_VALUE ):
+    self.left = left
+    self.right = right
+    self.value = value
+
+
+class FunctionFrame( Frame ):
+  __slots__ = ( 'paramaters', 'handler', 'module', 'dispatched', 'value', 'item_index', 'name' )
+  op_type = Types.FUNCTION
+
+  def __init__( self, paramaters=None, handler=None, module=None, dispatched=None, value=NO_VALUE, item_index=NO_VALUE, name=None ):
+    self.paramaters = {} if paramaters is None else paramaters
+    self.handler = handler        # the ExternalFunction, once it is setup
+    self.module = module
+    self.dispatched = dispatched  # None until there is a ExternalFunction to dispatch
+    self.value = value            # None if the function returned an Exception
+    self.item_index = item_index  # the index of the array/map item paramater a builtin changes in place, see builtin_mutating_map
+    self.name = name              # the name of the ExternalFunction in it's module, once it is setup
+
+
+class WhileFrame( Frame ):
+  __slots__ = ( 'doing', )
+  op_type = Types.WHILE
+
+  def __init__( self, doing='condition' ):
+    self.doing = doing  # so we remember what it was we were doing when interrupted
+
+
+class IfElseFrame( Frame ):
+  __slots__ = ( 'index', 'doing' )
+  op_type = Types.IFELSE
+
+  def __init__( self, index=0, doing='condition' ):
+    self.index = index
+    self.doing = doing
+
+
+class ExistsFrame( Frame ):
+  __slots__ = ( 'resume_pc', 'stack_len', 'value' )
+  op_type = Types.EXISTS
+
+  def __init__( self, resume_pc=None, stack_len=None, value=NO_VALUE ):
+    self.resume_pc = resume_pc  # CompiledRunner, where to go if it dosen't exist, and how much of the value stack to keep
+    self.stack_len = stack_len
+    self.value = value
+
+
+class JumpPointFrame( Frame ):
+  __slots__ = ()
+  op_type = Types.JUMP_POINT
+
+  def __init__( self ):
+    pass
+
+
+class GotoFrame( Frame ):
+  __slots__ = ()
+  op_type = Types.GOTO
+
+  def __init__( self ):
+    pass
+
+
+frame_class_map = { frame_class.op_type: frame_class for frame_class in ( LineFrame, ScopeFrame, ConstantFrame, VariableFrame, ArrayFrame, MapFrame, ArrayMapItemFrame, AssignmentFrame, InfixFrame, FunctionFrame, WhileFrame, IfElseFrame, ExistsFrame, JumpPointFrame, GotoFrame ) }
+
+
+def pack_state( state ):  # plain tuples pickle much faster than the frames
+  return [ ( frame.op_type, ) + frame._values() for frame in state ]
+
+
+def unpack_state( state ):
+  return [ frame_class_map[ item[0] ]( *item[ 1: ] ) for item in state ]
+
+
+def frames_from_lists( state ):  # upgrade the state of a runner pickled before frames
+  return [ frame_class_map[ item[0] ].fromList( item ) for item in state ]
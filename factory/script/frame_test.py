@@ -0,0 +1,49 @@
+import pickle
+import datetime
+
+from factory.script.parser import parse, Types
+from factory.script.runner import Runner
+from factory.script.frame import NO_VALUE, frames_from_lists, ScopeFrame, AssignmentFrame, InfixFrame, FunctionFrame, ArrayFrame, MapFrame, WhileFrame, LineFrame
+
+
+def test_pickle():
+  frame = InfixFrame()
+  frame.left = None
+  frame = pickle.loads( pickle.dumps( frame ) )
+  assert frame.left is None
+  assert frame.right is NO_VALUE
+  assert frame.value is NO_VALUE
+
+  now = datetime.datetime.utcnow()
+  frame = ScopeFrame( 2, now )
+  assert pickle.loads( pickle.dumps( frame ) ) == frame
+  assert pickle.loads( pickle.dumps( frame ) ) != ScopeFrame( 2 )
+  assert pickle.loads( pickle.dumps( LineFrame() ) ) == LineFrame()
+
+
+def test_from_lists():
+  now = datetime.datetime.utcnow()
+  state = frames_from_lists( [ [ Types.SCOPE, 1, now ], [ Types.SCOPE, 0, now, None ], [ Types.LINE ], [ Types.ASSIGNMENT, { 'value': 2 } ], [ Types.ARRAY, [ 1 ] ], [ Types.MAP, None, {} ], [ Types.WHILE, { 'doing': 'expression' } ], [ Types.INFIX, { 'left': 3 } ], [ Types.FUNCTION, { 'paramaters': { 'a': 1 }, 'dispatched': True, 'module': 'testing', 'handler': 'h' } ] ] )
+  assert state[0] == ScopeFrame( 1, now )
+  assert state[1].timed_out
+  assert state[1].max_time_at is None
+  assert isinstance( state[2], LineFrame )
+  assert isinstance( state[3], AssignmentFrame ) and state[3].operand == 2 and state[3].index is NO_VALUE
+  assert isinstance( state[4], ArrayFrame ) and state[4].items == [ 1 ] and state[4].value is NO_VALUE
+  assert isinstance( state[5], MapFrame ) and state[5].value == {}
+  assert isinstance( state[6], WhileFrame ) and state[6].doing == 'expression'
+  assert isinstance( state[7], InfixFrame ) and state[7].left == 3 and state[7].right is NO_VALUE
+  assert isinstance( state[8], FunctionFrame ) and state[8].paramaters == { 'a': 1 } and state[8].dispatched is True and state[8].handler == 'h'
+
+
+def test_legacy_resume():  # a runner pickled with list state, in the middle of the loop's "cnt = ( cnt + 1 )"
+  runner = Runner( parse( 'cnt = 0\nwhile ( cnt < 3 ) do cnt = ( cnt + 1 )' ) )
+  state = runner.__getstate__()
+  state[ 'state' ] = [ [ Types.SCOPE, 1, datetime.datetime.utcnow() ], [ Types.LINE ], [ Types.WHILE, { 'doing': 'expression' } ], [ Types.ASSIGNMENT, {} ], [ Types.INFIX, { 'left': 1 } ] ]
+  state[ 'variable_map' ] = { 'cnt': 1 }
+  state[ 'cur_line' ] = 2
+  runner.__setstate__( state )
+  assert isinstance( runner.state[ -1 ], InfixFrame )
+  runner.run()
+  assert runner.done
+  assert runner.variable_map == { 'cnt': 3 }
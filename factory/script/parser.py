@@ -1,6 +1,12 @@
+import re
+import bisect
+import hashlib
+import threading
+from collections import OrderedDict
 from datetime import timedelta
 
 from parsimonious import Grammar, ParseError, IncompleteParseError
+from django.conf import settings
 
 
 script_grammar = r"""
@@ -87,38 +93,256 @@ class ParserError( Exception ):
     return 'ParseError, line: {0}, column: {1}, "{2}"'.format( self.line, self.column, self.msg )
 
 
+# the backend used by lint/parse is set with settings.SCRIPT_PARSER_BACKEND, BACKEND overrides the setting if not None
+BACKEND = None
+DEFAULT_BACKEND = 'parsimonious'
+
+
+def _parserClass():
+  name = BACKEND
+  if name is None:
+    name = DEFAULT_BACKEND
+    if settings.configured:
+      name = getattr( settings, 'SCRIPT_PARSER_BACKEND', DEFAULT_BACKEND )
+
+  try:
+    return backend_map[ name ]
+  except KeyError:
+    raise ValueError( 'Unknown script parser backend "{0}"'.format( name ) )
+
+
 def lint( script ):
-  parser = Parser()
+  parser = _parserClass()()
   return parser.lint( script )
 
 
-def parse( script ):
-  parser = Parser()
-  return parser.parse( script )
+def parse( script, optimize=False ):
+  parser = _parserClass()()
+  return parser.parse( script, optimize )
+
+
+def lint_incremental( script ):
+  parser = _parserClass()()
+  return parser.lintIncremental( script )
+
+
+def _constant_infix( operator, left, right ):  # the value of an infix of two constants, the same way the runner does it, raises ValueError if it has to wait for the runner
+  from factory.script.runner import infix_string_operator_map, infix_math_operator_map, infix_logical_operator_map  # the runner imports the parser
+
+  if operator in infix_string_operator_map:
+    if not isinstance( left, str ):
+      left = str( left )
+    if not isinstance( right, str ):
+      right = str( right )
+
+    return infix_string_operator_map[ operator ]( left, right )
+
+  elif operator in infix_math_operator_map:
+    if not isinstance( left, ( int, float, bool ) ) or not isinstance( right, ( int, float, bool ) ):
+      raise ValueError( 'must be numeric' )
+
+    if operator == '^' and abs( right ) > 64:  # don't let a big power hang the parser
+      raise ValueError( 'power to large' )
+
+    return infix_math_operator_map[ operator ]( left, right )
+
+  elif operator in infix_logical_operator_map:
+    return infix_logical_operator_map[ operator ]( left, right )
+
+  raise ValueError( 'unknown operator' )
+
+
+AST_VERSION = 1  # bump when a change to the parser or optimizer changes the AST of a script, so stored ASTs are not reused
+AST_CACHE_SIZE = 50
+LINT_CACHE_SIZE = 20000
+
+_ast_cache = OrderedDict()
+_ast_cache_lock = threading.Lock()
+
+
+def script_hash( script ):
+  return hashlib.sha256( '{0}:{1}'.format( AST_VERSION, script ).encode( 'utf-8' ) ).hexdigest()
+
+
+def parse_cached( script ):
+  """
+  Like parse, but the resulting AST is optimized and kept in a small LRU keyed
+  by the hash of the script, so the same script is only parsed once.  The
+  returned AST is shared, it must not be modified.
+  """
+  key = script_hash( script )
+  with _ast_cache_lock:
+    try:
+      _ast_cache.move_to_end( key )
+      return _ast_cache[ key ]
+    except KeyError:
+      pass
+
+  ast = parse( script, True )  # parse errors are not cached, they are raised every time
+
+  with _ast_cache_lock:
+    _ast_cache[ key ] = ast
+    while len( _ast_cache ) > AST_CACHE_SIZE:
+      _ast_cache.popitem( last=False )
+
+  return ast
+
+
+def value_keys( ast, module, name ):
+  """
+  Returns the set of keys the AST uses of module.name, from module.name[ <constant> ],
+  or None if it is used any other way, ie: all of it, or indexed by something
+  only known when it runs.  Use the optimized AST, so more of the indexes are
+  constants.
+  """
+  key_set = set()
+  if _value_keys( ast, module, name, key_set ):
+    return key_set
+
+  return None
+
+
+def _value_keys( node, module, name, key_set ):  # False if the whole value may be used
+  if isinstance( node, dict ):
+    return all( _value_keys( item, module, name, key_set ) for item in node.values() )
+
+  if isinstance( node, list ):
+    return all( _value_keys( item, module, name, key_set ) for item in node )
 
+  if not isinstance( node, tuple ) or node[0] == Types.CONSTANT:
+    return True
 
-class IsEmpty( Exception ):
-  pass
+  if node[0] in ( Types.VARIABLE, Types.ARRAY_MAP_ITEM ) and node[1][ 'module' ] == module and node[1][ 'name' ] == name:
+    if node[0] == Types.VARIABLE or node[1][ 'index' ][0] != Types.CONSTANT:
+      return False
 
+    key_set.add( node[1][ 'index' ][1] )
+    return True
 
-class Parser( object ):
+  return all( _value_keys( item, module, name, key_set ) for item in node[ 1: ] )
+
+
+def function_modules( ast ):
+  """
+  Returns the set of modules of the functions the AST calls, the builtins are
+  not included.  The functions of a module are run outside the script, they
+  can get any of the script's values.
+  """
+  module_set = set()
+  _function_modules( ast, module_set )
+  return module_set
+
+
+def _function_modules( node, module_set ):
+  if isinstance( node, dict ):
+    for item in node.values():
+      _function_modules( item, module_set )
+
+  elif isinstance( node, list ):
+    for item in node:
+      _function_modules( item, module_set )
+
+  elif isinstance( node, tuple ) and node[0] != Types.CONSTANT:
+    if node[0] == Types.FUNCTION and node[1][ 'module' ] is not None:
+      module_set.add( node[1][ 'module' ] )
+
+    for item in node[ 1: ]:
+      _function_modules( item, module_set )
+
+
+# incremental lint results, ( first physical line, second physical line ) of a top level line -> list of ( top level line text, following text, result )
+_lint_cache = OrderedDict()
+_lint_cache_lock = threading.Lock()
+
+
+def _following_line( script, pos ):
+  end = script.find( '\n', pos )
+  if end == -1:
+    return script[ pos: ]
+
+  return script[ pos:end + 1 ]
+
+
+def _following_text( script, pos ):  # the blank lines and the next non blank line, a top level line looks past blank lines for an elif/else
+  end = pos
+  while end < len( script ):
+    line = _following_line( script, end )
+    end += len( line )
+    if line.strip():
+      break
+
+  return script[ pos:end ]
+
+
+def _lint_cache_get( key ):
+  with _lint_cache_lock:
+    try:
+      _lint_cache.move_to_end( key )
+      return _lint_cache[ key ]
+    except KeyError:
+      return ()
+
+
+def _lint_cache_put( key, chunk, following, result ):
+  with _lint_cache_lock:
+    entry_list = [ ( chunk, following, result ) ] + [ i for i in _lint_cache.get( key, () ) if i[0] != chunk or i[1] != following ]
+    _lint_cache[ key ] = entry_list[ 0:4 ]
+    _lint_cache.move_to_end( key )
+    while len( _lint_cache ) > LINT_CACHE_SIZE:
+      _lint_cache.popitem( last=False )
+
+
+_EMPTY = object()  # returned for nodes that do not produce anything, ie: white space
+_grammar = None
+_grammar_lock = threading.Lock()
+
+
+def _getGrammar():
+  # compiling the grammar is expensive, and the result is not modified by parsing, so
+  # it is built once, on first use, and shared by every Parser in the process
+  global _grammar
+  if _grammar is not None:
+    return _grammar
+
+  with _grammar_lock:
+    if _grammar is None:
+      _grammar = Grammar( script_grammar )
+
+  return _grammar
+
+
+class SyntaxFailure( Exception ):  # raised by the backends when the script does not match the grammar
+  def __init__( self, text, pos, incomplete ):
+    super().__init__()
+    self.incomplete = incomplete
+    # line and column are 1 based, the same as parsimonious
+    self.line = text.count( '\n', 0, pos ) + 1
+    self.column = pos - text.rfind( '\n', 0, pos )
+
+
+class BaseParser( object ):
+  """
+  The common parts of the parser backends, the backends implement _syntax,
+  which matches the script against the grammar, and _build, which turns the
+  result of _syntax into the AST.
+  """
   def __init__( self ):
     super().__init__()
     self.line_endings = []
-    self.grammar = Grammar( script_grammar )
 
   def lint( self, script ):
     script += '\n'  # just incase the end of the script lacks a \n otherwise the *line* will not match
     self.line_endings = [ i for i, c in enumerate( script ) if c == '\n' ]
     try:
-      root_node = self.grammar.parse( script )
-    except IncompleteParseError as e:
-      return 'Incomplete Parsing on line: {0} column: {1}'.format( e.line(), e.column() )
-    except ParseError as e:
-      return 'Error Parsing on line: {0} column: {1}'.format( e.line(), e.column() )
+      tree = self._syntax( script )
+    except SyntaxFailure as e:
+      if e.incomplete:
+        return 'Incomplete Parsing on line: {0} column: {1}'.format( e.line, e.column )
+
+      return 'Error Parsing on line: {0} column: {1}'.format( e.line, e.column )
 
     try:
-      ast = self._eval( root_node )
+      ast = self._build( tree )
     except Exception as e:
       return 'Exception Parsing "{0}"'.format( e )
 
@@ -129,35 +353,261 @@ class Parser( object ):
 
     return None
 
-  def parse( self, script ):
+  def parse( self, script, optimize=False ):
     script += '\n'  # just incase the end of the script lacks a \n otherwise the *line* will not match
     self.line_endings = [ i for i, c in enumerate( script ) if c == '\n' ]
     try:
-      root_node = self.grammar.parse( script )
-    except IncompleteParseError as e:
-      raise ParserError( e.line(), e.column(), 'Incomplete Parse' )
-    except ParseError as e:
-      raise ParserError( e.line(), e.column(), 'Error Parsing' )
+      tree = self._syntax( script )
+    except SyntaxFailure as e:
+      if e.incomplete:
+        raise ParserError( e.line, e.column, 'Incomplete Parse' )
+
+      raise ParserError( e.line, e.column, 'Error Parsing' )
 
-    ast = self._eval( root_node )
+    ast = self._build( tree )
     self._check( ast )
+    if optimize:
+      ast = self._optimize( ast )
 
     return ( Types.SCOPE, { '_children': ast, 'description': 'Overall Script' } )
 
-  def _eval( self, node ):
-    if node.expr_name[ 0:3 ] in ( 'ws_', 'nl_', 'em_' ):  # ignore wite space
-      raise IsEmpty()
+  def lintIncremental( self, script ):
+    """
+    Returns the same as lint, the top level lines are linted one at a time,
+    and the result for each is cached by the text of the line and the text
+    that follows it, up to the next non blank line ( that is as far as a top
+    level line looks ahead ), so
+    only the top level lines that have changed since the script was last
+    linted get parsed.
+    """
+    script += '\n'  # just incase the end of the script lacks a \n otherwise the *line* will not match
+    self.line_endings = [ i for i, c in enumerate( script ) if c == '\n' ]
+
+    exception = None
+    check = None  # ( depth, line ) of the first _check error, _check is breadth first so the shallowest error wins
+    pos = 0
+    while pos < len( script ):
+      first_line = _following_line( script, pos )
+      key = ( first_line, _following_line( script, pos + len( first_line ) ) )
+      line_offset = bisect.bisect_left( self.line_endings, pos )  # number of lines before this one
+
+      result = None
+      for ( chunk, following, cached ) in _lint_cache_get( key ):
+        if script.startswith( chunk, pos ) and _following_text( script, pos + len( chunk ) ) == following:
+          result = cached
+          end = pos + len( chunk )
+          break
+
+      if result is None:
+        line = self._lineSyntax( script, pos )
+        if line is None:
+          e = SyntaxFailure( script, pos, True )
+          return 'Incomplete Parsing on line: {0} column: {1}'.format( e.line, e.column )
+
+        ( tree, end ) = line
+        try:
+          ast = self._lineBuild( tree )
+          line_exception = None
+        except Exception as e:
+          ast = []
+          line_exception = 'Exception Parsing "{0}"'.format( e )
+
+        line_check = self._checkError( ast )
+        if line_check is not None:  # line numbers are relative to the start of the line, so the result can be used where ever the line moves to
+          line_check = ( line_check[0], line_check[1].line - line_offset, line_check[1].msg )
+
+        result = ( line_exception, line_check )
+
+        following = _following_text( script, end )
+        if not following.lstrip().startswith( ( 'elif', 'else' ) ):  # the if/else continues past the line, it has to be re-parsed every time
+          _lint_cache_put( key, script[ pos:end ], following, result )
+
+      if exception is None:
+        exception = result[0]
+
+      if result[1] is not None and ( check is None or result[1][0] < check[0] ):
+        check = ( result[1][0], result[1][1] + line_offset, result[1][2] )
+
+      pos = end
+
+    if exception is not None:
+      return exception
+
+    if check is not None:
+      return 'Invalid Script "{0}", line: {1} column: {2}'.format( check[2], check[1], 0 )
 
+    return None
+
+  def _syntax( self, script ):
+    raise NotImplementedError()
+
+  def _build( self, tree ):
+    raise NotImplementedError()
+
+  def _lineSyntax( self, script, pos ):
+    # like _syntax but for only the top level line at pos, returns ( tree, end of line ), or None if the line does not match
+    raise NotImplementedError()
+
+  def _lineBuild( self, tree ):
+    # like _build, for the tree from _lineSyntax, returns the list of AST lines, empty for blank lines
+    raise NotImplementedError()
+
+  def _checkError( self, ast ):  # returns ( depth, ParserError ) for the first problem found, None if no problems
+    node_stack = [ ( ast, 0 ) ]
+
+    while node_stack:
+      node_list, stack_depth = node_stack.pop( 0 )
+      for i in range( 0, len( node_list ) ):
+        line_no = node_list[i][2]
+        node = node_list[i][1]
+        if node[0] == Types.JUMP_POINT and stack_depth > 0:
+          return ( stack_depth, ParserError( line_no, 0, 'Jump points can not be inside begin/end blocks, jump point name: "{0}"'.format( node[1] ) ) )
+
+        elif node[0] == Types.SCOPE:
+          node_stack.append( ( node[1][ '_children' ], stack_depth + 1 ) )
+
+    return None
+
+  def _check( self, ast ):  # TODO: also check infix operators that they are operating against the right type of paramaters, as far as the constansts are anyway
+    error = self._checkError( ast )
+    if error is not None:
+      raise error[1]
+
+  def _optimize( self, ast ):
+    """
+    Folds the parts of the AST that evaluate to the same thing every time into
+    CONSTANTs, infix of constants, arrays and maps of constants, and drops the
+    if/elif branches that can never be taken.  The LINEs are left as they are,
+    so line numbers and status are still reported against the origional script.
+    Anything that would raise an error is left for the runner to raise.
+    """
+    return [ ( Types.LINE, self._fold( line[1] ), line[2] ) for line in ast ]
+
+  def _fold( self, node ):
+    op_type = node[0]
+    op_data = node[1]
+
+    if op_type == Types.INFIX:
+      left = self._fold( op_data[ 'left' ] )
+      right = self._fold( op_data[ 'right' ] )
+      if left[0] == Types.CONSTANT and right[0] == Types.CONSTANT:
+        try:
+          return ( Types.CONSTANT, _constant_infix( op_data[ 'operator' ], left[1], right[1] ) )
+        except Exception:
+          pass
+
+      return ( Types.INFIX, { 'operator': op_data[ 'operator' ], 'left': left, 'right': right } )
+
+    elif op_type == Types.ARRAY:
+      item_list = [ self._fold( item ) for item in op_data ]
+      if all( item[0] == Types.CONSTANT for item in item_list ):
+        return ( Types.CONSTANT, [ item[1] for item in item_list ] )
+
+      return ( Types.ARRAY, item_list )
+
+    elif op_type == Types.MAP:
+      item_map = dict( ( key, self._fold( value ) ) for key, value in op_data.items() )
+      if all( item[0] == Types.CONSTANT for item in item_map.values() ):
+        return ( Types.CONSTANT, dict( ( key, value[1] ) for key, value in item_map.items() ) )
+
+      return ( Types.MAP, item_map )
+
+    elif op_type == Types.IFELSE:
+      branch_list = []
+      for branch in op_data:
+        condition = branch[ 'condition' ]
+        if condition is not None:
+          condition = self._fold( condition )
+          if condition[0] == Types.CONSTANT:
+            if not condition[1]:  # never taken
+              continue
+
+            condition = None  # allways taken, so it is the else
+
+        branch_list.append( { 'condition': condition, 'expression': self._fold( branch[ 'expression' ] ) } )
+        if condition is None:  # nothing after the else can be reached
+          break
+
+      if not branch_list:
+        return ( Types.CONSTANT, None )
+
+      return ( Types.IFELSE, branch_list )
+
+    elif op_type == Types.SCOPE:
+      result = dict( op_data )
+      result[ '_children' ] = self._optimize( op_data[ '_children' ] )
+      return ( Types.SCOPE, result )
+
+    elif op_type == Types.WHILE:
+      return ( Types.WHILE, { 'condition': self._fold( op_data[ 'condition' ] ), 'expression': self._fold( op_data[ 'expression' ] ) } )
+
+    elif op_type == Types.ASSIGNMENT:
+      return ( Types.ASSIGNMENT, { 'target': self._fold( op_data[ 'target' ] ), 'value': self._fold( op_data[ 'value' ] ) } )
+
+    elif op_type == Types.ARRAY_MAP_ITEM:
+      result = dict( op_data )
+      result[ 'index' ] = self._fold( op_data[ 'index' ] )
+      return ( Types.ARRAY_MAP_ITEM, result )
+
+    elif op_type == Types.FUNCTION:
+      result = dict( op_data )
+      result[ 'paramaters' ] = dict( ( key, self._fold( value ) ) for key, value in op_data[ 'paramaters' ].items() )
+      return ( Types.FUNCTION, result )
+
+    elif op_type == Types.EXISTS:
+      return ( Types.EXISTS, self._fold( op_data ) )
+
+    return node
+
+
+class Parser( BaseParser ):  # the parsimonious backend
+  def __init__( self ):
+    super().__init__()
+    self.grammar = _getGrammar()
+
+    # rule name -> handler, anything not a rule (ie: the un-named parts of a rule) is handled by anonymous
+    self.handler_map = { '': self.anonymous }
+    for name in self.grammar.keys():
+      if name[ 0:3 ] in ( 'ws_', 'nl_', 'em_' ):  # ignore white space
+        self.handler_map[ name ] = self.empty
+      else:
+        self.handler_map[ name ] = getattr( self, name, self.anonymous )
+
+  def _syntax( self, script ):
+    try:
+      return self.grammar.parse( script )
+    except IncompleteParseError as e:
+      raise SyntaxFailure( script, e.pos, True )
+    except ParseError as e:
+      raise SyntaxFailure( script, e.pos, False )
+
+  def _build( self, tree ):
+    return self._eval( tree )
+
+  def _lineSyntax( self, script, pos ):
     try:
-      handler = getattr( self, node.expr_name )
-    except AttributeError:
-      handler = self.anonymous
+      node = self.grammar[ 'line' ].match( script, pos )
+    except ParseError:
+      return None
+
+    return ( node, node.end )
+
+  def _lineBuild( self, tree ):
+    value = self._eval( tree )
+    if value is _EMPTY:
+      return []
+
+    return [ value ]
+
+  def _eval( self, node ):
+    return self.handler_map.get( node.expr_name, self.anonymous )( node )
 
-    return handler( node )
+  def empty( self, node ):
+    return _EMPTY
 
   def anonymous( self, node ):
     if len( node.children ) < 1:
-      raise IsEmpty()
+      return _EMPTY
 
     return self._eval( node.children[0] )
 
@@ -167,19 +617,19 @@ class Parser( object ):
 
     result = []
     for child in node.children:
-      try:
-        result.append( self._eval( child ) )
-      except IsEmpty:
-        pass
+      value = self._eval( child )
+      if value is not _EMPTY:
+        result.append( value )
 
     return result
 
   def line( self, node ):
-    for i in range( 0, len( self.line_endings ) ):
-      if self.line_endings[ i ] > node.start:
-        break
+    value = self._eval( node.children[0] )
+    if value is _EMPTY:  # blank/comment only line
+      return _EMPTY
 
-    return ( Types.LINE, self._eval( node.children[0] ), i + 1 )
+    # the index of the first line ending after the start of the node is the line number - 1
+    return ( Types.LINE, value, bisect.bisect_right( self.line_endings, node.start ) + 1 )
 
   def expression( self, node ):
     return self._eval( node.children[1] )
@@ -212,10 +662,11 @@ class Parser( object ):
 
     result = {}
     for item in groups:
-      try:
-        result[ item[1].text ] = self._eval( item[4] )
-      except IsEmpty:
-        raise Exception( 'Paramater values are not allowed to be IsEmpty' )
+      value = self._eval( item[4] )
+      if value is _EMPTY:
+        raise Exception( 'Paramater values are not allowed to be Empty' )
+
+      result[ item[1].text ] = value
 
     return result
 
@@ -337,16 +788,545 @@ class Parser( object ):
 
     return ( Types.ASSIGNMENT, { 'target': target, 'value': self._eval( node.children[3] ) } )
 
-  def _check( self, ast ):  # TODO: also check infix operators that they are operating against the right type of paramaters, as far as the constansts are anyway
-    node_stack = [ ( ast, 0 ) ]
 
-    while node_stack:
-      node_list, stack_depth = node_stack.pop( 0 )
-      for i in range( 0, len( node_list ) ):
-        line_no = node_list[i][2]
-        node = node_list[i][1]
-        if node[0] == Types.JUMP_POINT and stack_depth > 0:
-          raise ParserError( line_no, 0, 'Jump points can not be inside begin/end blocks, jump point name: "{0}"'.format( node[1] ) )
+# for the recursive descent backend
+_label_re = re.compile( r'[a-zA-Z][a-zA-Z0-9_]+' )
+_word_char_re = re.compile( r'[a-zA-Z0-9_]' )
+_ws_s_re = re.compile( r'[ \x09]*' )
+_nl_p_re = re.compile( r'[\x0d\x0a]+' )
+_em_s_re = re.compile( r'[\x0d\x0a \x09]*' )
+_em_p_re = re.compile( r'[\x0d\x0a \x09]+' )
+_comment_re = re.compile( r'#[^\r\n]*' )
+_time_re = re.compile( r'([0-9]{1,2}:){1,3}[0-9]{1,2}' )
+_number_float_re = re.compile( r'[-+]?[0-9]+\.[0-9]+' )
+_number_int_re = re.compile( r'[-+]?[0-9]+' )
+_true_re = re.compile( r'[Tt]rue' )
+_false_re = re.compile( r'[Ff]alse' )
+_none_re = re.compile( r'[Nn]one' )
+_not_re = re.compile( r'[Nn]ot' )
+_text_re = re.compile( r"'([^']*)'|\"([^\"]*)\"" )
+
+_RESERVED_WORD_LIST = ( 'begin', 'end', 'while', 'do', 'goto', 'exists', 'continue', 'break', 'pass' )
+_OTHER_LIST = ( 'continue', 'break', 'pass' )
+_INFIX_OPERATOR_LIST = ( '.', '^', '*', '/', '%', '+', '-', '&', '|', 'and', 'or', '==', '!=', '<=', '>=', '>', '<' )
+_SCOPE_OPTION_LIST = ( 'description', 'expected_time', 'max_time' )
+
+
+class RecursiveDescentParser( BaseParser ):
+  """
+  Hand written backend, it follows script_grammar rule for rule, including the
+  ordering of the alternatives, so it accepts the same scripts and produces the
+  same AST, it works directly on the text and builds the AST as it goes
+  instead of building a parse tree first.  The rule methods return a tuple of
+  ( <value>, <position after the match> ), or None if the rule did not match.
+  value_expression, variable and array_map_item are re-tried at the same
+  position by the alternatives that fail, their results are memoized.
+  """
+  def _syntax( self, script ):
+    self._start( script )
+
+    ( ast, pos ) = self._lines( 0 )
+    if pos != len( script ):
+      raise SyntaxFailure( script, pos, True )
+
+    return ast
+
+  def _lineSyntax( self, script, pos ):
+    if script is not getattr( self, 'text', None ):
+      self._start( script )
+
+    return self._line( pos )
+
+  def _lineBuild( self, tree ):
+    if tree is None:
+      return []
 
-        elif node[0] == Types.SCOPE:
-          node_stack.append( ( node[1][ '_children' ], stack_depth + 1 ) )
+    return self._build( [ tree ] )
+
+  def _start( self, script ):
+    self.text = script
+    self.value_expression_memo = {}
+    self.variable_memo = {}
+    self.array_map_item_memo = {}
+    self.scope_error_list = []
+
+    self.expression_rule_list = ( self._jump_point, self._goto, self._function, self._ifelse, self._whiledo, self._block, self._assignment, self._infix, self._boolean, self._not, self._none, self._exists, self._other, self._array_map_item, self._array, self._map, self._variable, self._time, self._number_float, self._number_int, self._text )
+    self.value_expression_rule_list = ( self._function, self._assignment, self._infix, self._boolean, self._not, self._none, self._exists, self._array_map_item, self._array, self._map, self._variable, self._time, self._number_float, self._number_int, self._text )
+    self.constant_expression_rule_list = ( self._boolean, self._none, self._time, self._number_float, self._number_int, self._text )
+
+  def _build( self, tree ):
+    # the invalid scope options are not errors untill the block is known to be part of the final AST, the same as the parsimonious backend
+    if self.scope_error_list:
+      scope_set = set()
+      node_stack = [ tree ]
+      while node_stack:
+        node = node_stack.pop()
+        if isinstance( node, ( list, tuple ) ):
+          if len( node ) > 1 and node[0] == Types.SCOPE and isinstance( node[1], dict ):
+            scope_set.add( id( node[1] ) )
+          node_stack += node
+        elif isinstance( node, dict ):
+          node_stack += node.values()
+
+      for _, options, msg in sorted( self.scope_error_list, key=lambda item: item[0] ):
+        if id( options ) in scope_set:
+          raise Exception( msg )
+
+    return tree
+
+  def _ws_s( self, pos ):
+    return _ws_s_re.match( self.text, pos ).end()
+
+  def _label( self, pos ):
+    match = _label_re.match( self.text, pos )
+    if match is None:
+      return None
+
+    return ( match.group(), match.end() )
+
+  def _reserved( self, pos ):
+    for word in _RESERVED_WORD_LIST:
+      if self.text.startswith( word, pos ):
+        return _word_char_re.match( self.text, pos + len( word ) ) is None
+
+    return False
+
+  def _module_name( self, pos ):  # ( label "." )? label
+    module = None
+    result = self._label( pos )
+    if result is None:
+      return None
+
+    if self.text.startswith( '.', result[1] ):
+      module = result[0]
+      result = self._label( result[1] + 1 )
+      if result is None:  # PEG does not go back and try with out the optional part
+        return None
+
+    return ( module, result[0], result[1] )
+
+  def _lines( self, pos ):
+    result = []
+    while True:
+      line = self._line( pos )
+      if line is None:
+        return ( result, pos )
+
+      if line[0] is not None:
+        result.append( line[0] )
+
+      pos = line[1]
+
+  def _line( self, pos ):
+    expression = self._expression( pos )
+    if expression is None:
+      value = None
+      cur = self._ws_s( pos )
+    else:
+      ( value, cur ) = expression
+
+    match = _comment_re.match( self.text, cur )
+    if match is not None:
+      cur = match.end()
+
+    match = _nl_p_re.match( self.text, cur )
+    if match is None:
+      return None
+
+    if value is None:
+      return ( None, match.end() )
+
+    return ( ( Types.LINE, value, bisect.bisect_right( self.line_endings, pos ) + 1 ), match.end() )
+
+  def _first( self, rule_list, pos ):
+    start = self._ws_s( pos )
+    for rule in rule_list:
+      result = rule( start )
+      if result is not None:
+        return ( result[0], self._ws_s( result[1] ) )
+
+    return None
+
+  def _expression( self, pos ):
+    return self._first( self.expression_rule_list, pos )
+
+  def _value_expression( self, pos ):
+    try:
+      return self.value_expression_memo[ pos ]
+    except KeyError:
+      pass
+
+    result = self._first( self.value_expression_rule_list, pos )
+    self.value_expression_memo[ pos ] = result
+    return result
+
+  def _constant_expression( self, pos ):
+    return self._first( self.constant_expression_rule_list, pos )
+
+  def _jump_point( self, pos ):
+    if not self.text.startswith( ':', pos ):
+      return None
+
+    label = self._label( pos + 1 )
+    if label is None:
+      return None
+
+    return ( ( Types.JUMP_POINT, label[0] ), label[1] )
+
+  def _goto( self, pos ):
+    if not self.text.startswith( 'goto ', pos ):
+      return None
+
+    label = self._label( pos + 5 )
+    if label is None:
+      return None
+
+    return ( ( Types.GOTO, label[0] ), label[1] )
+
+  def _paramater( self, pos, value_rule ):  # ws_s label ws_s "=" <value_rule>
+    label = self._label( self._ws_s( pos ) )
+    if label is None:
+      return None
+
+    cur = self._ws_s( label[1] )
+    if not self.text.startswith( '=', cur ):
+      return None
+
+    value = value_rule( cur + 1 )
+    if value is None:
+      return None
+
+    return ( label[0], value[0], value[1] )
+
+  def _paramater_map( self, pos, value_rule=None ):
+    if value_rule is None:
+      value_rule = self._value_expression
+
+    item_list = []
+    cur = pos
+    while True:
+      item = self._paramater( cur, value_rule )
+      if item is None or not self.text.startswith( ',', item[2] ):
+        break
+
+      item_list.append( item )
+      cur = item[2] + 1
+
+    if item is None:  # the whole group is optional, nothing matched
+      return ( {}, self._ws_s( pos ) )
+
+    # the same order the parsimonious backend builds the map in, the last paramater first
+    result = { item[0]: item[1] }
+    for name, value, _ in item_list:
+      result[ name ] = value
+
+    return ( result, self._ws_s( item[2] ) )
+
+  def _const_paramater_map( self, pos ):
+    ( result, cur ) = self._paramater_map( pos, self._constant_expression )
+    for key in result.keys():  # constant_expression only matches constants, so there is no need to check the type
+      result[ key ] = result[ key ][1]
+
+    return ( result, cur )
+
+  def _block( self, pos ):
+    if not self.text.startswith( 'begin(', pos ):
+      return None
+
+    ( options, cur ) = self._const_paramater_map( pos + 6 )
+    if not self.text.startswith( ')', cur ):
+      return None
+
+    ( children, cur ) = self._lines( cur + 1 )
+    cur = self._ws_s( cur )
+    if not self.text.startswith( 'end', cur ):
+      return None
+
+    for name in options.keys():
+      if name not in _SCOPE_OPTION_LIST:
+        self.scope_error_list.append( ( pos, options, 'Scope option "{0}" not valid'.format( name ) ) )
+        break
+
+    options[ '_children' ] = children
+
+    return ( ( Types.SCOPE, options ), cur + 3 )
+
+  def _whiledo( self, pos ):
+    if not self.text.startswith( 'while', pos ):
+      return None
+
+    condition = self._value_expression( pos + 5 )
+    if condition is None or not self.text.startswith( 'do', condition[1] ):
+      return None
+
+    match = _em_p_re.match( self.text, condition[1] + 2 )
+    if match is None:
+      return None
+
+    expression = self._expression( match.end() )
+    if expression is None:
+      return None
+
+    return ( ( Types.WHILE, { 'condition': condition[0], 'expression': expression[0] } ), expression[1] )
+
+  def _other( self, pos ):
+    for word in _OTHER_LIST:
+      if self.text.startswith( word, pos ):
+        return ( ( Types.OTHER, word ), pos + len( word ) )
+
+    return None
+
+  def _branch( self, pos, keyword ):  # keyword value_expression "then" em_p expression
+    if not self.text.startswith( keyword, pos ):
+      return None
+
+    condition = self._value_expression( pos + len( keyword ) )
+    if condition is None or not self.text.startswith( 'then', condition[1] ):
+      return None
+
+    match = _em_p_re.match( self.text, condition[1] + 4 )
+    if match is None:
+      return None
+
+    expression = self._expression( match.end() )
+    if expression is None:
+      return None
+
+    return ( { 'condition': condition[0], 'expression': expression[0] }, expression[1] )
+
+  def _ifelse( self, pos ):
+    branch = self._branch( pos, 'if' )
+    if branch is None:
+      return None
+
+    branches = [ branch[0] ]
+    cur = branch[1]
+    while True:
+      branch = self._branch( _em_s_re.match( self.text, cur ).end(), 'elif' )
+      if branch is None:
+        break
+
+      branches.append( branch[0] )
+      cur = branch[1]
+
+    else_pos = _em_s_re.match( self.text, cur ).end()
+    if self.text.startswith( 'else', else_pos ):
+      match = _em_p_re.match( self.text, else_pos + 4 )
+      if match is not None:
+        expression = self._expression( match.end() )
+        if expression is not None:
+          branches.append( { 'condition': None, 'expression': expression[0] } )
+          cur = expression[1]
+
+    return ( ( Types.IFELSE, branches ), cur )
+
+  def _not( self, pos ):
+    if _not_re.match( self.text, pos ) is None:
+      return None
+
+    value = self._value_expression( pos + 3 )
+    if value is None:
+      return None
+
+    return ( ( Types.INFIX, { 'operator': 'not', 'left': value[0], 'right': ( Types.CONSTANT, None ) } ), value[1] )
+
+  def _time( self, pos ):  # days:hours:mins:seconds
+    match = _time_re.match( self.text, pos )
+    if match is None:
+      return None
+
+    parts = [ int( i ) for i in match.group().split( ':' ) ]
+
+    if len( parts ) == 4:
+      value = timedelta( days=parts[0], hours=parts[1], minutes=parts[2], seconds=parts[3] )
+    elif len( parts ) == 3:
+      value = timedelta( hours=parts[0], minutes=parts[1], seconds=parts[2] )
+    else:
+      value = timedelta( minutes=parts[0], seconds=parts[1] )
+
+    return ( ( Types.CONSTANT, value ), match.end() )
+
+  def _number_float( self, pos ):
+    match = _number_float_re.match( self.text, pos )
+    if match is None:
+      return None
+
+    return ( ( Types.CONSTANT, float( match.group() ) ), match.end() )
+
+  def _number_int( self, pos ):
+    match = _number_int_re.match( self.text, pos )
+    if match is None:
+      return None
+
+    return ( ( Types.CONSTANT, int( match.group() ) ), match.end() )
+
+  def _text( self, pos ):
+    match = _text_re.match( self.text, pos )
+    if match is None:
+      return None
+
+    value = match.group( 1 )
+    if value is None:
+      value = match.group( 2 )
+
+    return ( ( Types.CONSTANT, value ), match.end() )
+
+  def _boolean( self, pos ):
+    match = _true_re.match( self.text, pos )
+    if match is not None:
+      return ( ( Types.CONSTANT, True ), match.end() )
+
+    match = _false_re.match( self.text, pos )
+    if match is not None:
+      return ( ( Types.CONSTANT, False ), match.end() )
+
+    return None
+
+  def _none( self, pos ):
+    match = _none_re.match( self.text, pos )
+    if match is None:
+      return None
+
+    return ( ( Types.CONSTANT, None ), match.end() )
+
+  def _exists( self, pos ):
+    if not self.text.startswith( 'exists(', pos ):
+      return None
+
+    cur = self._ws_s( pos + 7 )
+    value = self._array_map_item( cur )
+    if value is None:
+      value = self._variable( cur )
+      if value is None:
+        return None
+
+    cur = self._ws_s( value[1] )
+    if not self.text.startswith( ')', cur ):
+      return None
+
+    return ( ( Types.EXISTS, value[0] ), cur + 1 )
+
+  def _array( self, pos ):
+    if not self.text.startswith( '[', pos ):
+      return None
+
+    values = []
+    cur = pos + 1
+    while True:
+      value = self._value_expression( cur )
+      if value is None or not self.text.startswith( ',', value[1] ):
+        break
+
+      values.append( value[0] )
+      cur = value[1] + 1
+
+    if value is None:  # the values are optional, nothing matched
+      values = []
+      cur = pos + 1
+    else:
+      values.append( value[0] )
+      cur = value[1]
+
+    cur = self._ws_s( cur )
+    if not self.text.startswith( ']', cur ):
+      return None
+
+    return ( ( Types.ARRAY, values ), cur + 1 )
+
+  def _map( self, pos ):
+    if not self.text.startswith( '{', pos ):
+      return None
+
+    ( values, cur ) = self._paramater_map( pos + 1 )
+    if not self.text.startswith( '}', cur ):
+      return None
+
+    return ( ( Types.MAP, values ), cur + 1 )
+
+  def _variable( self, pos ):
+    try:
+      return self.variable_memo[ pos ]
+    except KeyError:
+      pass
+
+    result = None
+    if not self._reserved( pos ):
+      name = self._module_name( pos )
+      if name is not None and not self.text.startswith( '(', name[2] ):
+        result = ( ( Types.VARIABLE, { 'module': name[0], 'name': name[1] } ), name[2] )
+
+    self.variable_memo[ pos ] = result
+    return result
+
+  def _function( self, pos ):
+    if self._reserved( pos ):
+      return None
+
+    name = self._module_name( pos )
+    if name is None or not self.text.startswith( '(', name[2] ):
+      return None
+
+    ( params, cur ) = self._paramater_map( name[2] + 1 )
+    if not self.text.startswith( ')', cur ):
+      return None
+
+    return ( ( Types.FUNCTION, { 'module': name[0], 'name': name[1], 'paramaters': params } ), cur + 1 )
+
+  def _array_map_item( self, pos ):
+    try:
+      return self.array_map_item_memo[ pos ]
+    except KeyError:
+      pass
+
+    result = None
+    variable = self._variable( pos )
+    if variable is not None and self.text.startswith( '[', variable[1] ):
+      index = self._value_expression( variable[1] + 1 )
+      if index is not None and self.text.startswith( ']', index[1] ):
+        result = ( ( Types.ARRAY_MAP_ITEM, { 'module': variable[0][1][ 'module' ], 'name': variable[0][1][ 'name' ], 'index': index[0] } ), index[1] + 1 )
+
+    self.array_map_item_memo[ pos ] = result
+    return result
+
+  def _infix( self, pos ):
+    if not self.text.startswith( '(', pos ):
+      return None
+
+    left = self._value_expression( pos + 1 )
+    if left is None:
+      return None
+
+    for operator in _INFIX_OPERATOR_LIST:
+      if self.text.startswith( operator, left[1] ):
+        break
+    else:
+      return None
+
+    right = self._value_expression( left[1] + len( operator ) )
+    if right is None or not self.text.startswith( ')', right[1] ):
+      return None
+
+    return ( ( Types.INFIX, { 'operator': operator, 'left': left[0], 'right': right[0] } ), right[1] + 1 )
+
+  def _assignment( self, pos ):
+    target = self._array_map_item( pos )
+    if target is None:
+      target = self._variable( pos )
+      if target is None:
+        return None
+
+    cur = self._ws_s( target[1] )
+    if not self.text.startswith( '=', cur ):
+      return None
+
+    value = self._value_expression( cur + 1 )
+    if value is None:
+      return None
+
+    return ( ( Types.ASSIGNMENT, { 'target': target[0], 'value': value[0] } ), value[1] )
+
+
+backend_map = {
+                'parsimonious': Parser,
+                'recursive_descent': RecursiveDescentParser
+              }
@@ -1,13 +1,43 @@
 import pytest
+import random
 from datetime import timedelta
 
-from factory.script.parser import parse, lint, ParserError, Parser
+from factory.script import parser
+from factory.script.parser import parse, parse_cached, script_hash, lint, lint_incremental, value_keys, function_modules, ParserError, Parser
+
+
+@pytest.fixture( autouse=True, params=sorted( parser.backend_map.keys() ) )
+def backend( request, monkeypatch ):  # run every test against each of the parser backends
+  monkeypatch.setattr( parser, 'BACKEND', request.param )
+  return request.param
 
 
 def test_gramer_parses():
   Parser()
 
 
+def test_grammar_shared():
+  assert Parser().grammar is Parser().grammar
+
+
+def test_parse_cached():
+  node = parse_cached( 'var = 10' )
+  assert node == parse( 'var = 10' )
+  assert parse_cached( 'var = 10' ) is node
+  assert parse_cached( 'var = 11' ) is not node
+
+  with pytest.raises( ParserError ):
+    parse_cached( 'begin()' )
+
+
+def test_script_hash( monkeypatch ):
+  value = script_hash( 'var = 10' )
+  assert script_hash( 'var = 10' ) == value
+  assert script_hash( 'var = 11' ) != value
+  monkeypatch.setattr( parser, 'AST_VERSION', parser.AST_VERSION + 1 )
+  assert script_hash( 'var = 10' ) != value
+
+
 def test_begin():
   node = parse( '' )
   assert node == ( 'S', { '_children': [], 'description': 'Overall Script' } )
@@ -1018,3 +1048,107 @@ def test_exists():
                            'expression': ( 'C', 10 ) }
                          ] ),
                     1 ) ], 'description': 'Overall Script' } )
+
+
+def test_lint_incremental( monkeypatch ):
+  parser._lint_cache.clear()
+
+  script = 'var = 1\nbegin( description="first" )\nother = ( var + 1 )\nend\nif ( var == 1 ) then other = 2\nelse other = 3\n:here\ngoto here'
+  assert lint_incremental( script ) is None
+  assert lint_incremental( script ) == lint( script )
+
+  parser_class = parser.backend_map[ parser.BACKEND ]
+  line_syntax = parser_class._lineSyntax
+  call_list = []
+
+  def _lineSyntax( self, script, pos ):
+    call_list.append( pos )
+    return line_syntax( self, script, pos )
+
+  monkeypatch.setattr( parser_class, '_lineSyntax', _lineSyntax )
+  assert lint_incremental( script ) is None
+  assert len( call_list ) == 0
+
+  call_list.clear()
+  edited = script.replace( 'other = ( var + 1 )', 'other = ( var + 2 )' )
+  assert lint_incremental( edited ) is None
+  assert call_list == [ edited.index( 'begin(' ) ]  # only the begin/end block changed
+
+  for script in ( 'begin()', 'var = 1\nbegin()\nvar = 2', 'var = 1\nbegin()\n:there\nend', 'begin()\nbegin()\n:deep\nend\nend\nbegin()\n:there\nend',
+                  'begin( bad=1 )\nend', 'var = 1\n\nbegin()\nvar = 2\nend', 'if True then 10\nelif False 200', 'if True then 10\nelse\n  20', 'asdf =' ):
+    assert lint_incremental( script ) == lint( script )
+    assert lint_incremental( script ) == lint( script )
+
+
+def test_lint_incremental_history():  # the cached lines must still be valid with what follows them now
+  parser._lint_cache.clear()
+  assert lint_incremental( 'if ( aa == 1 ) then\n  bb = 1\n  \ncc = 2' ) is None
+  script = 'if ( aa == 1 ) then\n  bb = 1\n  \nelif ( aa == 2 ) then\n  bb = 3'
+  assert lint( script ) is None
+  assert lint_incremental( script ) is None
+
+  line_list = [ 'if ( aa == 1 ) then', '  bb = 1', '  ', '', '\t', 'elif ( aa == 2 ) then', 'else', '  bb = 4', 'cc = 2', 'else 5', 'begin()', 'end',
+                'asdf =', 'zz = ( 1 + )', 'if True then 10', '# comment', ':jp', 'goto jp', 'goto nowhere', 'begin( bad=1 )', 'if ( aa == 1 ) then bb = 2' ]
+  rand = random.Random( 1 )
+  script_lines = []
+  for _ in range( 0, 1000 ):  # random edits, each one linted with the cache from the ones before
+    i = rand.randint( 0, len( script_lines ) )
+    if script_lines and rand.random() < 0.4:
+      del script_lines[ min( i, len( script_lines ) - 1 ) ]
+    else:
+      script_lines.insert( i, rand.choice( line_list ) )
+
+    script_lines = script_lines[ -12: ]
+    script = '\n'.join( script_lines )
+    assert lint_incremental( script ) == lint( script ), script
+
+
+def test_optimize():
+  node = parse( 'var = ( 1 + 2 )', True )
+  assert node == ( 'S', { '_children': [ ( 'L', ( 'A', { 'target': ( 'V', { 'module': None, 'name': 'var' } ), 'value': ( 'C', 3 ) } ), 1 ) ], 'description': 'Overall Script' } )
+
+  node = parse( 'var = ( ( 1 * 2 ) + ( "a" . 3 ) )', True )
+  assert node[1][ '_children' ][0][1][1][ 'value' ] == ( 'X', { 'operator': '+', 'left': ( 'C', 2 ), 'right': ( 'C', 'a3' ) } )
+
+  node = parse( 'var = not True\nvar = ( 1 / 0 )\nvar = ( 2 ^ 1000 )', True )
+  assert [ line[1][1][ 'value' ] for line in node[1][ '_children' ] ] == [ ( 'C', False ),
+                                                                           ( 'X', { 'operator': '/', 'left': ( 'C', 1 ), 'right': ( 'C', 0 ) } ),
+                                                                           ( 'X', { 'operator': '^', 'left': ( 'C', 2 ), 'right': ( 'C', 1000 ) } ) ]
+
+  node = parse( 'var = [ 1, ( 2 + 3 ), { aa=[ 4 ] } ]\nvar = [ 1, other ]\nvar = { aa=1, bb=other }', True )
+  assert [ line[1][1][ 'value' ] for line in node[1][ '_children' ] ] == [ ( 'C', [ 1, 5, { 'aa': [ 4 ] } ] ),
+                                                                           ( 'Y', [ ( 'C', 1 ), ( 'V', { 'module': None, 'name': 'other' } ) ] ),
+                                                                           ( 'M', { 'aa': ( 'C', 1 ), 'bb': ( 'V', { 'module': None, 'name': 'other' } ) } ) ]
+
+  node = parse( 'begin()\n\nif False then 1 elif ( aa == 1 ) then 2 elif ( 1 == 1 ) then 3 else 4\nif False then 5\nend', True )
+  assert node[1][ '_children' ][0][1][1][ '_children' ] == [ ( 'L', ( 'I', [ { 'condition': ( 'X', { 'operator': '==', 'left': ( 'V', { 'module': None, 'name': 'aa' } ), 'right': ( 'C', 1 ) } ), 'expression': ( 'C', 2 ) },
+                                                                             { 'condition': None, 'expression': ( 'C', 3 ) } ] ), 3 ),
+                                                             ( 'L', ( 'C', None ), 4 ) ]
+
+  node = parse( 'while ( aa < ( 2 * 5 ) ) do myfunc( value=( 1 + 1 ) )\nvar[ ( 1 + 1 ) ] = exists( var[ ( 2 - 1 ) ] )', True )
+  assert node[1][ '_children' ][0][1][1][ 'condition' ][1][ 'right' ] == ( 'C', 10 )
+  assert node[1][ '_children' ][0][1][1][ 'expression' ][1][ 'paramaters' ] == { 'value': ( 'C', 2 ) }
+  assert node[1][ '_children' ][1][1][1][ 'target' ][1][ 'index' ] == ( 'C', 2 )
+  assert node[1][ '_children' ][1][1][1][ 'value' ] == ( 'E', ( 'R', { 'module': None, 'name': 'var', 'index': ( 'C', 1 ) } ) )
+  assert node[1][ '_children' ][1][2] == 2
+
+  assert parse( 'var = ( 1 + aa )', True ) == parse( 'var = ( 1 + aa )' )
+
+
+def test_value_keys():
+  assert value_keys( parse( 'aa = 1' ), 'part', 'values' ) == set()
+  assert value_keys( parse( 'aa = part.values[ "name" ]\nif exists( part.values[ "size" ] ) then part.values[ "name" ]' ), 'part', 'values' ) == { 'name', 'size' }
+  assert value_keys( parse( 'begin( description="stuff" )\nwhile ( cnt < 2 ) do begin()\ntesting.count( stop_at=part.values[ "count" ], count_by=1 )\ncnt = [ 1, { aa=part.values[ "other" ] } ]\nend\nend' ), 'part', 'values' ) == { 'count', 'other' }
+  assert value_keys( parse( 'aa = part.values[ ( "na" . "me" ) ]', True ), 'part', 'values' ) == { 'name' }
+  assert value_keys( parse( 'aa = part.part\nbb = values[ "name" ]\ncc = other.values[ "name" ]' ), 'part', 'values' ) == set()
+  assert value_keys( parse( 'aa = "name"\nbb = part.values[ aa ]' ), 'part', 'values' ) is None
+  assert value_keys( parse( 'aa = part.values[ "name" ]\nbb = part.values' ), 'part', 'values' ) is None
+  assert value_keys( parse( 'aa = len( array=part.values )' ), 'part', 'values' ) is None
+
+
+def test_function_modules():
+  assert function_modules( parse( 'aa = 1' ) ) == set()
+  assert function_modules( parse( 'aa = len( array=[ 1 ] )\ndelay( seconds=1 )\nbb = part.values[ "name" ]' ) ) == set()
+  assert function_modules( parse( 'testing.remote()' ) ) == { 'testing' }
+  assert function_modules( parse( 'begin()\nwhile ( cnt < 2 ) do begin()\naa = [ 1, { bb=other.get( name=part.values[ "name" ] ) } ]\nend\nend\ntesting.count( stop_at=1 )' ) ) == { 'other', 'testing' }
+  assert function_modules( parse( 'aa = len( array=testing.list() )' ) ) == { 'testing' }
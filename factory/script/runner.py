@@ -1,13 +1,17 @@
 import sys
+import time
 import uuid
 import traceback
 import datetime
 import copy
 import logging
+from collections import deque
 from importlib import import_module
 from django.conf import settings
 
 from factory.script.parser import Types
+from factory.script.values import share, owned, detached
+from factory.script.frame import NO_VALUE, frame_class_map, pack_state, unpack_state, frames_from_lists, ScopeFrame
 
 
 # thrown when the scipt would like to pause execution, calling run() resumes execution
@@ -160,6 +164,13 @@ class ExternalFunction( object ):
     # if the returned value is an instance of Exception, it is raised and the return value is None, the function is considered executed
     return None
 
+  @property
+  def next_check( self ):
+    # return the utc datetime done could next become True at, if that is known, None if it could be at any time
+    # the job is not run again until then, unless something else happens to it, ie: fromAssembler
+    # THIS MUST NOT HANG/PAUSE/WAIT/POLL
+    return None
+
   def run( self ):
     # called after done is checked and returns False
     # raising Pause is allowed
@@ -231,6 +242,12 @@ class Interrupt( Exception ):
   pass
 
 
+# run()'s time_limit was reached, run() returns and the next run() carries on from here
+class TimeLimit( Interrupt ):
+  def __init__( self ):
+    super().__init__( 'Not Complete' )
+
+
 class Delay( ExternalFunction ):
   def __init__( self, *args, **kwargs ):
     super().__init__( *args, **kwargs )
@@ -244,6 +261,10 @@ class Delay( ExternalFunction ):
   def message( self ):
     return 'Waiting for {0} more seconds'.format( ( self.end_at - datetime.datetime.utcnow() ).seconds )
 
+  @property
+  def next_check( self ):
+    return self.end_at
+
   def setup( self, parms ):
     seconds = 0
     minutes = 0
@@ -279,7 +300,7 @@ builtin_function_map = {
                           'len': lambda array: len( array ),
                           'slice': lambda array, start, end: array[ start:end ],
                           'pop': lambda array, index=-1: array.pop( index ),
-                          'append': lambda array, value: array.append( value ),
+                          'append': lambda array, value: array.append( share( value ) ),
                           'index': lambda array, value: array.index( value ),
                           'pause': lambda msg: Pause( msg ),
                           'error': lambda msg: ExecutionError( msg ),
@@ -289,6 +310,21 @@ builtin_function_map = {
                         }
 
 
+# builtin functions that change one of their paramaters in place, and the name of that paramater
+builtin_mutating_map = {
+                         'append': 'array',
+                         'pop': 'array'
+                       }
+
+
+def _is_item_paramater( op_data, key ):  # the paramater key of the FUNCTION op_data is a variable's array/map item that the builtin changes in place
+  if op_data[ 'module' ] is not None or builtin_mutating_map.get( op_data[ 'name' ] ) != key:
+    return False
+
+  paramater = op_data[ 'paramaters' ][ key ]
+  return paramater[0] == Types.ARRAY_MAP_ITEM and paramater[1][ 'module' ] is None
+
+
 infix_string_operator_map = {
                               '.': lambda a, b: a + b,
                             }
@@ -316,6 +352,18 @@ infix_logical_operator_map = {
                                'not': lambda a, b: not bool( a )
                              }
 
+# trace levels, the trace buffer records events at or below the runner's trace_level
+TRACE_OFF = 0
+TRACE_RUN = 1   # start and end of each run()
+TRACE_STEP = 2  # every evaluation step, this is expensive, only for debugging a script
+
+TRACE_BUFFER_SIZE = 1000  # default number of trace events kept
+
+_script_module_map = {}  # module name -> ( SCRIPT_NAME, SCRIPT_FUNCTIONS, SCRIPT_VALUES ), so restoring a runner does not import it's modules again
+
+TIME_CHECK_STEPS = 100  # with a time_limit, the clock is checked every this many steps
+RUN_TTL = 1000  # default max steps of run() without a time_limit
+
 
 def _debugDump( message, exception, ast, state ):
   import os
@@ -352,6 +400,19 @@ def _debugDump( message, exception, ast, state ):
     print( 'Error "{0}" when writing the debug dump'.format( e ) )
 
 
+def _status_percentages( item_list ):  # item_list from _statusItems, returns ( % complete, scope type, scope data, frame, expected time )
+  result = []
+  last_perc_complete = 0
+  for item in reversed( item_list ):  # work backwards, as we go up, we scale the last perc_complete acording to the % of the curent scope
+    # before + -> scaling the last % complete .... after the +  -> the curent %
+    perc_complete = ( 1.0 / item[1] ) * last_perc_complete + ( 100.0 * item[0] ) / item[1]
+    result.append( ( perc_complete, item[2], item[3], item[4], item[5] ) )
+    last_perc_complete = perc_complete
+
+  result.reverse()
+  return result
+
+
 def _delta_to_string( delta ):
   sign = ''
   seconds = int( delta.total_seconds() )
@@ -374,22 +435,27 @@ def _delta_to_string( delta ):
 
 
 class Runner( object ):
-  def __init__( self, ast ):
+  def __init__( self, ast, ast_hash=None ):
     super().__init__()
     self.ast = ast
+    self.ast_hash = ast_hash  # key of the AST when it is kept in an external store, not serilized, it is up to the store to restore it
 
     # serilize
     self.module_list = []   # list of the loaded modules
     self.object_list = []   # list of loaded embeded objects
-    self.state = []         # list of ( <type>, work values, [ return value ] ), for each level of the AST to the curent execution point
+    self.state = []         # list of Frame, for each level of the AST to the curent execution point, see frame.py
     self.variable_map = {}  # map of the variables, they are all global
     self.cur_line = 0
     self.factory_cookie = None
+    self.trace_level = TRACE_OFF
+    self.trace_buffer = None  # deque of ( timestamp, line, event, detail ), only when tracing is enabled
 
     # do not serlize
     self.jump_point_map = {}
     self.function_map = {}
     self.value_map = {}
+    self._step_trace = False  # set by run(), True if each step needs to be traced/logged
+    self._status = None       # status, less the times and dispatched flags, cleared when the state changes
 
     # scan for all the jump points
     for i in range( 0, len( ast[1][ '_children' ] ) ):
@@ -409,98 +475,146 @@ class Runner( object ):
   def aborted( self ):
     return self.state == 'ABORTED'
 
+  @property
+  def blocked( self ):  # waiting on the assembler for the results of a dispatched function, running it does nothing until fromAssembler
+    frame = self._externalFrame()
+    return frame is not None and frame.dispatched is True
+
+  @property
+  def wake_at( self ):  # utc, running it before this does nothing, unless something else happens to it, None if it could make progress now, or when blocked or pending, only when the assembler does something
+    frame = self._externalFrame()
+    if frame is None:
+      return None
+
+    wake_at = None
+    if not frame.dispatched:
+      frame.handler._runner = self
+      try:
+        wake_at = frame.handler.next_check
+      except Exception:
+        return None  # running it will find out what is wrong
+
+      if wake_at is None and self.pending is None:
+        return None
+
+    for scope in self.state:  # a scope's max time can be up before then
+      if scope.op_type == Types.SCOPE and scope.max_time_at is not None and ( wake_at is None or scope.max_time_at < wake_at ):
+        wake_at = scope.max_time_at
+
+    return wake_at
+
+  @property
+  def pending( self ):  # ( module, function name ) of the external function waiting to go to the assembler, only an assembler with the module can move it along, None if there isn't one
+    frame = self._externalFrame()
+    if frame is None or frame.dispatched or type( frame.handler ).toAssembler is ExternalFunction.toAssembler:  # dispatched allready, or it never goes to the assembler
+      return None
+
+    return ( frame.module, frame.name )
+
+  def _externalFrame( self ):  # the FunctionFrame of the external function the script is stopped in, None if it isn't in one
+    if self.done or self.aborted or not self.state:
+      return None
+
+    frame = self.state[ -1 ]
+    if frame.op_type != Types.FUNCTION or frame.dispatched is None:
+      return None
+
+    return frame
+
+  @property
+  def trace( self ):
+    if self.trace_buffer is None:
+      return []
+
+    return list( self.trace_buffer )
+
+  def enableTrace( self, level=TRACE_RUN, size=TRACE_BUFFER_SIZE ):
+    self.trace_level = level
+    if self.trace_buffer is None or self.trace_buffer.maxlen != size:
+      self.trace_buffer = deque( self.trace_buffer or [], maxlen=size )
+
+  def disableTrace( self ):
+    self.trace_level = TRACE_OFF
+    self.trace_buffer = None
+
+  def _trace( self, level, event, detail=None ):  # detail must be serilizable
+    if self.trace_level >= level:
+      self.trace_buffer.append( ( datetime.datetime.utcnow(), self.cur_line, event, detail ) )
+
+  def _traceStep( self, state_index, operation ):
+    logging.debug( 'runner: _evaluate level: "%s" operation: "%s"', state_index, operation )
+    logging.debug( 'runner: _evaluate level: "%s" start state: "%s"', state_index, self.state )
+    self._trace( TRACE_STEP, 'step', ( state_index, operation[0] ) )
+
   @property
   def status( self ):  # list of ( % complete, status message )
-    logging.debug( 'runner: status state: {0}'.format( self.state ) )
     if self.done or self.aborted:
       return [ ( 100.0, 'Scope', None ) ]
     if len( self.state ) == 0:
       return [ ( 0.0, 'Scope', None ) ]
 
-    item_list = []  # ( scope position, scope length, scope type, scope data )
-    operation = self.ast
-    for step in self.state:  # condense into on loop, last status may be a blocking function with remote and status values
-      step_type = step[0]
-      try:
-        step_data = step[1]
-      except IndexError:
-        step_data = None
+    if self._status is None:  # the state is only walked again after it has changed, see run(), goto() and __setstate__()
+      logging.debug( 'runner: status state: %s', self.state )
+      self._status = _status_percentages( self._statusItems() )
 
-      if step_type == Types.SCOPE:
-        tmp = {}
-        for item in ( 'description', ):
-          try:
-            tmp[ item ] = operation[1][ item ]
-          except ( KeyError, TypeError ):
-            pass
+    result = []
+    for perc_complete, step_type, data, frame, expected_time in self._status:
+      data = data.copy()
+      if expected_time is not None and frame.started is not None:  # the time and dispatched flag change without the state being walked again
+        elapsed = datetime.datetime.utcnow() - frame.started
+        data[ 'time_elapsed' ] = _delta_to_string( elapsed )
+        data[ 'time_remaining' ] = _delta_to_string( expected_time - elapsed )
 
-        if 'expected_time' in operation[1]:
-          elapsed = datetime.datetime.utcnow() - step[2]
-          tmp[ 'time_elapsed' ] = _delta_to_string( elapsed )
-          tmp[ 'time_remaining' ] = _delta_to_string( operation[1][ 'expected_time' ] - elapsed )
+      elif frame is not None and step_type == 'Function' and frame.dispatched is not None:
+        data[ 'dispatched' ] = frame.dispatched
 
-        if step_data is None:  # no point in continuing, we don't know where we are
-          item_list.append( ( 0, len( operation[1][ '_children' ] ), 'Scope', tmp ) )
-          break
+      result.append( ( perc_complete, step_type, data ) )
 
-        item_list.append( ( step_data, len( operation[1][ '_children' ] ), 'Scope', tmp ) )
-        operation = operation[1][ '_children' ][ step_data ]
+    return result
+
+  def _statusItems( self ):
+    item_list = []  # ( scope position, scope length, scope type, scope data, frame, expected time ), frame is only for what is read each time, see status
+    operation = self.ast
+    for frame in self.state:  # condense into on loop, last status may be a blocking function with remote and status values
+      step_type = frame.op_type
+      if step_type == Types.SCOPE:
+        tmp = {}
+        if 'description' in operation[1]:
+          tmp[ 'description' ] = operation[1][ 'description' ]
+
+        item_list.append( ( frame.position, len( operation[1][ '_children' ] ), 'Scope', tmp, frame, operation[1].get( 'expected_time' ) ) )
+        operation = operation[1][ '_children' ][ frame.position ]
 
       elif step_type == Types.WHILE:  # if a while loop is on the stack, we must be in it, keep on going
-        item_list.append( ( 0, 1, 'While', { 'doing': step_data[ 'doing' ] } ) )
-        if step_data[ 'doing' ] == 'expression':
-          operation = operation[1][ 'expression' ]
-        elif step_data[ 'doing' ] == 'condition':
-          operation = operation[1][ 'condition' ]
-        else:
-          raise Exception( 'Unknown While doing "{0}"'.format( step_data[ 'doing' ] ) )
+        item_list.append( ( 0, 1, 'While', { 'doing': frame.doing }, None, None ) )
+        operation = operation[1][ frame.doing ]
 
       elif step_type == Types.IFELSE:
-        item_list.append( ( step_data[ 'index' ], len( operation[1] ), 'IfElse', { 'doing': step_data[ 'doing' ] } ) )
-        if step_data[ 'doing' ] == 'expression':
-          operation = operation[1][ step_data[ 'index' ] ][ 'expression' ]
-        elif step_data[ 'doing' ] == 'condition':
-          operation = operation[1][ step_data[ 'index' ] ][ 'condition' ]
-        else:
-          raise Exception( 'Unknown IfElse doing "{0}"'.format( step_data[ 'doing' ] ) )
+        item_list.append( ( frame.index, len( operation[1] ), 'IfElse', { 'doing': frame.doing }, None, None ) )
+        operation = operation[1][ frame.index ][ frame.doing ]
 
       elif step_type == Types.LINE:
         operation = operation[1]
 
       elif step_type == Types.FUNCTION:
-        tmp = {}
-        for item in ( 'dispatched', ):
-          try:
-            tmp[ item ] = step_data[ item ]
-          except ( TypeError, KeyError ):
-            pass
-
-        for item in ( 'module', 'name' ):
-          try:
-            tmp[ item ] = operation[1][ item ]
-          except ( TypeError, KeyError ):
-            pass
-
-        item_list.append( ( 0, 1, 'Function', tmp ) )
+        tmp = { 'module': operation[1][ 'module' ], 'name': operation[1][ 'name' ] }
+        item_list.append( ( 0, 1, 'Function', tmp, frame, None ) )
 
       elif step_type == Types.ASSIGNMENT:
-        if operation[1][ 'target' ][0] == Types.ARRAY_MAP_ITEM and ( step_data is None or 'index' not in step_data ):
+        if operation[1][ 'target' ][0] == Types.ARRAY_MAP_ITEM and frame.index is NO_VALUE:
           operation = operation[1][ 'target' ][1][ 'index' ]
-        elif step_data is None or 'value' not in step_data:
+        elif frame.operand is NO_VALUE:
           operation = operation[1][ 'value' ]
         else:
           raise Exception( 'status - assignment confused' )
 
       elif step_type == Types.INFIX:
-        try:
-          step_data[ 'left' ]
-          try:
-            step_data[ 'right' ]
-            raise Exception( 'Unknown Infix doing "{0}"'.format( step_data[ 'doing' ] ) )
-          except KeyError:
-            operation = operation[1][ 'right' ]
-        except (TypeError, KeyError ):  # NOTE: TypeError occurs when there is no step data, in this case we are still after the left side
+        if frame.left is NO_VALUE:
           operation = operation[1][ 'left' ]
+        elif frame.right is NO_VALUE:
+          operation = operation[1][ 'right' ]
+        else:
+          raise Exception( 'Unknown Infix doing' )
 
       elif step_type in ( Types.CONSTANT, Types.VARIABLE, Types.GOTO ):
         pass
@@ -509,17 +623,7 @@ class Runner( object ):
       else:
         raise Exception( 'Confused step type "{0}"'.format( step_type ) )
 
-    logging.debug( 'runner: status item_list {0}'.format( item_list ) )
-
-    result = []
-    last_perc_complete = 0
-    for item in reversed( item_list ):  # work backwards, as we go up, we scale the last perc_complete acording to the % of the curent scope
-      # before + -> scaling the last % complete .... after the +  -> the curent %
-      perc_complete = ( 1.0 / item[1] ) * last_perc_complete + ( 100.0 * item[0] ) / item[1]
-      result.insert( 0, ( perc_complete, item[2], item[3] ) )
-      last_perc_complete = perc_complete
-
-    return result
+    return item_list
 
   def goto( self, jump_point ):
     try:
@@ -527,9 +631,10 @@ class Runner( object ):
     except KeyError:
       raise NotDefinedError( jump_point )
 
-    self.state = [ [ Types.SCOPE, pos ] ]
+    self.state = [ ScopeFrame( pos ) ]
+    self._status = None
 
-  def run( self, ttl=1000 ):
+  def run( self, ttl=None, time_limit=None ):  # ttl is the max steps before raising Timeout, time_limit is the seconds before returning 'Not Complete', with a time_limit the steps are only limited if ttl is given, otherwise ttl defaults to RUN_TTL
     logging.debug( 'runner: run start' )
     if self.aborted:
       return 'aborted'
@@ -537,51 +642,100 @@ class Runner( object ):
     if self.done:
       return 'done'
 
-    self.ttl = ttl
+    if ttl is None and time_limit is None:
+      ttl = RUN_TTL
 
-    while True:  # we are a while loop for the benifit of the goto
-      try:
-        self._evaluate( self.ast, 0 )
-        return ''
+    if time_limit is None:
+      self.ttl = ttl
+      self._ttl_left = 0
+    else:  # the steps are handed out TIME_CHECK_STEPS at a time, see _nextSteps
+      if ttl is None:  # the time limit is the only limit
+        self.ttl = TIME_CHECK_STEPS
+        self._ttl_left = float( 'inf' )
+      else:
+        self.ttl = min( ttl, TIME_CHECK_STEPS )
+        self._ttl_left = ttl - self.ttl
+
+      self._deadline = time.monotonic() + time_limit
 
-      except Goto as e:  # yank the stack to this jump point,  NOTE: jump points can only be in the global scope
+    self._step_trace = self.trace_level >= TRACE_STEP or logging.getLogger().isEnabledFor( logging.DEBUG )
+    self._trace( TRACE_RUN, 'run', ttl )
+
+    try:
+      while True:  # we are a while loop for the benifit of the goto
         try:
-          self.goto( e.name )
-        except NotDefinedError:
-          self.state = 'ABORTED'
-          raise NotDefinedError( e.name, e.line_no )
+          self._execute()
+          result = ''
+          break
 
-      except Interrupt as e:
-        return str( e )
+        except Goto as e:  # yank the stack to this jump point,  NOTE: jump points can only be in the global scope
+          try:
+            self.goto( e.name )
+          except NotDefinedError:
+            self.state = 'ABORTED'
+            raise NotDefinedError( e.name, e.line_no )
 
-      except ( Pause, ExecutionError ) as e:
-        raise e
+        except Interrupt as e:
+          result = str( e )
+          break
 
-      except ( UnrecoverableError, ParamaterError, NotDefinedError, ScriptError ) as e:
-        self.state = 'ABORTED'
-        raise e
+        except ( Pause, ExecutionError ) as e:
+          raise e
 
-      except Exception as e:
-        self.state = 'ABORTED'  # TODO: watch some kind of DEBUG flag to enable/disable the stack trace
-        logging.exception( 'runner: Unahndled Exception' )
-        raise UnrecoverableError( 'Unahndled Exception ({0}): "{1}"\ntrace:\n{2}'.format( type( e ).__name__, str( e ), traceback.format_exc() ) )
+        except ( UnrecoverableError, ParamaterError, NotDefinedError, ScriptError ) as e:
+          self.state = 'ABORTED'
+          raise e
 
+        except Exception as e:
+          self.state = 'ABORTED'  # TODO: watch some kind of DEBUG flag to enable/disable the stack trace
+          logging.exception( 'runner: Unahndled Exception' )
+          raise UnrecoverableError( 'Unahndled Exception ({0}): "{1}"\ntrace:\n{2}'.format( type( e ).__name__, str( e ), traceback.format_exc() ) )
+
+    except Exception as e:
+      if self.trace_level:
+        self._trace( TRACE_RUN, 'raise', ( type( e ).__name__, str( e ) ) )
+      raise
+
+    finally:
+      self._status = None  # the state has moved on, however run() ended
+
+    self._trace( TRACE_RUN, 'return', result )
     logging.debug( 'runner: run finish' )
+    return result
+
+  def _nextSteps( self ):  # self.ttl has run out, give it the next TIME_CHECK_STEPS if there is time left
+    if self._ttl_left <= 0:
+      raise Timeout( self.cur_line )
+
+    if time.monotonic() >= self._deadline:
+      raise TimeLimit()
+
+    self.ttl = min( self._ttl_left, TIME_CHECK_STEPS )
+    self._ttl_left -= self.ttl
+
+  def _execute( self ):  # start or resume execution
+    self._evaluate( self.ast, 0 )
 
   def _evaluate( self, operation, state_index ):
-    logging.debug( 'runner: _evaluate level: "{0}" operation: "{1}"'.format( state_index, operation ) )
-    logging.debug( 'runner: _evaluate level: "{0}" start state: "{1}"'.format( state_index, self.state ) )
+    if self._step_trace:
+      self._traceStep( state_index, operation )
 
     op_type = operation[0]
     op_data = operation[1]
-    try:
-      if self.state[ state_index ][0] != op_type:
-        raise Exception( 'State type does not match AST type at {0}. Expected "{1}" got "{2}"'.format( state_index, self.state[ state_index ][0], op_type ) )
-    except IndexError:
-      self.state.append( [ op_type ] )
+    if len( self.state ) > state_index:
+      frame = self.state[ state_index ]
+      if frame.op_type != op_type:
+        raise Exception( 'State type does not match AST type at {0}. Expected "{1}" got "{2}"'.format( state_index, frame.op_type, op_type ) )
+    else:
+      try:
+        frame = frame_class_map[ op_type ]()
+      except KeyError:
+        raise ScriptError( 'Unimplemented "{0}"'.format( op_type ), self.cur_line )
+
+      self.state.append( frame )
 
     if self.ttl <= 0:
-      raise Timeout( self.cur_line )
+      self._nextSteps()
 
     self.ttl -= 1
 
@@ -589,7 +743,7 @@ class Runner( object ):
     # the logic here can seem a bit funny, however you have to keep
     # in mind that this has to be "re-entrant" ( for lack of a better word )
     # anytime you call _evaluate, execution may be aborted to take care of
-    # a blocking function, so you have to check if your state has been setup
+    # a blocking function, so you have to check if your frame has been setup
     # and sometimes it has to be set up in stages and checked as if you
     # have or haven't been through it before.
     if op_type == Types.LINE:
@@ -597,39 +751,30 @@ class Runner( object ):
       self._evaluate( op_data, state_index + 1 )
 
     elif op_type == Types.SCOPE:
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( 0 )
-        self.state[ state_index ].append( datetime.datetime.utcnow() )
+      if frame.started is None:
+        frame.started = datetime.datetime.utcnow()
         if 'max_time' in op_data:
-          self.state[ state_index ].append( op_data[ 'max_time' ] + datetime.datetime.utcnow() )
+          frame.max_time_at = op_data[ 'max_time' ] + frame.started
 
-      try:
-        if self.state[ state_index ][3] is None:
-          self.state[ state_index ][3] = datetime.datetime.utcnow()  # last time was a timeout, so set it so next run will timeout
+      if frame.timed_out:
+        frame.timed_out = False
+        frame.max_time_at = datetime.datetime.utcnow()  # last time was a timeout, so set it so next run will timeout
 
-        elif datetime.datetime.utcnow() > self.state[ state_index ][3]:
-          self.state[ state_index ][3] = None
-          raise Pause( 'max time elapsed' )
+      elif frame.max_time_at is not None and datetime.datetime.utcnow() > frame.max_time_at:
+        frame.timed_out = True
+        raise Pause( 'max time elapsed' )
 
-      except IndexError:  # no max time
-        pass
-
-      while self.state[ state_index ][1] < len( op_data[ '_children' ] ):
-        self._evaluate( op_data[ '_children' ][ self.state[ state_index ][ 1 ] ], state_index + 1 )
-        self.state[ state_index ][1] += 1
+      while frame.position < len( op_data[ '_children' ] ):
+        self._evaluate( op_data[ '_children' ][ frame.position ], state_index + 1 )
+        frame.position += 1
 
-    elif op_type == Types.CONSTANT:  # reterieve constant value
-      try:
-        self.state[ state_index ][2] = op_data
-      except IndexError:
-        self.state[ state_index ] += [ None, op_data ]
+    elif op_type == Types.CONSTANT:  # reterieve constant value, a folded array/map is a plain list/dict, so it is never changed in place
+      frame.value = op_data
 
     elif op_type == Types.VARIABLE:  # reterieve variable value
       if op_data[ 'module' ] is None:
         try:
-          value = self.variable_map[ op_data[ 'name' ] ]
+          frame.value = self.variable_map[ op_data[ 'name' ] ]
         except KeyError:
           raise NotDefinedError( op_data[ 'name' ], self.cur_line )
 
@@ -648,69 +793,30 @@ class Runner( object ):
           raise ParamaterError( 'target', '"{0}" of module "{1}" is not gettable'.format( op_data[ 'name' ], op_data[ 'module' ] ), self.cur_line )
 
         try:
-          value = getter()
+          frame.value = getter()
         except Exception as e:
           _debugDump( 'getter "{0}" in module "{1}" error during setup on line "{2}"'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line ), e, self.ast, self.state )
           raise UnrecoverableError( 'getter "{0}" in module "{1}" error during setup on line "{2}": "{3}"({4})'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line, str( e ), e.__class__.__name__) )
 
-      try:
-        self.state[ state_index ][2] = value
-      except IndexError:
-        self.state[ state_index ] += [ None, value ]
-
     elif op_type == Types.ARRAY:  # return array
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( [] )
-
-      for i in range( len( self.state[ state_index ][1] ), len( op_data ) ):
-        try:
-          self.state[ state_index + 1 ][2]
-        except IndexError:
-          self._evaluate( op_data[ i ], state_index + 1 )
+      for i in range( len( frame.items ), len( op_data ) ):
+        frame.items.append( share( self._evaluateValue( op_data[ i ], state_index + 1 ) ) )
 
-        self.state[ state_index ][1].append( self.state[ state_index + 1 ][2] )
-        self.state = self.state[ :( state_index + 1 ) ]
-
-      self.state[ state_index ].append( self.state[ state_index ][1] )
-      self.state[ state_index ][1] = None
+      frame.value = frame.items
+      frame.items = None
 
     elif op_type == Types.MAP:  # return map
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( {} )
-
       for key in op_data:
-        try:
-          self.state[ state_index + 1 ][2]
-        except IndexError:
-          self._evaluate( op_data[ key ], state_index + 1 )
+        if key not in frame.items:  # resuming, skip the ones allready done
+          frame.items[ key ] = share( self._evaluateValue( op_data[ key ], state_index + 1 ) )
 
-        self.state[ state_index ][1][ key ] = self.state[ state_index + 1 ][2]
-        self.state = self.state[ :( state_index + 1 ) ]
-
-      self.state[ state_index ].append( self.state[ state_index ][1] )
-      self.state[ state_index ][1] = None
+      frame.value = frame.items
+      frame.items = None
 
     elif op_type == Types.ARRAY_MAP_ITEM:  # reterieve array index value
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( {} )
-
       # evaluate the index
-      try:
-        self.state[ state_index ][1][ 'index' ]
-      except KeyError:
-        try:
-          self.state[ state_index + 1 ][2]
-        except IndexError:
-          self._evaluate( op_data[ 'index' ], state_index + 1 )
-
-        self.state[ state_index ][1][ 'index' ] = self.state[ state_index + 1 ][2]
-        self.state = self.state[ :( state_index + 1 ) ]
+      if frame.index is NO_VALUE:
+        frame.index = self._evaluateValue( op_data[ 'index' ], state_index + 1 )
 
       # look up the variable
       if op_data[ 'module' ] is None:
@@ -739,61 +845,31 @@ class Runner( object ):
           _debugDump( 'getter "{0}" in module "{1}" error during setup on line "{2}"'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line ), e, self.ast, self.state )
           raise UnrecoverableError( 'getter "{0}" in module "{1}" error during setup on line "{2}": "{3}"({4})'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line, str( e ), e.__class__.__name__) )
 
-      index = self.state[ state_index ][1][ 'index' ]
-
       try:
-        value = value[ index ]
+        frame.value = value[ frame.index ]
       except ( IndexError, KeyError ):
         raise NotDefinedError( 'Index/Key does not exist', self.cur_line )
 
-      self.state[ state_index ][1] = None
-      try:
-        self.state[ state_index ][2] = value
-      except IndexError:
-        self.state[ state_index ].append( value )
-
     elif op_type == Types.ASSIGNMENT:  # get the value from 'value', and assign it to the variable defined in 'target'
       if op_data[ 'target' ][0] not in ( Types.VARIABLE, Types.ARRAY_MAP_ITEM ) or ( op_data[ 'target' ][0] == Types.ARRAY_MAP_ITEM and op_data[ 'target' ][1][ 'module' ] is not None ):
         raise ParamaterError( 'target', 'Can only assign to variables', self.cur_line )
 
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( {} )
+      if op_data[ 'target' ][0] == Types.ARRAY_MAP_ITEM and frame.index is NO_VALUE:
+        frame.index = self._evaluateValue( op_data[ 'target' ][1][ 'index' ], state_index + 1 )
 
-      if op_data[ 'target' ][0] == Types.ARRAY_MAP_ITEM:
-        try:
-          self.state[ state_index ][1][ 'index' ]
-        except KeyError:
-          try:
-            self.state[ state_index + 1 ][2]
-          except IndexError:
-            self._evaluate( op_data[ 'target' ][1][ 'index' ], state_index + 1 )
-
-          self.state[ state_index ][1][ 'index' ] = self.state[ state_index + 1 ][2]
-          self.state = self.state[ :( state_index + 1 ) ]
-
-      try:
-        self.state[ state_index ][1][ 'value' ]
-      except KeyError:
-        try:
-          self.state[ state_index + 1 ][2]
-        except IndexError:
-          self._evaluate( op_data[ 'value' ], state_index + 1 )
-
-        self.state[ state_index ][1][ 'value' ] = self.state[ state_index + 1 ][2]
-        self.state = self.state[ :( state_index + 1 ) ]
+      if frame.operand is NO_VALUE:
+        frame.operand = self._evaluateValue( op_data[ 'value' ], state_index + 1 )
 
       target = op_data[ 'target' ][1]
-      value = copy.deepcopy( self.state[ state_index ][1][ 'value' ] )
 
       if target[ 'module' ] is None:  # we don't evaluate the target, it can only be a variable
         if op_data[ 'target' ][0] == Types.ARRAY_MAP_ITEM:
-          self.variable_map[ target[ 'name' ] ][ self.state[ state_index ][1][ 'index' ] ] = value
+          self._ownVariable( target[ 'name' ] )[ frame.index ] = share( frame.operand )
         else:
-         self.variable_map[ target[ 'name' ] ] = value
+         self.variable_map[ target[ 'name' ] ] = share( frame.operand )
 
       else:
+        value = copy.deepcopy( frame.operand )  # the module gets it's own copy
         try:
           module = self.value_map[ target[ 'module' ] ]
         except KeyError:
@@ -808,41 +884,20 @@ class Runner( object ):
           raise ParamaterError( 'target', '"{0}" of "{1}" is not settable'.format( target[ 'module' ], target[ 'name' ] ), self.cur_line )
 
         try:
-          setter( value )
+          setter( detached( value ) )
         except Exception as e:
           _debugDump( 'setter "{0}" in module "{1}" error on line "{2}"'.format( target[ 'name' ], target[ 'module' ], self.cur_line ), e, self.ast, self.state )
           raise UnrecoverableError( 'setter "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( target[ 'name' ], target[ 'module' ], self.cur_line, str( e ), e.__class__.__name__) )
 
     elif op_type == Types.INFIX:  # infix type operators
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( {} )
-
-      try:
-        self.state[ state_index ][1][ 'left' ]
-      except KeyError:
-        try:
-          self.state[ state_index + 1 ][2]
-        except IndexError:
-          self._evaluate( op_data[ 'left' ], state_index + 1 )
+      if frame.left is NO_VALUE:
+        frame.left = self._evaluateValue( op_data[ 'left' ], state_index + 1 )
 
-        self.state[ state_index ][1][ 'left' ] = self.state[ state_index + 1 ][2]
-        self.state = self.state[ :( state_index + 1 ) ]
+      if frame.right is NO_VALUE:
+        frame.right = self._evaluateValue( op_data[ 'right' ], state_index + 1 )
 
-      try:
-        self.state[ state_index ][1][ 'right' ]
-      except KeyError:
-        try:
-          self.state[ state_index + 1 ][2]
-        except IndexError:
-          self._evaluate( op_data[ 'right' ], state_index + 1 )
-
-        self.state[ state_index ][1][ 'right' ] = self.state[ state_index + 1 ][2]
-        self.state = self.state[ :( state_index + 1 ) ]
-
-      left_val = self.state[ state_index ][1][ 'left' ]
-      right_val = self.state[ state_index ][1][ 'right' ]
+      left_val = frame.left
+      right_val = frame.right
 
       if op_data[ 'operator' ] in infix_string_operator_map:  # the string group
         if not isinstance( left_val, str ):
@@ -866,183 +921,70 @@ class Runner( object ):
       else:
         raise NotDefinedError( op_data[ 'operator' ], self.cur_line )
 
-      self.state[ state_index ][1] = None
-      self.state[ state_index ].append( value )
+      frame.left = None
+      frame.right = None
+      frame.value = value
 
     elif op_type == Types.FUNCTION:  # FUNCTION
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( { 'paramaters': {} } )
-
-      if self.state[ state_index ][1] is None:  # TODO: is there a better way to handle this?
-        pass
-        # function allready executed and was an Exception last time, just let things pass by us
-
-      else:
+      if frame.value is NO_VALUE:  # otherwise the function allready executed and was an Exception last time, just let things pass by us
         # get the paramaters
         for key in op_data[ 'paramaters' ]:
-          try:
-            self.state[ state_index ][1][ 'paramaters' ][ key ]
-          except KeyError:
-            try:
-              self.state[ state_index + 1 ][2]
-            except IndexError:
-              self._evaluate( op_data[ 'paramaters' ][ key ], state_index + 1 )
+          if key not in frame.paramaters:
+            if _is_item_paramater( op_data, key ):  # keep the index, so the item can be changed where it is
+              ( frame.paramaters[ key ], frame.item_index ) = self._evaluateItem( op_data[ 'paramaters' ][ key ], state_index + 1 )
+            else:
+              frame.paramaters[ key ] = self._evaluateValue( op_data[ 'paramaters' ][ key ], state_index + 1 )
 
-            self.state[ state_index ][1][ 'paramaters' ][ key ] = self.state[ state_index + 1 ][2]
-            self.state = self.state[ :( state_index + 1 ) ]
+        value = self._functionValue( op_data, frame )
 
-        try:
-          handler = self.state[ state_index ][1][ 'handler' ]
-        except KeyError:  # handler dosen't exist, let's find it and set it up
-          if op_data[ 'module' ] is None:  # built in function
-            try:
-              handler = builtin_function_map[ op_data[ 'name' ] ]
-            except KeyError:
-              raise NotDefinedError( op_data[ 'name' ], self.cur_line )
-
-            module = '<builtin>'
-
-          else:  # external function
-            try:
-              module = self.function_map[ op_data[ 'module' ] ]
-            except KeyError:
-              raise NotDefinedError( op_data[ 'module' ], self.cur_line )
-
-            try:
-              handler = module[ op_data[ 'name' ] ]()
-            except KeyError:
-              raise NotDefinedError( '{0}" of "{1}'.format( op_data[ 'module' ], op_data[ 'name' ] ), self.cur_line )
-            except TypeError:  # hm.... this is bad
-              raise UnrecoverableError( 'Handler init function failed "{0}" on line {1}, possibly trying to call the function directly?'.format( op_data[ 'name' ], self.cur_line ) )
-
-            module = op_data[ 'module' ]
-
-          if isinstance( handler, tuple ):
-            module = handler[0]  # yes, overlay what ever was here
-            handler = handler[1]
-
-          if isinstance( handler, ExternalFunction ):
-            handler._runner = self
-            try:
-              handler.setup( self.state[ state_index ][1][ 'paramaters' ] )
-
-            except ( ParamaterError, Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
-              raise e
-
-            except Exception as e:
-              _debugDump( 'Handler "{0}" in module "{1}" error on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
-              raise UnrecoverableError( 'Handler "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
-
-            self.factory_cookie = str( uuid.uuid4() )
-            self.state[ state_index ][1][ 'handler' ] = handler
-            self.state[ state_index ][1][ 'module' ] = module
-            self.state[ state_index ][1][ 'dispatched' ] = False
-
-          else:
-            try:
-              paramaters = self.state[ state_index ][1][ 'paramaters' ]
-            except TypeError as e:
-              raise ParamaterError( '<unknown>', e, self.cur_line )
-
-            try:
-              value = handler( **paramaters )
-            except ( ParamaterError, Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
-              raise e
-
-            except Exception as e:
-              _debugDump( 'Handler "{0}" in module "{1}" error on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
-              raise UnrecoverableError( 'Handler "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
-
-        if isinstance( handler, ExternalFunction ):  # else was allready run and set a value above
-          handler._runner = self
-          try:
-            if not handler.done:
-              handler.run()
-              raise Interrupt( handler.message )
-
-            value = handler.value
-
-          except( Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
-            raise e
-
-          except Exception as e:
-            module = op_data.get( 'module', '<builtin>' )
-            _debugDump( 'Handler "{0}" in module "{1}" error during done/message/run/value on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
-            raise UnrecoverableError( 'Handler "{0}" in module "{1}" error during done/message/run/value on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
-
-        self.state[ state_index ][1] = None
+        frame.paramaters = None
+        frame.handler = None
+        frame.dispatched = None
         if isinstance( value, Exception ):
-          self.state[ state_index ].append( None )
+          frame.value = None
           raise value
 
-        else:
-          self.state[ state_index ].append( value )
+        frame.value = value
 
     elif op_type == Types.WHILE:
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( { 'doing': 'condition' } )  # this is so we remember what it was we were doing when interrupted
-
       while True:
-        if self.state[ state_index ][1][ 'doing' ] == 'condition':
-          self._evaluate( op_data[ 'condition' ], state_index + 1 )
-          if not self.state[ state_index + 1 ][2]:
+        if frame.doing == 'condition':
+          if not self._evaluateValue( op_data[ 'condition' ], state_index + 1 ):
             break
 
-          self.state[ state_index ][1][ 'doing' ] = 'expression'
-          self.state = self.state[ :( state_index + 1 ) ]
+          frame.doing = 'expression'
 
-        if self.state[ state_index ][1][ 'doing' ] == 'expression':
+        if frame.doing == 'expression':
           self._evaluate( op_data[ 'expression' ], state_index + 1 )
-          self.state[ state_index ][1][ 'doing' ] = 'condition'
-          self.state = self.state[ :( state_index + 1 ) ]
+          frame.doing = 'condition'
+          del self.state[ state_index + 1: ]
 
     elif op_type == Types.IFELSE:
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( { 'index': 0, 'doing': 'condition' } )
-
-      while self.state[ state_index ][1][ 'index' ] < len( op_data ):
-        if self.state[ state_index ][1][ 'doing' ] == 'condition':
-          if op_data[ self.state[ state_index ][1][ 'index' ] ][ 'condition' ] is None:
+      while frame.index < len( op_data ):
+        if frame.doing == 'condition':
+          if op_data[ frame.index ][ 'condition' ] is None:
             do_expression = True
           else:
-            self._evaluate( op_data[ self.state[ state_index ][1][ 'index' ] ][ 'condition' ], state_index + 1 )
-            do_expression = self.state[ state_index + 1 ][2]
-            self.state = self.state[ :( state_index + 1 ) ]
+            do_expression = self._evaluateValue( op_data[ frame.index ][ 'condition' ], state_index + 1 )
 
           if not do_expression:
-            self.state[ state_index ][1][ 'index' ] += 1
+            frame.index += 1
             continue
 
-          self.state[ state_index ][1][ 'doing' ] = 'expression'
+          frame.doing = 'expression'
 
-        if self.state[ state_index ][1][ 'doing' ] == 'expression':
-          self._evaluate( op_data[ self.state[ state_index ][1][ 'index' ] ][ 'expression' ], state_index + 1 )
+        if frame.doing == 'expression':
+          self._evaluate( op_data[ frame.index ][ 'expression' ], state_index + 1 )
           break
 
-        self.state = self.state[ :( state_index + 1 ) ]
+        del self.state[ state_index + 1: ]
 
     elif op_type == Types.EXISTS:
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( None )
-
       try:
         self._evaluate( op_data, state_index + 1 )
-        result = True
+        frame.value = True
       except NotDefinedError:
-        result = False
-
-      try:
-        self.state[ state_index ][2] = result
-      except IndexError:
-        self.state[ state_index ].append( result )
+        frame.value = False
 
     elif op_type == Types.JUMP_POINT:  # just a NOP execution wise
       pass
@@ -1055,51 +997,176 @@ class Runner( object ):
 
     # if the op_type we just ran does not return a value, make sure it is cleaned up
     if op_type not in ( Types.CONSTANT, Types.VARIABLE, Types.ARRAY, Types.MAP, Types.ARRAY_MAP_ITEM, Types.INFIX, Types.FUNCTION, Types.EXISTS ):  # all the things that "return" a value
-      self.state = self.state[ :state_index ]  # remove this an evertying after from the state
+      del self.state[ state_index: ]  # remove this an evertying after from the state
     else:
-      self.state = self.state[ :state_index + 1 ]  # remove everything after this one, save this one's return value on the stack
+      del self.state[ state_index + 1: ]  # remove everything after this one, save this one's return value on the stack
 
-    logging.debug( 'runner: _evaluate level: "{0}" final state: {1}'.format( state_index, self.state ) )
+    if self._step_trace:
+      logging.debug( 'runner: _evaluate level: "%s" final state: %s', state_index, self.state )
     if self.state == []:
       self.state = 'DONE'
       self.cur_line = None
 
+  def _evaluateValue( self, operation, state_index ):  # evaluate a value, unless it was evaluated before being interrupted, and remove it from the state
+    if len( self.state ) <= state_index or self.state[ state_index ].value is NO_VALUE:
+      self._evaluate( operation, state_index )
+
+    value = self.state[ state_index ].value
+    del self.state[ state_index: ]
+    return value
+
+  def _evaluateItem( self, operation, state_index ):  # like _evaluateValue, for an array/map item, returns ( value, index )
+    if len( self.state ) <= state_index or self.state[ state_index ].value is NO_VALUE:
+      self._evaluate( operation, state_index )
+
+    frame = self.state[ state_index ]
+    del self.state[ state_index: ]
+    return ( frame.value, frame.index )
+
+  def _functionValue( self, op_data, frame ):  # frame is the FunctionFrame with the paramaters, and once set up, the handler, it's module and dispatched flag
+    handler = frame.handler
+    if handler is None:  # handler dosen't exist, let's find it and set it up
+      if op_data[ 'module' ] is None:  # built in function
+        try:
+          handler = builtin_function_map[ op_data[ 'name' ] ]
+        except KeyError:
+          raise NotDefinedError( op_data[ 'name' ], self.cur_line )
+
+        module = '<builtin>'
+
+      else:  # external function
+        try:
+          module = self.function_map[ op_data[ 'module' ] ]
+        except KeyError:
+          raise NotDefinedError( op_data[ 'module' ], self.cur_line )
+
+        try:
+          handler = module[ op_data[ 'name' ] ]()
+        except KeyError:
+          raise NotDefinedError( '{0}" of "{1}'.format( op_data[ 'module' ], op_data[ 'name' ] ), self.cur_line )
+        except TypeError:  # hm.... this is bad
+          raise UnrecoverableError( 'Handler init function failed "{0}" on line {1}, possibly trying to call the function directly?'.format( op_data[ 'name' ], self.cur_line ) )
+
+        module = op_data[ 'module' ]
+
+      if isinstance( handler, tuple ):
+        module = handler[0]  # yes, overlay what ever was here
+        handler = handler[1]
+
+      if isinstance( handler, ExternalFunction ):
+        handler._runner = self
+        try:
+          handler.setup( detached( frame.paramaters ) )  # the paramaters may be constants from the shared AST
+
+        except ( ParamaterError, Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
+          raise e
+
+        except Exception as e:
+          _debugDump( 'Handler "{0}" in module "{1}" error on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
+          raise UnrecoverableError( 'Handler "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
+
+        self.factory_cookie = str( uuid.uuid4() )
+        frame.handler = handler
+        frame.module = module
+        frame.name = op_data[ 'name' ]
+        frame.dispatched = False
+
+      else:
+        if module == '<builtin>' and builtin_mutating_map.get( op_data[ 'name' ] ) in frame.paramaters:
+          name = builtin_mutating_map[ op_data[ 'name' ] ]
+          frame.paramaters[ name ] = self._ownParamater( op_data[ 'paramaters' ][ name ], frame.paramaters[ name ], frame.item_index )
+
+        paramaters = frame.paramaters if module == '<builtin>' else detached( frame.paramaters )
+        try:
+          value = handler( **paramaters )
+        except ( ParamaterError, Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
+          raise e
+
+        except Exception as e:
+          _debugDump( 'Handler "{0}" in module "{1}" error on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
+          raise UnrecoverableError( 'Handler "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
+
+    if isinstance( handler, ExternalFunction ):  # else was allready run and set a value above
+      handler._runner = self
+      try:
+        if not handler.done:
+          handler.run()
+          raise Interrupt( handler.message )
+
+        value = handler.value
+
+      except( Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
+        raise e
+
+      except Exception as e:
+        module = op_data.get( 'module', '<builtin>' )
+        _debugDump( 'Handler "{0}" in module "{1}" error during done/message/run/value on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
+        raise UnrecoverableError( 'Handler "{0}" in module "{1}" error during done/message/run/value on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
+
+    return value
+
+  def _ownVariable( self, name ):  # the value of the variable, copied first if it can't be changed in place
+    value = self.variable_map[ name ]
+    result = owned( value )
+    if result is not value:
+      self.variable_map[ name ] = result
+
+    return result
+
+  def _ownParamater( self, operation, value, index=NO_VALUE ):  # value of the paramater operation, that can be changed in place, and is still where the operation got it from, index is the item's evaluated index
+    if operation[0] in ( Types.VARIABLE, Types.ARRAY_MAP_ITEM ) and operation[1][ 'module' ] is None:
+      name = operation[1][ 'name' ]
+      if operation[0] == Types.VARIABLE:
+        if self.variable_map.get( name ) is value:
+          return self._ownVariable( name )
+
+      elif index is not NO_VALUE:
+        parent = self.variable_map.get( name )
+        try:
+          found = isinstance( parent, ( list, dict ) ) and parent[ index ] is value  # unless the other paramaters moved it
+        except ( IndexError, KeyError, TypeError ):
+          found = False
+
+        if found:
+          parent = self._ownVariable( name )
+          parent[ index ] = owned( value )
+          return parent[ index ]
+
+    return owned( value )  # not in a variable, nothing else sees the change
+
   def toAssembler( self, assembler_module_list ):
     # return None if we done, or not started
     if self.done or self.aborted or self.state == []:
       return None
 
-    operation = self.state[ -1 ]
+    frame = self.state[ -1 ]
 
-    if operation[0] != Types.FUNCTION and operation[0]:  # not a function
+    if frame.op_type != Types.FUNCTION:  # not a function
       return None
 
-    if operation[1] is None:  # the operation isn't setup yet
+    if frame.handler is None:  # the function isn't setup yet, or is not external
       return None
 
-    try:
-      if operation[1][ 'module' ] not in assembler_module_list:
-        return None
-    except KeyError:
-      return None  # function is not external
+    if frame.module not in assembler_module_list:
+      return None
 
-    if operation[1][ 'dispatched' ] is True:  # allready dispatchced, don't send anything else until something comes back
+    if frame.dispatched is True:  # allready dispatchced, don't send anything else until something comes back
       return None
 
-    handler = operation[1][ 'handler' ]
+    handler = frame.handler
     handler._runner = self
     try:
       paramaters = handler.toAssembler()
     except Exception as e:
-      _debugDump( 'Handler "{0}" in module "{1}" error during toAssembler on line "{2}"'.format( handler.__class__.__name__, operation[1][ 'module' ], self.cur_line ), e, self.ast, self.state )
+      _debugDump( 'Handler "{0}" in module "{1}" error during toAssembler on line "{2}"'.format( handler.__class__.__name__, frame.module, self.cur_line ), e, self.ast, self.state )
       return None  # TODO: log something?
 
     if paramaters is None:
       return None
 
-    operation[1][ 'dispatched' ] = True
+    frame.dispatched = True
 
-    return { 'module': operation[1][ 'module' ], 'function': paramaters[0], 'cookie': self.factory_cookie, 'paramaters': paramaters[1] }
+    return { 'module': frame.module, 'function': paramaters[0], 'cookie': self.factory_cookie, 'paramaters': paramaters[1] }
 
   def fromAssembler( self, cookie, data ):
     if self.done or self.aborted or self.state == []:
@@ -1108,23 +1175,23 @@ class Runner( object ):
     if cookie != self.factory_cookie:
       return ( 'Bad Cookie', None )
 
-    operation = self.state[ -1 ]
+    frame = self.state[ -1 ]
 
-    if operation[0] != Types.FUNCTION:
+    if frame.op_type != Types.FUNCTION:
       return ( 'Not At a Function', None )
 
-    if operation[1][ 'dispatched' ] is False:
+    if not frame.dispatched:
       return ( 'Not Expecting Anything', None )
 
-    handler = operation[1][ 'handler' ]
+    handler = frame.handler
     handler._runner = self
     try:
       handler.fromAssembler( data )
     except Exception as e:
-      _debugDump( 'Handler "{0}" in module "{1}" error during fromAssembler on line "{2}"'.format( handler.__class__.__name__, operation[1][ 'module' ], self.cur_line ), e, self.ast, self.state )
+      _debugDump( 'Handler "{0}" in module "{1}" error during fromAssembler on line "{2}"'.format( handler.__class__.__name__, frame.module, self.cur_line ), e, self.ast, self.state )
       return ( 'Error', None )  # TODO: log something?
 
-    operation[1][ 'dispatched' ] = False
+    frame.dispatched = False
 
     return ( 'Accepted', handler.message )
 
@@ -1132,15 +1199,15 @@ class Runner( object ):
     if self.done or self.aborted or self.state == []:
       return
 
-    operation = self.state[ -1 ]
+    frame = self.state[ -1 ]
 
-    if operation[0] != Types.FUNCTION:
+    if frame.op_type != Types.FUNCTION:
       return
 
-    if not isinstance( operation[1], dict ) or 'dispatched' not in operation[1]:
+    if frame.dispatched is None:
       return  # or?: raise Exception( 'Function is not dispatched or has allready returned its value' ), we don't say anything if it's not a function
 
-    operation[1][ 'dispatched' ] = False
+    frame.dispatched = False
 
     return
 
@@ -1148,12 +1215,12 @@ class Runner( object ):
     if self.done or self.aborted or self.state == []:
       return 'Script not Running'
 
-    operation = self.state[ -1 ]
+    frame = self.state[ -1 ]
 
-    if operation[0] != Types.FUNCTION:
+    if frame.op_type != Types.FUNCTION or frame.handler is None:
       return 'Not At a Function'
 
-    handler = operation[1][ 'handler' ]
+    handler = frame.handler
     try:
       handler.rollback()
 
@@ -1161,19 +1228,23 @@ class Runner( object ):
       return 'Rollback not possible'
 
     except Exception as e:
-      _debugDump( 'Handler "{0}" in module "{1}" error starting rollback on line "{2}"'.format( handler.__class__.__name__, operation[1][ 'module' ], self.cur_line ), e, self.ast, self.state )
+      _debugDump( 'Handler "{0}" in module "{1}" error starting rollback on line "{2}"'.format( handler.__class__.__name__, frame.module, self.cur_line ), e, self.ast, self.state )
       return 'Exception while trying to rollback'  # TODO: log?
 
     self.factory_cookie = str( uuid.uuid4() )  # revoke any outstanding tasks, TODO: do we also rotate cookie on reset?  if not, should we rotate keys even if rollback is  not possible
-    operation[1][ 'dispatched' ] = False
+    frame.dispatched = False
 
     return 'Done'
 
   def registerModule( self, name ):
-    module = import_module( name )
+    try:
+      ( script_name, functions, values ) = _script_module_map[ name ]
+    except KeyError:
+      module = import_module( name )
+      ( script_name, functions, values ) = _script_module_map[ name ] = ( module.SCRIPT_NAME, module.SCRIPT_FUNCTIONS, module.SCRIPT_VALUES )
 
-    self.function_map[ module.SCRIPT_NAME ] = module.SCRIPT_FUNCTIONS
-    self.value_map[ module.SCRIPT_NAME ] = module.SCRIPT_VALUES
+    self.function_map[ script_name ] = functions
+    self.value_map[ script_name ] = values
 
     self.module_list.append( name )
 
@@ -1205,13 +1276,32 @@ class Runner( object ):
     return ( self.__class__, ( self.ast, ), self.__getstate__() )
 
   def __getstate__( self ):
-    return { 'module_list': self.module_list, 'object_list': self.object_list, 'state': self.state, 'variable_map': self.variable_map, 'cur_line': self.cur_line, 'factory_cookie': self.factory_cookie }
+    state = self.state
+    if isinstance( state, list ):
+      state = pack_state( state )
+
+    result = { 'module_list': self.module_list, 'object_list': self.object_list, 'state': state, 'variable_map': self.variable_map, 'cur_line': self.cur_line, 'factory_cookie': self.factory_cookie }
+    if self.trace_buffer is not None:  # only when tracing, so the usual pickle is not any bigger
+      result[ 'trace_level' ] = self.trace_level
+      result[ 'trace_buffer' ] = self.trace_buffer
+
+    return result
 
   def __setstate__( self, state ):
     self.state = state[ 'state' ]
+    if isinstance( self.state, list ):
+      if self.state and isinstance( self.state[0], list ):  # pickled before frames
+        self.state = frames_from_lists( self.state )
+      else:
+        self.state = unpack_state( self.state )
+
+    self._status = None
+
     self.variable_map = state[ 'variable_map' ]
     self.cur_line = state[ 'cur_line' ]
     self.factory_cookie = state[ 'factory_cookie' ]
+    self.trace_level = state.get( 'trace_level', TRACE_OFF )
+    self.trace_buffer = state.get( 'trace_buffer', None )
     for module in state[ 'module_list' ]:
       self.registerModule( module )
 
@@ -74,6 +74,27 @@ class Remote( ExternalFunction ):
     self.counter = state[1]
 
 
+class Mangle( ExternalFunction ):  # changes it's paramaters in place, as a badly behaved plugin might
+  def __init__( self, *args, **kwargs ):
+    super().__init__( *args, **kwargs )
+    self.array = None
+
+  def setup( self, parms ):
+    parms[ 'array' ].append( 'mangled' )
+    parms[ 'array' ][0][ 'key' ] = 'mangled'
+    self.array = parms[ 'array' ]
+
+  @property
+  def value( self ):
+    return self.array
+
+  def __getstate__( self ):
+    return self.array
+
+  def __setstate__( self, state ):
+    self.array = state
+
+
 class Count( ExternalFunction ):
   def __init__( self, *args, **kwargs ):
     super().__init__( *args, **kwargs )
@@ -143,7 +164,8 @@ SCRIPT_FUNCTIONS = {
                       'constant': Constant,
                       'multiply': Multiply,
                       'remote': Remote,
-                      'count': Count
+                      'count': Count,
+                      'mangle': Mangle
                     }
 
 SCRIPT_VALUES = {
@@ -1,11 +1,22 @@
 import pytest
 import pickle
 import time
+from datetime import datetime, timedelta
 
-from factory.script.parser import parse
-from factory.script.runner import Runner, ExecutionError, UnrecoverableError, ParamaterError, NotDefinedError, Timeout, Pause
+from factory.script.parser import parse, Types
+from factory.script.runner import Runner, ExecutionError, UnrecoverableError, ParamaterError, NotDefinedError, Timeout, Pause, TRACE_RUN, TRACE_STEP
+from factory.script.compiler import CompiledRunner
+from factory.script import runner_plugins_test
+from factory.script import runner as runner_module
 
-# TODO: test the assignment deepcopy, ie: a = {}, b = a  make sure changes to b are not reflected in a
+
+@pytest.fixture( autouse=True, params=[ Runner, CompiledRunner ], ids=[ 'tree', 'compiled' ] )
+def runner_class( request, monkeypatch ):  # run every test against both the tree walking and the compiled runner
+  monkeypatch.setitem( globals(), 'Runner', request.param )
+  for name in ( 'little_stuff', 'other_stuff' ):  # the tests set these, put them back afterwards
+    monkeypatch.setattr( runner_plugins_test, name, getattr( runner_plugins_test, name ) )
+
+  return request.param
 
 
 class testExternalObject( object ):
@@ -245,6 +256,70 @@ def test_map():
   assert runner.variable_map == { 'myvar': { 'hi': 'stuff' } }
 
 
+def test_literal_resume():  # array and map literals that take more than one run, with a pickle in between
+  runner = Runner( parse( 'aa = 1\nbb = [ {0} ]\ncc = {{ {1} }}'.format( ', '.join( [ '( aa + 1 )' ] * 20 ), ', '.join( [ 'k{0}=( aa + {0} )'.format( i ) for i in range( 0, 20 ) ] ) ) ) )
+  for _ in range( 0, 20 ):
+    try:
+      runner.run( 20 )
+      break
+    except Timeout:
+      runner = pickle.loads( pickle.dumps( runner ) )
+
+  assert runner.done
+  assert runner.variable_map[ 'bb' ] == [ 2 ] * 20
+  assert runner.variable_map[ 'cc' ] == { 'k{0}'.format( i ): 1 + i for i in range( 0, 20 ) }
+
+
+def test_detached():  # what code outside the script does with a value is not seen by the script, or the next script run from the same AST
+  ast = parse( 'aa = [ { key="value" }, 1 ]\nbb = testing.mangle( array=aa )\ntesting.littlestuff = aa\ncc = testing.mangle( array=[ { key="value" }, 2 ] )', True )
+  for _ in range( 0, 2 ):
+    runner = Runner( ast )
+    runner.registerModule( 'factory.script.runner_plugins_test' )
+    assert runner.run() == ''
+    assert runner.variable_map[ 'aa' ] == [ { 'key': 'value' }, 1 ]
+    assert runner.variable_map[ 'bb' ] == [ { 'key': 'mangled' }, 1, 'mangled' ]
+    assert runner.variable_map[ 'cc' ] == [ { 'key': 'mangled' }, 2, 'mangled' ]
+    runner_plugins_test.little_stuff[0][ 'key' ] = 'set'
+    runner_plugins_test.little_stuff.append( 'set' )
+    assert runner.variable_map[ 'aa' ] == [ { 'key': 'value' }, 1 ]
+
+  assert ast == parse( 'aa = [ { key="value" }, 1 ]\nbb = testing.mangle( array=aa )\ntesting.littlestuff = aa\ncc = testing.mangle( array=[ { key="value" }, 2 ] )', True )
+
+
+def test_copy_on_write():  # assignment shares, changes to one variable are not reflected in the others
+  script = 'aa = { bb=[ 1, 2 ], cc=3 }\ndd = aa\ndd[ "cc" ] = 4\nee = dd[ "bb" ]\nappend( array=ee, value=5 )\nappend( array=dd[ "bb" ], value=6 )\nff = [ aa, ee ]\nappend( array=ee, value=7 )\ngg = pop( array=aa[ "bb" ] )'
+  result = { 'aa': { 'bb': [ 1 ], 'cc': 3 }, 'dd': { 'bb': [ 1, 2, 6 ], 'cc': 4 }, 'ee': [ 1, 2, 5, 7 ], 'ff': [ { 'bb': [ 1, 2 ], 'cc': 3 }, [ 1, 2, 5 ] ], 'gg': 2 }
+  for optimize in ( False, True ):
+    runner = Runner( parse( script, optimize ) )
+    runner.run()
+    assert runner.done
+    assert runner.variable_map == result
+
+  ast = parse( 'aa = [ 1, 2 ]\nappend( array=aa, value=3 )\naa[ 0 ] = 0', True )  # aa is a constant from the AST
+  for _ in range( 0, 2 ):
+    runner = Runner( ast )
+    runner.run()
+    assert runner.variable_map == { 'aa': [ 0, 2, 3 ] }
+
+  runner = Runner( parse( 'aa = [ [ 1 ], 2 ]\nbb = aa\npause( msg="here" )\nappend( array=bb[ 0 ], value=3 )\nbb[ 1 ] = 4' ) )
+  with pytest.raises( Pause ):
+    runner.run()
+  runner = pickle.loads( pickle.dumps( runner ) )
+  runner.run()
+  assert runner.done
+  assert runner.variable_map == { 'aa': [ [ 1 ], 2 ], 'bb': [ [ 1, 3 ], 4 ] }
+
+  for script, result in ( ( 'aa = { xx=[ 1 ] }\naa[ "yy" ] = aa[ "xx" ]\nappend( array=aa[ "yy" ], value=2 )', { 'aa': { 'xx': [ 1 ], 'yy': [ 1, 2 ] } } ),  # the same item in two places
+                          ( 'bb = [ 1 ]\naa = [ bb, bb ]\nappend( array=aa[ 1 ], value=2 )', { 'aa': [ [ 1 ], [ 1, 2 ] ], 'bb': [ 1 ] } ),
+                          ( 'bb = [ 1 ]\naa = [ bb, bb ]\ncc = pop( array=aa[ 0 ] )', { 'aa': [ [], [ 1 ] ], 'bb': [ 1 ], 'cc': 1 } ),
+                          ( 'aa = [ [ 1 ], [ 1 ] ]\nii = 1\nappend( array=aa[ ii ], value=2 )', { 'aa': [ [ 1 ], [ 1, 2 ] ], 'ii': 1 } ) ):
+    for optimize in ( False, True ):
+      runner = Runner( parse( script, optimize ) )
+      runner.run()
+      assert runner.done
+      assert runner.variable_map == result
+
+
 def test_module_values():  # TODO: add pickling testing
   runner = Runner( parse( 'asdf = testing.bigstuff' ) )
   runner.registerModule( 'factory.script.runner_plugins_test' )
@@ -717,6 +792,64 @@ def test_delay():
   assert runner.run() == 'Waiting for 7197 more seconds'
 
 
+def test_wake():
+  runner = Runner( parse( 'delay( seconds=5 )' ) )
+  assert runner.wake_at is None
+  assert runner.run() == 'Waiting for 4 more seconds'
+  assert timedelta( seconds=4 ) < runner.wake_at - datetime.utcnow() <= timedelta( seconds=5 )
+  assert not runner.blocked
+  runner = pickle.loads( pickle.dumps( runner ) )
+  assert timedelta( seconds=4 ) < runner.wake_at - datetime.utcnow() <= timedelta( seconds=5 )
+
+  runner = Runner( parse( 'begin( max_time=0:03 )\ndelay( seconds=6 )\nend' ) )  # the max time is up first
+  runner.run()
+  assert timedelta( seconds=2 ) < runner.wake_at - datetime.utcnow() <= timedelta( seconds=3 )
+
+  runner = Runner( parse( 'testing.remote()' ) )
+  runner.registerModule( 'factory.script.runner_plugins_test' )
+  assert runner.pending is None
+  assert runner.run() == 'Not Initilized'
+  assert not runner.blocked
+  assert runner.wake_at is None
+  assert runner.pending == ( 'testing', 'remote' )
+  assert runner.toAssembler( [ 'testing' ] ) is not None
+  assert runner.blocked
+  assert runner.wake_at is None
+  assert runner.pending is None
+  assert runner.fromAssembler( runner.factory_cookie, True )[0] == 'Accepted'
+  assert not runner.blocked
+  assert runner.pending == ( 'testing', 'remote' )
+  assert runner.run() == ''
+  assert not runner.blocked
+  assert runner.wake_at is None
+  assert runner.pending is None
+
+  runner = Runner( parse( 'aa = len( array=testing.remote() )' ) )  # the name of the inner function, not the one it is a paramater of
+  runner.registerModule( 'factory.script.runner_plugins_test' )
+  assert runner.run() == 'Not Initilized'
+  assert runner.pending == ( 'testing', 'remote' )
+  runner = pickle.loads( pickle.dumps( runner ) )
+  assert runner.pending == ( 'testing', 'remote' )
+
+  runner = Runner( parse( 'aa = 1\ntesting.count( stop_at=2, count_by=1 )\ndelay( seconds=5 )' ) )  # these are run here, not by the assembler
+  runner.registerModule( 'factory.script.runner_plugins_test' )
+  assert runner.run() == 'at 1 of 2'
+  assert runner.pending is None
+  runner.run()
+  assert runner.run() == 'Waiting for 4 more seconds'
+  assert runner.pending is None
+
+  runner = Runner( parse( 'begin( max_time=0:10 )\ntesting.remote()\nend' ) )  # pending, then blocked, but still woken for the max time
+  runner.registerModule( 'factory.script.runner_plugins_test' )
+  runner.run()
+  assert not runner.blocked
+  assert runner.pending == ( 'testing', 'remote' )
+  assert timedelta( seconds=9 ) < runner.wake_at - datetime.utcnow() <= timedelta( seconds=10 )
+  assert runner.toAssembler( [ 'testing' ] ) is not None
+  assert runner.blocked
+  assert timedelta( seconds=9 ) < runner.wake_at - datetime.utcnow() <= timedelta( seconds=10 )
+
+
 def test_message():
   runner = Runner( parse( 'message( msg="Hello World" )' ) )
   assert runner.run() == 'Hello World'
@@ -832,6 +965,46 @@ def test_module_functions():
   assert runner.run() == 'done'
 
 
+def test_status_cache():
+  runner = Runner( parse( 'begin( description="timed", expected_time=10:00 )\ntesting.count( stop_at=2, count_by=1 )\ntesting.count( stop_at=1, count_by=1 )\nend' ) )
+  runner.registerModule( 'factory.script.runner_plugins_test' )
+  assert runner.run() == 'at 1 of 2'
+  first_state = pickle.loads( pickle.dumps( runner.__getstate__() ) )
+  status = runner.status
+  assert [ ( item[0], item[1] ) for item in status ] == [ ( 0.0, 'Scope' ), ( 0.0, 'Scope' ), ( 0.0, 'Function' ) ]
+  assert status[1][2][ 'description' ] == 'timed'
+  assert status[1][2][ 'time_elapsed' ] == '00:00'
+  status[1][2][ 'description' ] = 'changed'  # the cached status is not changed by changing what was returned
+  assert runner.status[1][2][ 'description' ] == 'timed'
+  assert runner.status[2] == status[2]
+
+  for frame in runner.state:  # the times are worked out each time status is read
+    if frame.op_type == Types.SCOPE and frame.started is not None:
+      frame.started -= timedelta( minutes=1 )
+
+  assert runner.status[1][2][ 'time_elapsed' ] == '01:00'
+
+  assert runner.run() == 'at 2 of 2'
+  assert runner.run() == 'at 1 of 1'
+  assert runner.status[1][0] == 50.0
+  assert runner.status[2][2] == { 'module': 'testing', 'name': 'count', 'dispatched': False }
+  runner.__setstate__( first_state )  # back to the first count
+  assert runner.status[1][0] == 0.0
+  assert runner.run() == 'at 2 of 2'
+  assert runner.run() == 'at 1 of 1'
+  assert runner.status[1][0] == 50.0
+  assert runner.run() == ''
+  assert runner.status == [ ( 100.0, 'Scope', None ) ]
+
+  runner = Runner( parse( 'pause( msg="first" )\naa = 1\npause( msg="second" )\naa = 2' ) )  # run() ending with an exception changes the state too
+  with pytest.raises( Pause ):
+    runner.run()
+  assert runner.status[0][0] == 0.0
+  with pytest.raises( Pause ):
+    runner.run()
+  assert runner.status[0][0] == 50.0
+
+
 def test_external_remote_functions():
   runner = Runner( parse( 'testing.remote()' ) )
   runner.registerModule( 'factory.script.runner_plugins_test' )
@@ -1006,6 +1179,64 @@ def test_while():
   assert runner.variable_map == { 'cnt': 10 }
 
 
+def test_time_limit():
+  runner = Runner( parse( 'cnt = 0\nwhile ( cnt < 100000 ) do cnt = ( cnt + 1 )' ) )
+  assert runner.run( 10000000, time_limit=0.01 ) == 'Not Complete'
+  assert not runner.done
+  cnt = runner.variable_map[ 'cnt' ]
+  assert 0 < cnt < 100000
+  assert runner.run( 10000000, time_limit=0.01 ) == 'Not Complete'
+  assert runner.variable_map[ 'cnt' ] > cnt
+  while runner.run( 10000000, time_limit=0.05 ) == 'Not Complete':
+    pass
+  assert runner.done
+  assert runner.variable_map[ 'cnt' ] == 100000
+
+  runner = Runner( parse( 'cnt = 0\nwhile True do cnt = ( cnt + 1 )' ) )  # the steps still run out first
+  with pytest.raises( Timeout ):
+    runner.run( 350, time_limit=10 )
+  assert not runner.done
+  assert runner.variable_map[ 'cnt' ] > 0
+
+  runner = Runner( parse( 'cnt = 1\nwhile ( cnt < 10 ) do cnt = ( cnt + 1 )' ) )
+  assert runner.run( time_limit=10 ) == ''
+  assert runner.done
+  assert runner.variable_map == { 'cnt': 10 }
+
+  runner = Runner( parse( 'cnt = 0\nwhile ( cnt < 2000 ) do cnt = ( cnt + 1 )' ) )  # more than run()'s default ttl, with a time_limit only the time limits it
+  with pytest.raises( Timeout ):
+    runner.run()
+  runner = Runner( parse( 'cnt = 0\nwhile ( cnt < 2000 ) do cnt = ( cnt + 1 )' ) )
+  assert runner.run( time_limit=10 ) == ''
+  assert runner.variable_map == { 'cnt': 2000 }
+
+  runner = Runner( parse( 'cnt = 0\nwhile True do cnt = ( cnt + 1 )' ) )
+  assert runner.run( time_limit=0.01 ) == 'Not Complete'
+  assert runner.variable_map[ 'cnt' ] > 0
+
+
+def test_module_registry( monkeypatch ):
+  runner = Runner( parse( 'aa = testing.count( stop_at=2, count_by=1 )' ) )
+  runner.registerModule( 'factory.script.runner_plugins_test' )
+  assert runner.run() == 'at 1 of 2'
+
+  def import_module( name ):
+    raise Exception( 'imported "{0}" again'.format( name ) )
+
+  monkeypatch.setattr( runner_module, 'import_module', import_module )
+  runner2 = pickle.loads( pickle.dumps( runner ) )
+  assert runner2.function_map[ 'testing' ] is runner_plugins_test.SCRIPT_FUNCTIONS
+  assert runner2.value_map[ 'testing' ] is runner_plugins_test.SCRIPT_VALUES
+  assert runner2.module_list == [ 'factory.script.runner_plugins_test' ]
+  assert runner2.run() == 'at 2 of 2'
+  assert runner2.run() == ''
+  assert runner2.done
+
+  runner = Runner( parse( 'aa = 1' ) )
+  with pytest.raises( Exception ):
+    runner.registerModule( 'factory.script.parser' )
+
+
 def test_ifelse():
   runner = Runner( parse( 'if False then var = 1' ) )
   assert runner.status[0][0] == 0.0
@@ -1466,6 +1697,29 @@ def test_exists():
   assert runner.variable_map == { 'aa': False, 'bb': [ 1, 2 ] }
 
 
+def test_optimized():
+  for script in ( 'aa = ( 1 + 2 )', 'aa = ( ( 1 * 2 ) + ( 3 - 1 ) )', 'aa = ( "a" . ( 1 + 1 ) )', 'aa = not True', 'aa = ( 1 == 1 )',
+                  'aa = [ 1, ( 2 + 3 ), { bb=[ 4 ] } ]', 'aa = { bb=( 1 + 1 ) }', 'if False then aa = 1 elif ( 1 == 1 ) then aa = 2 else aa = 3',
+                  'if False then aa = 1', 'cnt = 0\nwhile ( cnt < ( 2 * 3 ) ) do cnt = ( cnt + 1 )',
+                  'aa = [ 1, 2 ]\nwhile ( len( array=aa ) < 4 ) do append( array=[ 1, 2 ], value=3 )\nbb = [ 1, 2 ]\nappend( array=aa, value=bb )', 'aa = ( 1 / 0 )', 'aa = ( 1 + "a" )' ):
+    result_list = []
+    for optimize in ( False, True ):
+      runner = Runner( parse( script, optimize ) )
+      try:
+        runner.run( 100 )
+        result_list.append( runner.variable_map )
+      except Exception as e:
+        result_list.append( type( e ) )
+
+    assert result_list[0] == result_list[1]
+
+  ast = parse( 'cnt = 0\nwhile ( cnt < 2 ) do begin()\nappend( array=[ 1, 2 ], value=3 )\ncnt = ( cnt + 1 )\nend', True )  # the folded array is not changed
+  runner = Runner( ast )
+  runner.run()
+  assert runner.done
+  assert ast == parse( 'cnt = 0\nwhile ( cnt < 2 ) do begin()\nappend( array=[ 1, 2 ], value=3 )\ncnt = ( cnt + 1 )\nend', True )
+
+
 def test_block_timing():
   runner = Runner( parse( 'begin( expected_time=0:10 )\ndelay( seconds=4 )\nend' ) )
   assert runner.run() == 'Waiting for 3 more seconds'
@@ -1564,3 +1818,33 @@ def test_block_timing_with_remote():
   assert runner.line is None
   assert runner.status == [ ( 100.0, 'Scope', None ) ]
   assert runner.toAssembler( [ 'testing' ] ) is None
+
+
+def test_trace():
+  runner = Runner( parse( 'aa = 1\nbb = 2' ) )
+  assert runner.trace == []
+  runner.run()
+  assert runner.trace == []
+  assert 'trace_buffer' not in runner.__getstate__()
+
+  runner = Runner( parse( 'aa = 1\nbb = 2' ) )
+  runner.enableTrace()
+  with pytest.raises( Timeout ):
+    runner.run( 2 )
+  runner = pickle.loads( pickle.dumps( runner ) )
+  runner.run()
+  assert runner.done
+  assert [ ( item[2], item[3] ) for item in runner.trace ] == [ ( 'run', 2 ), ( 'raise', ( 'Timeout', '1' ) ), ( 'run', 1000 ), ( 'return', '' ) ]
+
+  runner = Runner( parse( 'aa = 1\nbb = 2' ) )
+  runner.enableTrace( TRACE_STEP, 5 )
+  runner.run()
+  trace = runner.trace
+  assert len( trace ) == 5
+  assert [ item[2] for item in trace ] == [ 'step', 'step', 'step', 'step', 'return' ]
+  assert trace[ -2 ][1] == 2
+
+  runner.enableTrace( TRACE_RUN, 2 )
+  assert runner.trace == trace[ -2: ]
+  runner.disableTrace()
+  assert runner.trace == []
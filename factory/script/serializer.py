@@ -0,0 +1,92 @@
+import lzma
+import zlib
+import pickle
+
+from factory.script.runner import Runner
+from factory.script.compiler import CompiledRunner
+
+"""
+Storage format of Runners.
+
+  MAGIC <format version byte> <compression byte> <payload>
+
+The payload is a pickle of a tuple of the runner's fields in a fixed order,
+not of the Runner it's self, so stored runners do not depend on the module
+path or layout of the Runner classes.  The AST is only stored when the runner
+has no ast_hash, otherwise load_runner gets it from the ast_loader.
+
+Anything without the MAGIC header is a pickle of the Runner, as jobs stored
+it before this format, load_runner still loads those.  A new format version gets a new
+_decode_v<n>, so the older versions can still be loaded.
+"""
+
+MAGIC = b'FRS'
+FORMAT_VERSION = 1
+PICKLE_PROTOCOL = 4
+COMPRESS_SIZE = 2048  # default size payloads are compressed at
+
+COMPRESS_NONE = 0
+COMPRESS_ZLIB = 1
+COMPRESS_LZMA = 2
+
+compression_map = { None: COMPRESS_NONE, 'zlib': COMPRESS_ZLIB, 'lzma': COMPRESS_LZMA }
+
+_compress_map = { COMPRESS_ZLIB: lambda payload: zlib.compress( payload, 1 ), COMPRESS_LZMA: lambda payload: lzma.compress( payload, preset=0 ) }  # the fastest levels, the higher ones are much slower for little gain on runner state
+_decompress_map = { COMPRESS_NONE: lambda payload: payload, COMPRESS_ZLIB: zlib.decompress, COMPRESS_LZMA: lzma.decompress }
+
+runner_class_map = { 'Runner': Runner, 'CompiledRunner': CompiledRunner }  # stored by this name, keep the names of renamed classes
+
+_FIELD_LIST_V1 = ( 'module_list', 'object_list', 'state', 'variable_map', 'cur_line', 'factory_cookie' )  # the other __getstate__ values go in a dict after these
+
+
+def dump_runner( runner, compression='zlib', compress_size=COMPRESS_SIZE ):
+  state = runner.__getstate__()
+  item_list = [ runner.__class__.__name__, runner.ast_hash, runner.ast if runner.ast_hash is None else None ]
+  for name in _FIELD_LIST_V1:
+    item_list.append( state.pop( name ) )
+
+  item_list.append( state or None )
+
+  payload = pickle.dumps( tuple( item_list ), protocol=PICKLE_PROTOCOL )
+  method = compression_map[ compression ]
+  if method == COMPRESS_NONE or len( payload ) < compress_size:
+    return MAGIC + bytes( ( FORMAT_VERSION, COMPRESS_NONE ) ) + payload
+
+  return MAGIC + bytes( ( FORMAT_VERSION, method ) ) + _compress_map[ method ]( payload )
+
+
+def load_runner( blob, ast_loader ):  # ast_loader( ast_hash ) returns the AST
+  blob = bytes( blob )  # the database may hand back a memoryview
+  if not blob.startswith( MAGIC ):
+    return pickle.loads( blob )  # a pickle of the Runner from before the format, it has the AST in it
+
+  version = blob[ len( MAGIC ) ]
+  try:
+    decoder = _decoder_map[ version ]
+  except KeyError:
+    raise ValueError( 'Unknown runner format version "{0}"'.format( version ) )
+
+  try:
+    decompress = _decompress_map[ blob[ len( MAGIC ) + 1 ] ]
+  except KeyError:
+    raise ValueError( 'Unknown runner compression "{0}"'.format( blob[ len( MAGIC ) + 1 ] ) )
+
+  return decoder( pickle.loads( decompress( blob[ len( MAGIC ) + 2: ] ) ), ast_loader )
+
+
+def _decode_v1( item_list, ast_loader ):
+  ( class_name, ast_hash, ast ) = item_list[ :3 ]
+  if ast is None:
+    ast = ast_loader( ast_hash )
+
+  state = dict( zip( _FIELD_LIST_V1, item_list[ 3:-1 ] ) )
+  if item_list[ -1 ] is not None:
+    state.update( item_list[ -1 ] )
+
+  runner = runner_class_map[ class_name ]( ast, ast_hash )
+  runner.__setstate__( state )
+
+  return runner
+
+
+_decoder_map = { 1: _decode_v1 }
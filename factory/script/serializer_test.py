@@ -0,0 +1,114 @@
+import pickle
+import pytest
+
+from factory.script.parser import parse
+from factory.script.runner import Runner
+from factory.script import compiler
+from factory.script.compiler import CompiledRunner
+from factory.script.serializer import dump_runner, load_runner, MAGIC, COMPRESS_NONE, COMPRESS_ZLIB, COMPRESS_LZMA
+
+
+SCRIPT = 'aa = [ 1, 2, { bb="cc" } ]\nrr = testing.remote()\ndd = aa\ntesting.count( stop_at=2, count_by=1 )\nee = part.values'
+
+
+class testPart( object ):
+  SCRIPT_NAME = 'part'
+
+  def __init__( self, values ):
+    super().__init__()
+    self.values = values
+
+  def getValues( self ):
+    return { 'values': ( lambda: self.values, None ) }
+
+  def getFunctions( self ):
+    return {}
+
+  def __reduce__( self ):
+    return ( self.__class__, ( self.values, ) )
+
+
+def _runner( runner_class, ast_hash ):  # a runner waiting on testing.remote()
+  runner = runner_class( parse( SCRIPT ), ast_hash )
+  runner.registerModule( 'factory.script.runner_plugins_test' )
+  runner.registerObject( testPart( { 'field{0}'.format( i ): 'value {0}'.format( i ) for i in range( 0, 200 ) } ) )
+  assert runner.run() == 'Not Initilized'
+  assert runner.toAssembler( [ 'testing' ] ) is not None
+
+  return runner
+
+
+def _finish( runner ):
+  assert runner.fromAssembler( runner.factory_cookie, 'good' ) == ( 'Accepted', 'Current State "good"' )
+  assert runner.run() == 'at 1 of 2'
+  assert runner.run() == 'at 2 of 2'
+  assert runner.run() == ''
+  assert runner.done
+  assert runner.variable_map[ 'rr' ] == 'good'
+  assert runner.variable_map[ 'dd' ] == [ 1, 2, { 'bb': 'cc' } ]
+  assert runner.variable_map[ 'ee' ][ 'field3' ] == 'value 3'
+
+
+@pytest.mark.parametrize( 'runner_class', [ Runner, CompiledRunner ] )
+def test_round_trip( runner_class ):
+  ast_list = []
+
+  def ast_loader( ast_hash ):
+    ast_list.append( ast_hash )
+    return parse( SCRIPT )
+
+  runner = _runner( runner_class, 'hash{0}'.format( runner_class.__name__ ) )
+  for compression, method in ( ( None, COMPRESS_NONE ), ( 'zlib', COMPRESS_ZLIB ), ( 'lzma', COMPRESS_LZMA ) ):
+    blob = dump_runner( runner, compression, 100 )
+    assert blob.startswith( MAGIC )
+    assert blob[ len( MAGIC ) + 1 ] == method
+    runner2 = load_runner( blob, ast_loader )
+    assert runner2.__class__ is runner_class
+    assert runner2.ast_hash == runner.ast_hash
+    assert runner2.status == runner.status
+    assert runner2.variable_map == runner.variable_map
+    assert runner2.factory_cookie == runner.factory_cookie
+
+  assert ast_list == [ runner.ast_hash ] * 3
+  assert dump_runner( runner, 'zlib' )[ len( MAGIC ) + 1 ] == COMPRESS_ZLIB
+  assert dump_runner( runner, 'zlib', 1000000 )[ len( MAGIC ) + 1 ] == COMPRESS_NONE
+  assert len( dump_runner( runner, 'zlib' ) ) < len( dump_runner( runner, None ) )
+
+  runner = load_runner( dump_runner( runner ), ast_loader )
+  _finish( runner )
+
+  runner = _runner( runner_class, None )  # no ast_hash, the AST goes with it
+  blob = dump_runner( runner )
+  runner = load_runner( blob, None )
+  assert runner.ast_hash is None
+  _finish( runner )
+
+
+@pytest.mark.parametrize( 'runner_class', [ Runner, CompiledRunner ] )
+def test_legacy( runner_class ):  # runners pickled before the format
+  runner = _runner( runner_class, None )
+  _finish( load_runner( pickle.dumps( runner, protocol=4 ), None ) )
+
+
+def test_bad():
+  runner = Runner( parse( SCRIPT ) )
+  blob = dump_runner( runner )
+  with pytest.raises( ValueError ):
+    load_runner( MAGIC + b'\xff' + blob[ len( MAGIC ) + 1: ], None )
+
+  with pytest.raises( ValueError ):
+    load_runner( blob[ :len( MAGIC ) + 1 ] + b'\xff' + blob[ len( MAGIC ) + 2: ], None )
+
+  assert load_runner( memoryview( blob ), None ).variable_map == {}
+
+
+def test_program_version( monkeypatch ):
+  blob = dump_runner( _runner( CompiledRunner, None ) )
+  monkeypatch.setattr( compiler, 'PROGRAM_VERSION', compiler.PROGRAM_VERSION + 1 )
+  with pytest.raises( ValueError ):
+    load_runner( blob, None )
+
+  runner = CompiledRunner( parse( SCRIPT ) )  # not started, so there is no pc to go wrong
+  blob = dump_runner( runner )
+  monkeypatch.setattr( compiler, 'PROGRAM_VERSION', compiler.PROGRAM_VERSION + 1 )
+  assert load_runner( blob, None ).state == []
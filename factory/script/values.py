@@ -0,0 +1,66 @@
+"""
+Copy on write arrays and maps for the script runner.
+
+Assigning a value to a variable, or putting it in an array/map, does not copy
+it, arrays/maps are marked shared instead.  A shared ScriptList/ScriptMap, or
+a plain list/dict (a constant from the AST, a value from a module), is never
+changed in place, the runner changes a shallow copy and puts the copy where
+the original was, so only the arrays/maps on the way to the change are copied.
+
+Values handed to code outside the script, module functions and setters, are
+detached, that code does not know about shared, and may change them.
+"""
+
+
+class ScriptList( list ):
+  __slots__ = ( 'shared', )
+
+  def __init__( self, *args ):
+    super().__init__( *args )
+    self.shared = False
+
+
+class ScriptMap( dict ):
+  __slots__ = ( 'shared', )
+
+  def __init__( self, *args, **kwargs ):
+    super().__init__( *args, **kwargs )
+    self.shared = False
+
+
+def share( value ):  # value is being put somewhere else as well, from now on it can not be changed in place
+  if value.__class__ is ScriptList or value.__class__ is ScriptMap:
+    value.shared = True
+
+  return value
+
+
+def owned( value ):  # value, or if it is shared, a copy of it that can be changed in place
+  if value.__class__ is ScriptList or value.__class__ is ScriptMap:
+    if not value.shared:
+      return value
+
+  elif not isinstance( value, ( list, dict ) ):
+    return value
+
+  if isinstance( value, list ):
+    result = ScriptList( value )
+    for item in result:
+      share( item )
+
+  else:
+    result = ScriptMap( value )
+    for item in result.values():
+      share( item )
+
+  return result
+
+
+def detached( value ):  # a copy of value all the way down, for code outside the script, so what it does with it is not seen by the script, or the AST the value may be a constant from
+  if isinstance( value, list ):
+    return [ detached( item ) for item in value ]
+
+  if isinstance( value, dict ):
+    return dict( ( key, detached( item ) ) for key, item in value.items() )
+
+  return value
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+#
+# Benchmark for several assemblers polling getJobs at the same time, each a process
+# that gets jobs and sends the results straight back, tasks/second for each number of assemblers
+#
+# needs a database with row locking, ie: PostgreSQL, see --engine in processjobs_bench.py
+# run from the top of the source tree: ./lib/benchmark/assembler_bench.py -e postgresql
+#
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+sys.path.insert( 0, os.path.join( os.path.dirname( __file__ ), '..', '..' ) )
+
+from processjobs_bench import add_database_arguments, setup, create_jobs
+
+SCRIPT = 'while True do testing.remote()'  # every run sends a task to the assembler
+PLUGIN_MODULE = 'factory.script.runner_plugins_test'
+
+
+def assembler( duration, max_jobs, queue ):
+  from django.db import connections, transaction
+  from factory.Assembler.models import Assembler
+
+  connections.close_all()  # the connection from before the fork is the parent's
+  task_count = 0
+  poll_count = 0
+  end_at = time.monotonic() + duration
+  while time.monotonic() < end_at:
+    with transaction.atomic():  # as the API server does for each request
+      task_list = Assembler.getJobs( [ 'testing' ], max_jobs )
+
+    poll_count += 1
+    for task in task_list:
+      with transaction.atomic():
+        Assembler.jobResults( task[ 'job_id' ], task[ 'cookie' ], 'good' )
+
+    task_count += len( task_list )
+
+  connections.close_all()
+  queue.put( ( task_count, poll_count ) )
+
+
+def main():
+  arg_parser = argparse.ArgumentParser( description='Concurrent Assembler Benchmark' )
+  arg_parser.add_argument( '-j', '--jobs', help='number of queued jobs, default: 2000', type=int, default=2000 )
+  arg_parser.add_argument( '-a', '--assemblers', help='numbers of assemblers to run at once, default: 1 2 4 8', type=int, nargs='*', default=[ 1, 2, 4, 8 ] )
+  arg_parser.add_argument( '-m', '--max-jobs', help='max_jobs of each getJobs, default: 10', type=int, default=10 )
+  arg_parser.add_argument( '-s', '--seconds', help='seconds each number of assemblers is run for, default: 10', type=float, default=10.0 )
+  add_database_arguments( arg_parser )
+  args = arg_parser.parse_args()
+
+  setup( args, 1.0 )
+
+  from django.db import connections
+  from factory.WorkOrder.lib import RUNNER_MODULE_LIST
+
+  RUNNER_MODULE_LIST.append( PLUGIN_MODULE )
+  start = time.perf_counter()
+  create_jobs( args.jobs, 0, args.jobs, SCRIPT )
+  print( '{0:>30}: {1:7} jobs {2:10.3f} s'.format( 'create', args.jobs, time.perf_counter() - start ) )
+  connections.close_all()
+
+  context = multiprocessing.get_context( 'fork' )  # the children get the configured django
+  base_rate = None
+  for count in args.assemblers:
+    queue = context.Queue()
+    process_list = [ context.Process( target=assembler, args=( args.seconds, args.max_jobs, queue ) ) for _ in range( 0, count ) ]
+    for process in process_list:
+      process.start()
+
+    result_list = [ queue.get() for _ in process_list ]
+    for process in process_list:
+      process.join()
+
+    rate = sum( result[0] for result in result_list ) / args.seconds
+    if base_rate is None:
+      base_rate = rate
+
+    print( '{0:>30}: {1:10.1f} tasks/s {2:6.2f}x {3:8} polls'.format( '{0} assemblers'.format( count ), rate, rate / base_rate if base_rate else 0.0, sum( result[1] for result in result_list ) ) )
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+#
+# Benchmark for the script parser
+#
+# the scripts used are the ones passed to parse()/lint() in factory/script/parser_test.py
+# and generated scripts of the line counts given with --lines
+# run from the top of the source tree: ./lib/benchmark/parser_bench.py
+#
+import os
+import sys
+import ast
+import time
+import bisect
+import argparse
+
+sys.path.insert( 0, os.path.join( os.path.dirname( __file__ ), '..', '..' ) )
+
+from parsimonious import Grammar
+
+from factory.script import parser
+from factory.script.parser import Types
+
+TEST_FILE = os.path.join( os.path.dirname( __file__ ), '..', '..', 'factory', 'script', 'parser_test.py' )
+
+
+def test_scripts():
+  result = []
+  tree = ast.parse( open( TEST_FILE, 'r' ).read() )
+  for node in ast.walk( tree ):
+    if not isinstance( node, ast.Call ) or not isinstance( node.func, ast.Name ) or node.func.id not in ( 'parse', 'lint' ):
+      continue
+
+    if node.args and isinstance( node.args[0], ast.Constant ) and isinstance( node.args[0].value, str ):
+      result.append( node.args[0].value )
+
+  return result
+
+
+def generated_script( line_count ):
+  block = [
+            'count = ( count + 1 )',
+            'name = ( "part " . count )',
+            'if ( count > 10 ) then count = 0',
+            'values = [ 1, 2, ( count * 2 ) ]',
+            '# just a comment',
+          ]
+  return '\n'.join( block[ i % len( block ) ] for i in range( 0, line_count ) )
+
+
+class LinearLineParser( parser.Parser ):  # the line number lookup as it was before bisect
+  def line( self, node ):
+    value = self._eval( node.children[0] )
+    if value is parser._EMPTY:
+      return value
+
+    for i in range( 0, len( self.line_endings ) ):
+      if self.line_endings[ i ] > node.start:
+        break
+
+    return ( Types.LINE, value, i + 1 )
+
+
+class IsEmpty( Exception ):
+  pass
+
+
+class GetattrEvalParser( parser.Parser ):  # the AST building dispatch as it was before the handler_map
+  def _eval( self, node ):
+    if node.expr_name[ 0:3 ] in ( 'ws_', 'nl_', 'em_' ):
+      raise IsEmpty()
+
+    try:
+      handler = getattr( self, node.expr_name )
+    except AttributeError:
+      handler = self.anonymous
+
+    return handler( node )
+
+  def anonymous( self, node ):
+    if len( node.children ) < 1:
+      raise IsEmpty()
+
+    return self._eval( node.children[0] )
+
+  def lines( self, node ):
+    result = []
+    for child in node.children:
+      try:
+        result.append( self._eval( child ) )
+      except IsEmpty:
+        pass
+
+    return result
+
+  def line( self, node ):
+    return ( Types.LINE, self._eval( node.children[0] ), bisect.bisect_right( self.line_endings, node.start ) + 1 )
+
+
+def phases( parser_class, script, rounds ):  # returns ( PEG parse time, AST build time )
+  peg_time = 0.0
+  ast_time = 0.0
+  script += '\n'
+  for _ in range( 0, rounds ):
+    p = parser_class()
+    p.line_endings = [ i for i, c in enumerate( script ) if c == '\n' ]
+    start = time.perf_counter()
+    root_node = p.grammar.parse( script )
+    peg_time += time.perf_counter() - start
+    start = time.perf_counter()
+    p._eval( root_node )
+    ast_time += time.perf_counter() - start
+
+  return ( peg_time / rounds, ast_time / rounds )
+
+
+def timeit( func, script_list, rounds ):
+  start = time.perf_counter()
+  for _ in range( 0, rounds ):
+    for script in script_list:
+      func( script )
+
+  return ( time.perf_counter() - start ) / ( rounds * len( script_list ) )
+
+
+def uncached( script ):  # what every Parser() did before the grammar was shared
+  p = parser.Parser()
+  p.grammar = Grammar( parser.script_grammar )
+  p.lint( script )
+
+
+def cached( script ):
+  parser.Parser().lint( script )
+
+
+def recursive_descent( script ):
+  parser.RecursiveDescentParser().lint( script )
+
+
+def main():
+  arg_parser = argparse.ArgumentParser( description='Script Parser Benchmark' )
+  arg_parser.add_argument( '-r', '--rounds', help='number of times to parse each script, default: 3', type=int, default=3 )
+  arg_parser.add_argument( '-l', '--lines', help='line counts of the generated scripts, default: 500 5000 50000', type=int, nargs='*', default=[ 500, 5000, 50000 ] )
+  arg_parser.add_argument( '--linear', help='also time the linear line number lookup on the generated scripts', action='store_true' )
+  args = arg_parser.parse_args()
+
+  script_list = test_scripts()
+  print( 'Scripts: {0}'.format( len( script_list ) ) )
+
+  for name, func in ( ( 'grammar per Parser', uncached ), ( 'shared grammar', cached ), ( 'recursive_descent', recursive_descent ) ):
+    print( '{0:>30}: {1:10.1f} us/parse'.format( name, timeit( func, script_list, args.rounds ) * 1000000 ) )
+
+  print()
+  print( 'Phases, PEG parse / AST build:' )
+  for line_count in args.lines:
+    script = generated_script( line_count )
+    for name, parser_class in ( ( 'handler_map', parser.Parser ), ( 'getattr + IsEmpty', GetattrEvalParser ) ):
+      peg_time, ast_time = phases( parser_class, script, args.rounds )
+      print( '{0:>30}: {1:7} lines {2:10.3f} s / {3:8.3f} s'.format( name, line_count, peg_time, ast_time ) )
+
+  print()
+  print( 'Lint after a one line edit, full / incremental:' )
+  for line_count in args.lines:
+    script = generated_script( line_count )
+    parser.lint_incremental( script )  # prime the cache
+    edited = script.replace( 'count = ( count + 1 )', 'count = ( count + 2 )', 1 )
+    full = timeit( parser.lint, [ edited ], 1 )
+    incremental = timeit( parser.lint_incremental, [ edited ], 1 )
+    print( '{0:>30}: {1:7} lines {2:10.3f} s / {3:8.3f} s'.format( 'lint', line_count, full, incremental ) )
+
+  print()
+  print( 'Generated Scripts:' )
+  for line_count in args.lines:
+    script = generated_script( line_count )
+    parser_list = [ ( 'parse', parser.Parser ), ( 'parse (recursive_descent)', parser.RecursiveDescentParser ) ]
+    if args.linear:
+      parser_list.append( ( 'parse (linear line lookup)', LinearLineParser ) )
+
+    for name, parser_class in parser_list:
+      elapsed = timeit( lambda script: parser_class().parse( script ), [ script ], 1 )
+      print( '{0:>30}: {1:7} lines {2:10.3f} s {3:10.1f} us/line'.format( name, line_count, elapsed, elapsed * 1000000 / line_count ) )
+
+
+if __name__ == '__main__':
+  main()
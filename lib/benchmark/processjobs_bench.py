@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+#
+# Benchmark for the Assembler's getJobs, processJobs with a table of jobs in various states
+#
+# uses a sqlite database, by default in memory, or a PostgreSQL database with --engine postgresql,
+# the parts are generated, so mongo is not needed
+# run from the top of the source tree: ./lib/benchmark/processjobs_bench.py
+#
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert( 0, os.path.join( os.path.dirname( __file__ ), '..', '..' ) )
+
+import django
+from django.conf import settings
+
+SCRIPT = 'delay( seconds=600 )'  # once run, the queued jobs are waiting on the delay, and not ready again until it is up
+STATE_LIST = ( 'new', 'done', 'paused', 'error', 'aborted' )  # the states of the jobs not waiting or queued, in turn
+
+
+def add_database_arguments( arg_parser ):
+  arg_parser.add_argument( '-e', '--engine', help='database engine, sqlite or postgresql, default: sqlite', choices=( 'sqlite', 'postgresql' ), default='sqlite' )
+  arg_parser.add_argument( '-d', '--database', help='sqlite database file, default: in memory, or PostgreSQL database, default: factory_bench, it is flushed first', default=None )
+  arg_parser.add_argument( '--host', help='PostgreSQL host, default: 127.0.0.1', default='127.0.0.1' )
+  arg_parser.add_argument( '--user', help='PostgreSQL user, default: factory', default='factory' )
+  arg_parser.add_argument( '--password', help='PostgreSQL password, default: factory', default='factory' )
+
+
+def setup( args, process_jobs_time ):
+  if args.engine == 'postgresql':
+    database = { 'ENGINE': 'django.db.backends.postgresql', 'NAME': args.database or 'factory_bench', 'USER': args.user, 'PASSWORD': args.password, 'HOST': args.host }
+  else:
+    database = { 'ENGINE': 'django.db.backends.sqlite3', 'NAME': args.database or ':memory:' }
+
+  settings.configure(
+                      SECRET_KEY='benchmark',
+                      INSTALLED_APPS=( 'factory.Auth', 'factory.Plan', 'factory.WorkOrder', 'factory.Assembler', 'django.contrib.auth', 'django.contrib.contenttypes' ),
+                      DATABASES={ 'default': database },
+                      USE_TZ=True,
+                      PROCESS_JOBS_TIME=process_jobs_time
+                    )
+  django.setup()
+
+  from django.core.management import call_command
+  call_command( 'migrate', run_syncdb=True, verbosity=0 )
+  call_command( 'flush', interactive=False, verbosity=0 )
+
+
+def create_jobs( job_count, waiting_count, queued_count, script=SCRIPT ):
+  from django.utils import timezone
+  from factory.Plan.models import Drawing
+  from factory.WorkOrder.models import WorkOrder, Job, store_ast
+  from factory.WorkOrder.lib import _newJob
+
+  drawing = Drawing( name='bench', description='benchmark', script=script )
+  drawing.save()
+  workorder = WorkOrder( user='bench', name=drawing.name, script=drawing.script, part_query='{}', execution_style='parallel', started_at=timezone.now() )
+  workorder.save()
+  ast_hash = store_ast( script )
+
+  job_list = []
+  for i in range( 0, job_count ):
+    job = _newJob( workorder, { '_id': 'part{0}'.format( i ), 'name': 'part {0}'.format( i ), 'size': i }, ast_hash )
+    if i < waiting_count:
+      job.state = 'waiting'
+    elif i < waiting_count + queued_count:
+      job.state = 'queued'
+      job.started_at = timezone.now()
+    else:
+      job.state = STATE_LIST[ i % len( STATE_LIST ) ]
+      if job.state != 'new':
+        job.started_at = timezone.now()
+
+      if job.state == 'done':
+        job.finished_at = timezone.now()
+
+    job_list.append( job )
+
+  Job.objects.bulk_create( job_list, batch_size=500 )
+
+
+def get_jobs():
+  from django.db import transaction
+  from factory.Assembler.models import Assembler
+
+  start = time.perf_counter()
+  with transaction.atomic():  # as the API server does for each request
+    Assembler.getJobs( [], 10 )
+
+  return time.perf_counter() - start
+
+
+def main():
+  arg_parser = argparse.ArgumentParser( description='Assembler getJobs Benchmark' )
+  arg_parser.add_argument( '-j', '--jobs', help='total number of jobs, default: 10000', type=int, default=10000 )
+  arg_parser.add_argument( '-w', '--waiting', help='number of jobs waiting to be started, default: 1000', type=int, default=1000 )
+  arg_parser.add_argument( '-q', '--queued', help='number of queued jobs, default: 100', type=int, default=100 )
+  arg_parser.add_argument( '-r', '--rounds', help='number of getJobs calls after the first, default: 20', type=int, default=20 )
+  arg_parser.add_argument( '-t', '--time', help='PROCESS_JOBS_TIME, seconds, default: 5.0', type=float, default=5.0 )
+  add_database_arguments( arg_parser )
+  args = arg_parser.parse_args()
+
+  setup( args, args.time )
+
+  start = time.perf_counter()
+  create_jobs( args.jobs, args.waiting, args.queued )
+  print( '{0:>30}: {1:7} jobs {2:10.3f} s'.format( 'create', args.jobs, time.perf_counter() - start ) )
+
+  from factory.WorkOrder.models import Job
+  print( '{0:>30}: {1}'.format( 'states', ', '.join( '{0}={1}'.format( state, Job.objects.filter( state=state ).count() ) for state in ( 'waiting', 'queued' ) + STATE_LIST ) ) )
+
+  print( '{0:>30}: {1:10.2f} ms'.format( 'first, starting the waiting', get_jobs() * 1000 ) )
+
+  elapsed_list = sorted( get_jobs() for _ in range( 0, args.rounds ) )
+  print( '{0:>30}: {1:10.2f} ms min {2:10.2f} ms median {3:10.2f} ms max'.format( 'getJobs', elapsed_list[0] * 1000, elapsed_list[ len( elapsed_list ) // 2 ] * 1000, elapsed_list[-1] * 1000 ) )
+
+
+if __name__ == '__main__':
+  main()
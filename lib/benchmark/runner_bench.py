@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+#
+# Benchmark for the script runner, the tree walking Runner against the CompiledRunner
+#
+# the scripts used are the ones passed to Runner( parse( ... ) ) in factory/script/runner_test.py
+# run from the top of the source tree: ./lib/benchmark/runner_bench.py
+#
+import os
+import sys
+import ast
+import time
+import pickle
+import logging
+import argparse
+
+sys.path.insert( 0, os.path.join( os.path.dirname( __file__ ), '..', '..' ) )
+
+from factory.script.parser import parse
+from factory.script.runner import Runner, Timeout, TRACE_RUN, TRACE_STEP
+from factory.script.compiler import CompiledRunner, compile_ast
+from factory.script.serializer import dump_runner, load_runner
+
+TEST_FILE = os.path.join( os.path.dirname( __file__ ), '..', '..', 'factory', 'script', 'runner_test.py' )
+PLUGIN_MODULE = 'factory.script.runner_plugins_test'
+
+
+def test_scripts():
+  result = []
+  tree = ast.parse( open( TEST_FILE, 'r' ).read() )
+  for node in ast.walk( tree ):
+    if not isinstance( node, ast.Call ) or not isinstance( node.func, ast.Name ) or node.func.id != 'parse':
+      continue
+
+    if node.args and isinstance( node.args[0], ast.Constant ) and isinstance( node.args[0].value, str ):
+      if 'delay(' in node.args[0].value or 'max_time' in node.args[0].value:  # these wait on the clock
+        continue
+
+      result.append( node.args[0].value )
+
+  return result
+
+
+def run_all( runner, ttl ):  # run until done/aborted or it stops making progress
+  for _ in range( 0, 20 ):
+    try:
+      runner.run( ttl )
+    except Exception:
+      pass
+
+    if runner.done or runner.aborted:
+      return
+
+
+def timeit( runner_class, ast_list, rounds, ttl=1000 ):
+  start = time.perf_counter()
+  for _ in range( 0, rounds ):
+    for ast_hash, script_ast in ast_list:
+      runner = runner_class( script_ast, ast_hash )
+      runner.registerModule( PLUGIN_MODULE )
+      run_all( runner, ttl )
+
+  return ( time.perf_counter() - start ) / ( rounds * len( ast_list ) )
+
+
+class EagerLoggingRunner( Runner ):  # the step logging as it was, formatted even when debug logging is off
+  def _evaluate( self, operation, state_index ):
+    logging.debug( 'runner: _evaluate level: "{0}" operation: "{1}"'.format( state_index, operation ) )
+    logging.debug( 'runner: _evaluate level: "{0}" start state: "{1}"'.format( state_index, self.state ) )
+    super()._evaluate( operation, state_index )
+    logging.debug( 'runner: _evaluate level: "{0}" final state: {1}'.format( state_index, self.state ) )
+
+
+def traced( runner_class, level ):
+  class TracedRunner( runner_class ):
+    def __init__( self, *args, **kwargs ):
+      super().__init__( *args, **kwargs )
+      self.enableTrace( level )
+
+  return TracedRunner
+
+
+def nested_script( depth ):  # a function that takes many run()s to finish, nested depth blocks deep
+  return '\n'.join( [ 'begin()' ] * depth + [ 'cnt = 0', 'while ( cnt < 1 ) do begin()', 'testing.count( stop_at=1000, count_by=1 )', 'cnt = 1', 'end' ] + [ 'end' ] * depth )
+
+
+def resume( runner_class, script_ast, rounds ):  # time per run() call to get back into the paused function
+  runner = runner_class( script_ast, 'resume{0}'.format( id( script_ast ) ) )  # the compiled program is cached by hash
+  runner.registerModule( PLUGIN_MODULE )
+  runner.run()
+  start = time.perf_counter()
+  for _ in range( 0, rounds ):
+    runner.run()
+
+  return ( time.perf_counter() - start ) / rounds
+
+
+def literal_script( kind, size ):  # the items are variables so the parser can't fold it into a constant
+  if kind == 'array':
+    return 'aa = 1\nbb = [ {0} ]\n'.format( ', '.join( [ 'aa' ] * size ) )
+
+  if kind == 'map':
+    return 'aa = 1\nbb = {{ {0} }}\n'.format( ', '.join( [ 'k{0}=aa'.format( i ) for i in range( 0, size ) ] ) )
+
+  return 'aa = 1\nbb = {0}aa{1}\n'.format( '( ' * size, ' + 1 )' * size )  # nested infix
+
+
+def assign_script( size, change ):  # 100 assignments of a size item array of maps, optionally changing one item of the copy
+  script = 'xx = {{ name="part", size=1024 }}\naa = [ {0} ]\ncnt = 0\nwhile ( cnt < 100 ) do begin()\nbb = aa\n'.format( ', '.join( [ 'xx' ] * size ) )
+  if change:
+    script += 'bb[ 0 ] = cnt\n'
+
+  return script + 'cnt = ( cnt + 1 )\nend\n'
+
+
+def run_until_done( runner, ttl ):  # number of run() calls, giving up after 1000
+  for count in range( 1, 1001 ):
+    try:
+      runner.run( ttl )
+    except Timeout:
+      continue
+
+    if runner.done:
+      return count
+
+  return None
+
+
+def state_size( runner_class, script_ast, rounds ):  # pickled size of a paused runner, without the AST, and time to save and restore it
+  runner = runner_class( script_ast, 'size{0}'.format( id( script_ast ) ) )
+  runner.registerModule( PLUGIN_MODULE )
+  runner.run()
+  start = time.perf_counter()
+  for _ in range( 0, rounds ):
+    buff = pickle.dumps( runner.__getstate__() )
+    runner_class( script_ast ).__setstate__( pickle.loads( buff ) )
+
+  return ( len( buff ), ( time.perf_counter() - start ) / rounds )
+
+
+def status_time( runner_class, script_ast, rounds ):  # time to read the status of a paused runner, walking the state each time / once
+  runner = runner_class( script_ast, 'status{0}'.format( id( script_ast ) ) )
+  runner.registerModule( PLUGIN_MODULE )
+  runner.run()
+  start = time.perf_counter()
+  for _ in range( 0, rounds ):
+    runner._status = None
+    runner.status
+
+  walked = ( time.perf_counter() - start ) / rounds
+  start = time.perf_counter()
+  for _ in range( 0, rounds ):
+    runner.status
+
+  return ( walked, ( time.perf_counter() - start ) / rounds )
+
+
+class Part( object ):  # like the WorkOrder PartPlugin, the part's document goes with each job
+  SCRIPT_NAME = 'part'
+
+  def __init__( self, values ):
+    super().__init__()
+    self.values = values
+
+  def getValues( self ):
+    return { 'values': ( lambda: self.values, None ) }
+
+  def getFunctions( self ):
+    return {}
+
+  def __reduce__( self ):
+    return ( self.__class__, ( self.values, ) )
+
+
+def job_runner( runner_class, script_ast, field_count ):  # a job paused in the function, with a part of field_count fields in a variable
+  part = { 'field{0}'.format( i ): { 'value': 'value of field {0}'.format( i ), 'size': i, 'tags': [ 'a', 'b' ] } for i in range( 0, field_count ) }
+  runner = runner_class( script_ast, 'job{0}'.format( id( script_ast ) ) )
+  runner.registerModule( PLUGIN_MODULE )
+  runner.registerObject( Part( part ) )
+  runner.run()
+
+  return runner
+
+
+def store_time( runner, compression, rounds ):  # size of the stored runner and time to dump and load it, compression 'legacy' for the pickle of the Runner jobs stored before the format
+  start = time.perf_counter()
+  for _ in range( 0, rounds ):
+    if compression == 'legacy':
+      blob = pickle.dumps( runner, protocol=4 )
+      load_runner( blob, lambda ast_hash: runner.ast )
+    else:
+      blob = dump_runner( runner, compression )
+      load_runner( blob, lambda ast_hash: runner.ast )
+
+  return ( len( blob ), ( time.perf_counter() - start ) / rounds )
+
+
+def main():
+  arg_parser = argparse.ArgumentParser( description='Script Runner Benchmark' )
+  arg_parser.add_argument( '-r', '--rounds', help='number of times to run each script, default: 20', type=int, default=20 )
+  arg_parser.add_argument( '-l', '--loops', help='iteration counts of the loop script, default: 1000 10000 100000', type=int, nargs='*', default=[ 1000, 10000, 100000 ] )
+  arg_parser.add_argument( '-s', '--sizes', help='item counts of the array/map literals, default: 1000 10000', type=int, nargs='*', default=[ 1000, 10000 ] )
+  arg_parser.add_argument( '-i', '--infix', help='nesting depths of the infix expression, default: 50 100 200', type=int, nargs='*', default=[ 50, 100, 200 ] )
+  arg_parser.add_argument( '-d', '--depths', help='nesting depths of the resume script, default: 1 10 50', type=int, nargs='*', default=[ 1, 10, 50 ] )
+  args = arg_parser.parse_args()
+
+  sys.setrecursionlimit( 10000 )  # the parser and the tree walker recurse for each level of the nested infix
+
+  ast_list = [ ( str( i ), parse( script ) ) for i, script in enumerate( test_scripts() ) ]
+  print( 'Scripts: {0}'.format( len( ast_list ) ) )
+
+  start = time.perf_counter()
+  for _, script_ast in ast_list:
+    compile_ast( script_ast )
+  print( '{0:>30}: {1:10.1f} us/script'.format( 'compile', ( time.perf_counter() - start ) * 1000000 / len( ast_list ) ) )
+
+  optimized_list = [ ( 'o' + str( i ), parse( script, True ) ) for i, script in enumerate( test_scripts() ) ]
+  for name, runner_class in ( ( 'tree walker', Runner ), ( 'compiled', CompiledRunner ) ):
+    print( '{0:>30}: {1:10.1f} us/script'.format( name, timeit( runner_class, ast_list, args.rounds ) * 1000000 ) )
+    print( '{0:>30}: {1:10.1f} us/script'.format( name + ' (optimized AST)', timeit( runner_class, optimized_list, args.rounds ) * 1000000 ) )
+
+  print()
+  print( 'Loop, cnt = ( cnt + 1 ):' )
+  for count in args.loops:
+    script_ast = parse( 'cnt = 0\nwhile ( cnt < {0} ) do cnt = ( cnt + 1 )'.format( count ) )
+    for name, runner_class in ( ( 'tree walker', Runner ), ( 'compiled', CompiledRunner ) ):
+      elapsed = timeit( runner_class, [ ( 'loop{0}'.format( count ), script_ast ) ], 1, count * 10 )
+      print( '{0:>30}: {1:7} loops {2:10.3f} s {3:10.2f} us/loop'.format( name, count, elapsed, elapsed * 1000000 / count ) )
+
+  print()
+  print( 'Loop with constant expressions, AST / optimized AST:' )
+  for count in args.loops:
+    script = 'cnt = 0\nwhile ( cnt < ( {0} * 1 ) ) do begin()\ncnt = ( cnt + ( 2 - 1 ) )\nname = ( "part" . "-" )\nsize = [ ( 1024 * 1024 ), 512 ]\nif True then last = cnt\nend'.format( count )
+    for name, runner_class in ( ( 'tree walker', Runner ), ( 'compiled', CompiledRunner ) ):
+      elapsed = timeit( runner_class, [ ( 'const{0}'.format( count ), parse( script ) ) ], 1, count * 100 )
+      optimized = timeit( runner_class, [ ( 'oconst{0}'.format( count ), parse( script, True ) ) ], 1, count * 100 )
+      print( '{0:>30}: {1:7} loops {2:10.3f} s / {3:8.3f} s'.format( name, count, elapsed, optimized ) )
+
+  print()
+  print( 'Tracing, per step of the loop script:' )
+  count = args.loops[0]
+  script_ast = parse( 'cnt = 0\nwhile ( cnt < {0} ) do cnt = ( cnt + 1 )'.format( count ) )
+  for name, runner_class in ( ( 'tree eager logging', EagerLoggingRunner ), ( 'tree walker', Runner ), ( 'tree trace run', traced( Runner, TRACE_RUN ) ), ( 'tree trace step', traced( Runner, TRACE_STEP ) ),
+                              ( 'compiled', CompiledRunner ), ( 'compiled trace step', traced( CompiledRunner, TRACE_STEP ) ) ):
+    runner = runner_class( script_ast, 'trace{0}'.format( count ) )
+    start = time.perf_counter()
+    runner.run( count * 100 )
+    elapsed = time.perf_counter() - start
+    steps = count * 100 - runner.ttl
+    print( '{0:>30}: {1:7} steps {2:10.3f} s {3:10.3f} us/step'.format( name, steps, elapsed, elapsed * 1000000 / steps ) )
+
+  print()
+  print( 'Literals and nested infix, run to completion (compiled includes compiling) / in run( 500 )s:' )
+  for kind, size_list in ( ( 'array', args.sizes ), ( 'map', args.sizes ), ( 'infix', args.infix ) ):
+    for size in size_list:
+      script_ast = parse( literal_script( kind, size ) )
+      for name, runner_class in ( ( 'tree walker', Runner ), ( 'compiled', CompiledRunner ) ):
+        ast_hash = '{0}{1}'.format( kind, size )
+        elapsed = timeit( runner_class, [ ( ast_hash, script_ast ) ], 1, size * 10 )
+        runner = runner_class( script_ast, ast_hash )
+        start = time.perf_counter()
+        count = run_until_done( runner, 500 )
+        print( '{0:>30}: {1:5} {2:6} {3:10.2f} ms / {4:10.2f} ms {5:>5} runs'.format( name, kind, size, elapsed * 1000, ( time.perf_counter() - start ) * 1000, count or 'never' ) )
+
+  print()
+  print( '100 assignments of an array of maps, with bb[ 0 ] = cnt, pickled size:' )
+  for size in args.sizes:
+    for change in ( False, True ):
+      script_ast = parse( assign_script( size, change ) )
+      for name, runner_class in ( ( 'tree walker', Runner ), ( 'compiled', CompiledRunner ) ):
+        runner = runner_class( script_ast, 'assign{0}{1}'.format( size, change ) )
+        start = time.perf_counter()
+        runner.run( size * 100 + 10000 )
+        elapsed = time.perf_counter() - start
+        print( '{0:>30}: {1:6} {2:>5} {3:10.2f} ms {4:9} bytes'.format( name, size, str( change ), elapsed * 1000, len( pickle.dumps( runner.__getstate__() ) ) ) )
+
+  print()
+  print( 'Paused runner pickle, size and save + restore:' )
+  for depth in args.depths:
+    script_ast = parse( nested_script( depth ) )
+    for name, runner_class in ( ( 'tree walker', Runner ), ( 'compiled', CompiledRunner ) ):
+      size, elapsed = state_size( runner_class, script_ast, 500 )
+      print( '{0:>30}: {1:7} deep {2:7} bytes {3:10.1f} us'.format( name, depth, size, elapsed * 1000000 ) )
+
+  print()
+  print( 'Status of a paused function, walking the state / again without changes:' )
+  for depth in args.depths:
+    script_ast = parse( nested_script( depth ) )
+    for name, runner_class in ( ( 'tree walker', Runner ), ( 'compiled', CompiledRunner ) ):
+      walked, cached = status_time( runner_class, script_ast, 500 )
+      print( '{0:>30}: {1:7} deep {2:10.1f} us / {3:10.1f} us'.format( name, depth, walked * 1000000, cached * 1000000 ) )
+
+  print()
+  print( 'Stored job runner, paused with the part in a variable, bytes and dump + load:' )
+  for field_count in ( 10, 100, 1000 ):
+    script_ast = parse( 'pp = part.values\n' + nested_script( 10 ) )
+    for name, runner_class in ( ( 'tree walker', Runner ), ( 'compiled', CompiledRunner ) ):
+      runner = job_runner( runner_class, script_ast, field_count )
+      for compression in ( 'legacy', None, 'zlib', 'lzma' ):
+        size, elapsed = store_time( runner, compression, 100 )
+        print( '{0:>30}: {1:5} fields {2:>6} {3:8} bytes {4:10.1f} us'.format( name, field_count, str( compression ), size, elapsed * 1000000 ) )
+
+  print()
+  print( 'Resume a paused function:' )
+  for depth in args.depths:
+    script_ast = parse( nested_script( depth ) )
+    for name, runner_class in ( ( 'tree walker', Runner ), ( 'compiled', CompiledRunner ) ):
+      elapsed = resume( runner_class, script_ast, 500 )
+      print( '{0:>30}: {1:7} deep {2:10.1f} us/run()'.format( name, depth, elapsed * 1000000 ) )
+
+
+if __name__ == '__main__':
+  main()